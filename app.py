@@ -4,80 +4,203 @@ INCAR Generator Web Interface
 A Flask-based GUI for generating VASP INCAR files using the incar_core module.
 """
 
+import hashlib
 import os
+import re
+import stat
 import sys
+import tarfile
+import threading
+import time
+import zipfile
+from collections import namedtuple
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, Response, current_app, render_template, request, jsonify, send_file
 from flask_cors import CORS
-from io import BytesIO
+from io import BytesIO, StringIO
 import json
 
 # Import the consolidated incar core module (no external dependencies needed)
 from incar_core import (
     standard_incar, tasks_incar, u_value, j_value, mag_value,
-    get_available_tasks, get_task_params, get_standard_params
+    get_available_tasks, get_task_params, get_standard_params,
+    read_poscar_header, parse_poscar_header, dftu_params, magmom_from_header, LRUCache,
+    load_task_config, validate_task_config, check_neb_job, build_task_registry, build_suggestion_index,
+    get_rule_set, plan_parallel, kpoints_for, render_kpoints
 )
+from assets import AssetStore, init_assets
+from metrics import Metrics
 
 HAS_DATA_MODULE = True  # Now always True since we have the data embedded
 
+class UploadRequest(Request):
+    """Request that lets POSCAR uploads use their own size limit and stay in memory."""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_poscar' and current_app.config.get('POSCAR_UPLOAD_MAX_LENGTH'):
+            return current_app.config['POSCAR_UPLOAD_MAX_LENGTH']
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'upload_poscar':
+            # Parse uploaded structures from memory instead of spooling them to temp files
+            return BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)  # Enable CORS for all routes - fixes Safari issues
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Size limit for /api/upload-poscar (None: same as MAX_CONTENT_LENGTH). Archives
+# sent as the raw request body are read as a stream, so this can be much larger.
+app.config['POSCAR_UPLOAD_MAX_LENGTH'] = None
+
+# Per-route request metrics and internal phase timings, served on /metrics.
+# Set INCAR_METRICS=0 to turn them off (or METRICS.enabled = False at runtime).
+METRICS = Metrics(enabled=os.environ.get('INCAR_METRICS', '1').lower() not in ('0', 'false', 'no', 'off'))
+METRICS.init_app(app)
+
+# Seconds between checks of task_config.json for changes (0 turns reloading off)
+app.config['TASK_CONFIG_CHECK_INTERVAL'] = float(os.environ.get('INCAR_TASK_CONFIG_CHECK', '2'))
+# static/ and figs/ are read into memory once: fingerprinted URLs from
+# asset_url() are cached for a year, gzip/brotli variants are built here
+ASSETS = init_assets(app, {
+    'static': AssetStore(os.path.join(app.root_path, app.static_folder), 'static'),
+    'get_fig': AssetStore(Path(__file__).resolve().parent / 'figs', 'get_fig'),
+})
+
+# SQLite file of the user preset store (opened on first use)
+app.config['PRESET_DB'] = os.environ.get('INCAR_PRESET_DB', str(Path(__file__).resolve().parent / 'presets.db'))
+
+
+class TaskState(namedtuple('TaskState', [
+        'generation', 'stamp', 'categories', 'registry', 'mapping',
+        'available_tasks', 'task_keys', 'suggestions'])):
+    """Everything derived from one version of task_config.json, never modified once published."""
+    __slots__ = ()
+
+
+def build_task_state(task_categories, generation=0, stamp=None):
+    """Compile the built-in tasks and the task_config.json categories into a TaskState."""
+    # One registry holds every task; all task lookups go through its indexes
+    registry = build_task_registry(task_categories)
+
+    # Mapping from task key to readable name, kept for code that reads it directly
+    mapping = {}
+    for entry in registry.entries():
+        mapping[entry.key] = {'display': entry.display, 'params': entry.params}
+        if entry.category is not None:
+            mapping[entry.key]['category'] = entry.category
+
+    return TaskState(
+        generation=generation,
+        stamp=stamp,
+        categories=task_categories,
+        registry=registry,
+        mapping=mapping,
+        available_tasks=[mapping[key]['display'] for key in sorted(mapping.keys())],
+        task_keys={value['display'].lower().replace(' ', '_').replace('-', ''): key
+                   for key, value in mapping.items()},
+        # Autocomplete over task names and INCAR tags
+        suggestions=build_suggestion_index(registry),
+    )
+
+
+def _config_stamp(path):
+    """Return (mtime_ns, size, inode) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def install_task_state(state):
+    """Publish a new TaskState; requests already running keep the one they read."""
+    global TASK_STATE, TASK_CATEGORIES, TASK_REGISTRY, TASK_MAPPING, AVAILABLE_TASKS, TASK_KEYS, SUGGESTIONS
+    TASK_STATE = state
+    # Module-level names kept for code that imports them directly
+    TASK_CATEGORIES, TASK_REGISTRY, TASK_MAPPING = state.categories, state.registry, state.mapping
+    AVAILABLE_TASKS, TASK_KEYS, SUGGESTIONS = state.available_tasks, state.task_keys, state.suggestions
+
+
+class TaskConfigWatcher:
+    """Reload task_config.json in the background when it changes, keeping the old config if the new one is invalid."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.last_error = None
+        self._next_check = 0.0
+        self._failed_stamp = None
+        self._busy = threading.Lock()  # held while a check or reload runs
+
+    def maybe_reload(self, interval):
+        now = time.monotonic()
+        if interval <= 0 or now < self._next_check or not self._busy.acquire(blocking=False):
+            return
+        self._next_check = now + interval
+        stamp = _config_stamp(self.path)
+        if stamp is None or stamp in (TASK_STATE.stamp, self._failed_stamp):
+            self._busy.release()
+            return
+        threading.Thread(target=self._reload, args=(stamp,), name='task-config-reload',
+                         daemon=True).start()
+
+    def reload(self):
+        """Reload now, on the calling thread; returns True if a new config was installed."""
+        with self._busy:
+            stamp = _config_stamp(self.path)
+            if stamp is None:
+                return False
+            return self._load(stamp)
+
+    def _reload(self, stamp):
+        try:
+            self._load(stamp)
+        finally:
+            self._busy.release()
+
+    def _load(self, stamp):
+        with METRICS.phase('task_config_reload'):
+            try:
+                task_categories = load_task_config(self.path)
+                validate_task_config(task_categories)
+                state = build_task_state(task_categories, TASK_STATE.generation + 1, stamp)
+            except (OSError, ValueError) as e:
+                self._failed_stamp = stamp
+                self.last_error = f'{type(e).__name__}: {e}'
+                print(f"Warning: keeping the previous task configuration, {self.path} is invalid: {e}",
+                      file=sys.stderr)
+                return False
+        install_task_state(state)
+        self._failed_stamp = self.last_error = None
+        # Cached INCARs of older generations can no longer be requested
+        INCAR_CACHE.clear()
+        return True
+
 
 # Load task categories from configuration file
 config_path = Path(__file__).resolve().parent / 'task_config.json'
 if config_path.exists():
-    with open(config_path, 'r') as f:
-        TASK_CATEGORIES = json.load(f)
+    _initial_categories = load_task_config(str(config_path))
 else:
     print(f"Warning: task_config.json not found at {config_path}")
-    TASK_CATEGORIES = {}
-
-# Get available tasks from incar module
-# Create mapping from task key to readable name
-TASK_MAPPING = {}
-for key in tasks_incar.keys():
-    # Convert d_cal_something to Something
-    readable_name = key.replace('d_cal_', '')
-    # Handle special cases like vdwD3bj -> vdW-D3-BJ
-    if 'vdw' in readable_name.lower():
-        if 'bj' in readable_name:
-            readable_name = 'vdW-D3-BJ'
-        elif 'zero' in readable_name:
-            readable_name = 'vdW-D3-Zero'
-    elif 'ml' in readable_name.lower():
-        # ML cases: mltrain -> ML-Train
-        parts = readable_name.split('ml')
-        readable_name = 'ML-' + parts[1].capitalize()
-    else:
-        # Standard case: convert underscores to spaces and title case
-        readable_name = readable_name.replace('_', ' ').title()
-    
-    TASK_MAPPING[key] = {
-        'display': readable_name,
-        'params': tasks_incar[key]
-    }
-
-AVAILABLE_TASKS = [TASK_MAPPING[key]['display'] for key in sorted(TASK_MAPPING.keys())]
-TASK_KEYS = {value['display'].lower().replace(' ', '_').replace('-', ''): key for key, value in TASK_MAPPING.items()}
+    _initial_categories = {}
+install_task_state(build_task_state(_initial_categories, stamp=_config_stamp(config_path)))
+TASK_CONFIG_WATCHER = TaskConfigWatcher(config_path)
 
-# Merge categorized tasks from config file into TASK_MAPPING
-for category, tasks in TASK_CATEGORIES.items():
-    for task_name, task_data in tasks.items():
-        TASK_MAPPING[task_name] = {
-            'display': task_name,
-            'params': task_data['params'],
-            'category': category
-        }
 
-AVAILABLE_TASKS = [TASK_MAPPING[key]['display'] for key in sorted(TASK_MAPPING.keys())]
-TASK_KEYS = {value['display'].lower().replace(' ', '_').replace('-', ''): key for key, value in TASK_MAPPING.items()}
+@app.before_request
+def _watch_task_config():
+    TASK_CONFIG_WATCHER.maybe_reload(app.config['TASK_CONFIG_CHECK_INTERVAL'])
 
 
 @app.route('/')
 def index():
     """Render the main interface."""
-    return render_template('index.html', tasks=AVAILABLE_TASKS)
+    return render_template('index.html', tasks=TASK_STATE.available_tasks)
 
 
 @app.route('/test')
@@ -95,19 +218,8 @@ def simple_test():
 
 @app.route('/figs/<filename>')
 def get_fig(filename):
-    """Serve files from the figs directory."""
-    figs_path = Path(__file__).resolve().parent / 'figs'
-    file_path = figs_path / filename
-    
-    # Security check: ensure the requested file is within the figs directory
-    try:
-        file_path.resolve().relative_to(figs_path.resolve())
-    except ValueError:
-        return 'File not found', 404
-    
-    if file_path.exists():
-        return send_file(str(file_path), mimetype='image/jpeg')
-    return 'File not found', 404
+    """Serve files from the figs directory (only files known to the asset store)."""
+    return ASSETS['get_fig'].send(filename)
 
 
 @app.route('/api/task-categories', methods=['GET'])
@@ -116,12 +228,13 @@ def get_task_categories():
     # Maintain order: Functional, Correction, Model, System, Tasks
     category_order = ['Functional', 'Correction', 'Model', 'System', 'Tasks']
     ordered_categories = []
+    task_categories = TASK_STATE.categories
     
     for cat in category_order:
-        if cat in TASK_CATEGORIES:
+        if cat in task_categories:
             ordered_categories.append({
                 'name': cat,
-                'tasks': TASK_CATEGORIES[cat]
+                'tasks': task_categories[cat]
             })
     
     return jsonify({'categories': ordered_categories})
@@ -133,18 +246,31 @@ def get_task_params():
     data = request.json
     task_name = data.get('task', '').strip()
     
-    # Find the matching task in TASK_MAPPING
-    task_key = None
-    for key, value in TASK_MAPPING.items():
-        if value['display'].lower() == task_name.lower():
-            task_key = key
-            break
-    
-    if not task_key:
+    entry = TASK_STATE.registry.find_display(task_name)
+    if entry is None:
         return jsonify({'error': f'Invalid task: {task_name}'}), 400
     
-    params = TASK_MAPPING[task_key]['params']
-    return jsonify({'params': params})
+    return jsonify({'params': dict(entry.params)})
+
+
+# /api/autocomplete kinds: the web UI selects task_config.json presets
+AUTOCOMPLETE_KINDS = {'task': ('preset',), 'param': ('tag',), 'all': None}
+
+
+@app.route('/api/autocomplete', methods=['GET'])
+def autocomplete():
+    """Complete a task or INCAR tag name: ?q=<typed text>&kind=task|param|all&limit=10."""
+    query = request.args.get('q', '')
+    kind = request.args.get('kind', 'all')
+    if kind not in AUTOCOMPLETE_KINDS:
+        return jsonify({'error': f'Invalid kind: {kind}'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+
+    suggestions = TASK_STATE.suggestions.complete(query, limit, AUTOCOMPLETE_KINDS[kind])
+    return jsonify({
+        'query': query,
+        'suggestions': [s._asdict() for s in suggestions]
+    })
 
 
 @app.route('/api/standard-params', methods=['GET'])
@@ -159,70 +285,72 @@ def get_standard_params():
     return jsonify({'standard': filtered_standard})
 
 
-@app.route('/api/generate-incar', methods=['POST'])
-def generate_incar():
-    """Generate INCAR content based on selected parameters."""
-    data = request.json
-    selected_tasks = data.get('tasks', [])  # Changed from 'task' to 'tasks' (list)
-    custom_params = data.get('custom_params', {})
-    include_sections = data.get('include_sections', {})
-    
+# Rendered INCAR responses keyed by the canonical form of the request
+INCAR_CACHE = LRUCache(maxsize=512)
+
+
+def _canonical_incar_request(selected_tasks, include_sections, custom_params):
+    """Return a hashable, normalized form of a generate-incar request (case and whitespace folded)."""
+    tasks = []
+    for selected_task in selected_tasks or []:
+        task = ' '.join(str(selected_task).split()).lower()
+        if task and task not in tasks:
+            tasks.append(task)
+
+    sections = sorted(
+        section for section, include in (include_sections or {}).items()
+        if include and section in standard_incar
+    )
+
+    custom = {}
+    for key, value in (custom_params or {}).items():
+        key = str(key).strip().upper()
+        if key:  # Only add non-empty keys
+            custom[key] = ' '.join(str('' if value is None else value).split())
+
+    return tuple(tasks), tuple(sections), tuple(sorted(custom.items()))
+
+
+def _build_incar_response(canonical_request, registry):
+    """Build the generate-incar payload and its ETag for a canonical request."""
+    selected_tasks, sections, custom_items = canonical_request
+
     # Track parameters by source for organized output
     task_params_by_name = {}  # Dictionary to keep params organized by task
-    standard_params_by_section = {}
-    final_custom_params = {}
-    
-    # Add selected standard parameter sections
-    for section, include in include_sections.items():
-        if include and section in standard_incar:
-            standard_params_by_section[section] = standard_incar[section]
-    
+    standard_params_by_section = {section: standard_incar[section] for section in sections}
+    final_custom_params = dict(custom_items)
+
     # Separate actual Tasks from Model/System items
     actual_task_params = {}  # Parameters from Tasks category
     model_params = {}  # Parameters from Model/System/Correction categories
-    selected_task_names = []
-    
+
     for selected_task in selected_tasks:
-        if selected_task:
-            # Find matching task and determine its category
-            task_key = None
-            category = None
-            for key, value in TASK_MAPPING.items():
-                if value['display'].lower() == selected_task.lower():
-                    task_key = key
-                    category = value.get('category')
-                    selected_task_names.append(value['display'])
-                    break
-            
-            if task_key:
-                params = TASK_MAPPING[task_key]['params']
-                if category == 'Tasks':
-                    # Store actual task parameters separately for priority
-                    actual_task_params[value['display']] = params
-                else:
-                    # Store model/system/correction parameters
-                    model_params[value['display']] = params
-    
+        # Find matching task and determine its category
+        entry = registry.find_display(selected_task)
+        if entry is not None:
+            if entry.category == 'Tasks':
+                # Store actual task parameters separately for priority
+                actual_task_params[entry.display] = entry.params
+            else:
+                # Store model/system/correction parameters
+                model_params[entry.display] = entry.params
+
     # Build task_params_by_name with model params first, then actual task params (so tasks override)
     task_params_by_name.update(model_params)
     task_params_by_name.update(actual_task_params)
-    
-    # Add/override with custom parameters
-    for key, value in custom_params.items():
-        if key.strip():  # Only add non-empty keys
-            final_custom_params[key.strip()] = value.strip()
-    
+
     # Generate INCAR content with organized structure (separated by task)
-    incar_content = _generate_incar_content_organized(
-        task_params_by_name, 
-        standard_params_by_section, 
-        final_custom_params
-    )
-    
+    with METRICS.phase('render'):
+        incar_content = _generate_incar_content_organized(
+            task_params_by_name,
+            standard_params_by_section,
+            final_custom_params
+        )
+
     # Count total params
     task_params_count = sum(len(v) for v in task_params_by_name.values())
     total_params = task_params_count + sum(len(v) for v in standard_params_by_section.values()) + len(final_custom_params)
-    
+
     # Merge all params for return
     all_params = {}
     for task_params in task_params_by_name.values():
@@ -230,14 +358,282 @@ def generate_incar():
     all_params.update(final_custom_params)
     for section_params in standard_params_by_section.values():
         all_params.update(section_params)
-    
-    return jsonify({
+
+    # Conflicts between the parameters, checked in the order they take effect
+    with METRICS.phase('validate'):
+        layers = [('standard', 'standard', {k: v for params in standard_params_by_section.values()
+                                            for k, v in params.items()})]
+        layers += [('task', name, params) for name, params in task_params_by_name.items()]
+        layers.append(('custom', 'custom parameters', final_custom_params))
+        findings = get_rule_set().check_layers(layers)
+
+    payload = {
         'incar_content': incar_content,
         'param_count': total_params,
-        'params': all_params
+        'params': all_params,
+        'validation': [finding._asdict() for finding in findings]
+    }
+    etag = hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+    return payload, etag
+
+
+@app.route('/api/generate-incar', methods=['POST'])
+def generate_incar():
+    """Generate INCAR content based on selected parameters, cached and answered with an ETag."""
+    data = request.json
+    state = TASK_STATE
+    custom_params = data.get('custom_params', {})
+    if data.get('presets'):
+        # Saved user presets (by id) add their parameters; custom params still win
+        try:
+            custom_params = _preset_params(data['presets'], custom_params)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 400
+    canonical_request = _canonical_incar_request(
+        data.get('tasks', []),  # Changed from 'task' to 'tasks' (list)
+        data.get('include_sections', {}),
+        custom_params
+    )
+    payload, etag = INCAR_CACHE.get_or_compute(
+        (state.generation, canonical_request),
+        lambda: _build_incar_response(canonical_request, state.registry)
+    )
+
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    return response
+
+
+class _ZipStream:
+    """Write-only, unseekable file object that hands zipfile output over in chunks."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _structure_params(header, selected_tasks, registry):
+    """Return the LDAUL/LDAUU/LDAUJ and MAGMOM values that the selected tasks need."""
+    params = {}
+    for selected_task in selected_tasks:
+        entry = registry.find_display(str(selected_task).strip())
+        if entry is None:
+            continue
+        if entry.params.get('LDAU') == 'T':
+            params.update(dftu_params(header.elements))
+        if entry.params.get('ISPIN') == '2':
+            params['MAGMOM'] = magmom_from_header(header)
+    return params
+
+
+@app.route('/api/generate-incar-batch', methods=['POST'])
+def generate_incar_batch():
+    """Generate many INCARs (and KPOINTS) in one request and stream them back as a ZIP."""
+    data = request.json or {}
+    state = TASK_STATE
+    configs = data.get('configs')
+    if not isinstance(configs, list) or not configs:
+        return jsonify({'error': 'No configurations provided'}), 400
+
+    # Validate everything up front: once streaming starts, errors can no longer be reported
+    requests_by_name = []
+    used_names = set()
+    for index, config in enumerate(configs):
+        if not isinstance(config, dict):
+            return jsonify({'error': f'Configuration {index} is not an object'}), 400
+
+        name = re.sub(r'[^A-Za-z0-9_.+-]+', '_', str(config.get('name') or '')).strip('._')
+        name = name or f'config_{index + 1:04d}'
+        unique_name, suffix = name, 1
+        while unique_name in used_names:
+            suffix += 1
+            unique_name = f'{name}_{suffix}'
+        used_names.add(unique_name)
+
+        tasks = config.get('tasks', [])
+        if not isinstance(tasks, list) or not all(isinstance(task, str) for task in tasks):
+            return jsonify({'error': f'{unique_name}: tasks must be a list of task names'}), 400
+        for field in ('custom_params', 'include_sections'):
+            if config.get(field) is not None and not isinstance(config[field], dict):
+                return jsonify({'error': f'{unique_name}: {field} must be an object'}), 400
+        if config.get('poscar') is not None and not isinstance(config['poscar'], str):
+            return jsonify({'error': f'{unique_name}: poscar must be the POSCAR text'}), 400
+        custom_params = {}
+        header = None
+        if config.get('poscar'):
+            try:
+                with METRICS.phase('poscar_parse'):
+                    header = parse_poscar_header(StringIO(config['poscar']))
+            except ValueError as e:
+                return jsonify({'error': f'{unique_name}: {e}'}), 400
+            with METRICS.phase('derive'):
+                custom_params.update(_structure_params(header, tasks, state.registry))
+        custom_params.update(config.get('custom_params') or {})
+
+        kpoints_content = None
+        if config.get('kpoints'):
+            if header is None:
+                return jsonify({'error': f'{unique_name}: KPOINTS needs a POSCAR'}), 400
+            try:
+                kspacing, style = _kpoints_options(config['kpoints'])
+                incar = _request_incar_params({'tasks': tasks, 'custom_params': custom_params})
+                kpoints_content = render_kpoints(kpoints_for(header, incar, kspacing, style))
+            except ValueError as e:
+                return jsonify({'error': f'{unique_name}: {e}'}), 400
+
+        requests_by_name.append((unique_name, _canonical_incar_request(
+            tasks, config.get('include_sections') or {}, custom_params), kpoints_content))
+
+    def generate():
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, canonical_request, kpoints_content in requests_by_name:
+                payload, _ = INCAR_CACHE.get_or_compute(
+                    (state.generation, canonical_request),
+                    lambda: _build_incar_response(canonical_request, state.registry)
+                )
+                archive.writestr(f'{name}/INCAR', payload['incar_content'] + '\n')
+                if kpoints_content is not None:
+                    archive.writestr(f'{name}/KPOINTS', kpoints_content)
+                yield stream.drain()
+        yield stream.drain()
+
+    return Response(generate(), mimetype='application/zip', headers={
+        'Content-Disposition': 'attachment; filename=INCARs.zip'
     })
 
 
+# ============================================================================
+# User presets (SQLite store, see preset_store.py)
+# ============================================================================
+
+_preset_store = None
+_preset_store_lock = threading.Lock()
+
+
+def get_preset_store():
+    """Return the preset store, opening app.config['PRESET_DB'] on first use."""
+    global _preset_store
+    if _preset_store is None:
+        with _preset_store_lock:
+            if _preset_store is None:
+                from preset_store import PresetStore
+                _preset_store = PresetStore(app.config['PRESET_DB'])
+    return _preset_store
+
+
+def _preset_params(preset_ids, custom_params):
+    """Merge the params of the given presets (in order) under custom_params."""
+    if not isinstance(preset_ids, list):
+        preset_ids = [preset_ids]
+    try:
+        preset_ids = [int(preset_id) for preset_id in preset_ids]
+    except (TypeError, ValueError):
+        raise LookupError('Preset ids must be integers')
+    presets = get_preset_store().get_many(preset_ids)
+    missing = [str(preset_id) for preset_id in preset_ids if preset_id not in presets]
+    if missing:
+        raise LookupError(f"Unknown preset(s): {', '.join(missing)}")
+    params = {}
+    for preset_id in preset_ids:
+        params.update(presets[preset_id]['params'])
+    params.update(custom_params or {})
+    return params
+
+
+@app.route('/api/presets', methods=['GET'])
+def list_presets():
+    """List saved presets a page at a time, filtered by owner, project, category, name prefix and tag."""
+    tags = {}
+    for tag_filter in request.args.getlist('tag'):
+        tag, sep, value = tag_filter.partition('=')
+        if not tag.strip():
+            return jsonify({'error': f'Invalid tag filter: {tag_filter}'}), 400
+        tags[tag] = value if sep else None
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+
+    presets, total = get_preset_store().query(
+        owner=request.args.get('owner'),
+        project=request.args.get('project'),
+        category=request.args.get('category'),
+        name=request.args.get('name'),
+        tags=tags,
+        limit=per_page,
+        offset=(page - 1) * per_page
+    )
+    return jsonify({
+        'presets': presets,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page
+    })
+
+
+@app.route('/api/presets', methods=['POST'])
+def create_preset():
+    """Save a preset: {"name", "params", "owner", "project", "category", "description"}."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        preset = get_preset_store().create(
+            data.get('name'), data.get('params'),
+            **{field: data[field] for field in ('owner', 'project', 'category', 'description')
+               if data.get(field) is not None}
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(preset), 201
+
+
+@app.route('/api/presets/<int:preset_id>', methods=['GET'])
+def get_preset(preset_id):
+    """Return one preset."""
+    preset = get_preset_store().get(preset_id)
+    if preset is None:
+        return jsonify({'error': f'Preset {preset_id} not found'}), 404
+    return jsonify(preset)
+
+
+@app.route('/api/presets/<int:preset_id>', methods=['PUT', 'PATCH'])
+def update_preset(preset_id):
+    """Change the given fields of a preset (params are replaced as a whole)."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        preset = get_preset_store().update(preset_id, **data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if preset is None:
+        return jsonify({'error': f'Preset {preset_id} not found'}), 404
+    return jsonify(preset)
+
+
+@app.route('/api/presets/<int:preset_id>', methods=['DELETE'])
+def delete_preset(preset_id):
+    """Delete a preset."""
+    if not get_preset_store().delete(preset_id):
+        return jsonify({'error': f'Preset {preset_id} not found'}), 404
+    return jsonify({'success': True})
+
+
 @app.route('/api/download-incar', methods=['POST'])
 def download_incar():
     """Download INCAR file."""
@@ -343,46 +739,141 @@ def health():
     return jsonify({'status': 'ok'})
 
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request and phase metrics of this process in the Prometheus text format."""
+    if not METRICS.enabled:
+        return 'Metrics are disabled', 404
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Readiness of this process: set once the module has loaded the task
+# registry, cleared by serve.py when a worker starts a graceful shutdown
+SERVER_STATE = {'ready': False, 'draining': False}
+
+
+def mark_draining():
+    """Stop reporting ready so load balancers send new requests elsewhere."""
+    SERVER_STATE['draining'] = True
+
+
+@app.route('/ready')
+def ready():
+    """Readiness check: 200 only when this worker can serve requests."""
+    state = TASK_STATE
+    checks = {
+        'task_registry': len(state.registry) > 0,
+        'task_config': bool(state.categories),
+        'templates': os.path.isdir(app.template_folder and os.path.join(app.root_path, app.template_folder)),
+    }
+    is_ready = SERVER_STATE['ready'] and not SERVER_STATE['draining'] and all(checks.values())
+    return jsonify({
+        'status': 'ready' if is_ready else 'unavailable',
+        'draining': SERVER_STATE['draining'],
+        'checks': checks,
+        'task_config': {
+            'generation': state.generation,
+            'reload_error': TASK_CONFIG_WATCHER.last_error
+        },
+        'pid': os.getpid()
+    }), 200 if is_ready else 503
+
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """Report the size and hit/miss counters of the server-side caches."""
+    return jsonify({
+        'poscar': POSCAR_CACHE.stats(),
+        'incar': INCAR_CACHE.stats(),
+        'assets': {endpoint: store.stats() for endpoint, store in ASSETS.items()}
+    })
+
+
+def _cache_metrics():
+    """Expose the cache-stats counters on /metrics."""
+    caches = {'poscar': POSCAR_CACHE.stats(), 'incar': INCAR_CACHE.stats()}
+    return [
+        (name, metric_type, help_text,
+         [({'cache': cache}, stats[field]) for cache, stats in caches.items()])
+        for name, field, metric_type, help_text in (
+            ('cache_entries', 'size', 'gauge', 'Entries held by the cache.'),
+            ('cache_hits_total', 'hits', 'counter', 'Lookups answered from the cache.'),
+            ('cache_misses_total', 'misses', 'counter', 'Lookups that had to compute the value.'),
+        )
+    ]
+
+
+METRICS.add_collector(_cache_metrics)
+
+
+# Possible POSCAR locations relative to the server's working directory
+POSCAR_PATHS = ['POSCAR', './POSCAR', '../POSCAR', '../../POSCAR']
+
+# Parsed POSCAR analyses keyed by (resolved path, mtime_ns, size), shared by
+# all POSCAR endpoints so back-to-back calls only parse the file once
+POSCAR_CACHE = LRUCache(maxsize=256)
+
+
+def _analyze_poscar():
+    """Find the POSCAR and return its cached species, counts, LDAU* and MAGMOM analysis, or None."""
+    with METRICS.phase('poscar_lookup'):
+        return _find_poscar_analysis()
+
+
+def _find_poscar_analysis():
+    for path in POSCAR_PATHS:
+        resolved = os.path.realpath(path)
+        try:
+            st = os.stat(resolved)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+
+        key = (resolved, st.st_mtime_ns, st.st_size)
+        analysis = POSCAR_CACHE.get(key)
+        if analysis is None:
+            try:
+                with METRICS.phase('poscar_parse'):
+                    header = read_poscar_header(resolved)
+            except (OSError, ValueError):
+                continue
+            analysis = _analysis_from_header(header)
+            analysis['header'] = header
+            POSCAR_CACHE.put(key, analysis)
+        return analysis
+    return None
+
+
+def _analysis_from_header(header):
+    """Return the species, counts and LDAU*/MAGMOM strings for a POSCAR header."""
+    with METRICS.phase('derive'):
+        element_counts = header.element_counts()
+        analysis = {
+            'elements': list(element_counts),
+            'element_counts': element_counts,
+            'total_atoms': header.total_atoms,
+            'MAGMOM': magmom_from_header(header)
+        }
+        analysis.update(dftu_params(header.elements))
+    return analysis
+
+
 @app.route('/api/read-poscar', methods=['POST'])
 def read_poscar():
     """Read POSCAR file and return element information."""
     try:
-        # Try importing ASE to read POSCAR
-        from ase.io import read
-        
-        # Check multiple possible POSCAR locations
-        poscar_paths = ['POSCAR', './POSCAR', '../POSCAR', '../../POSCAR']
-        poscar_content = None
-        
-        for path in poscar_paths:
-            if os.path.isfile(path):
-                try:
-                    atoms = read(path, format='vasp')
-                    elements = atoms.get_chemical_symbols()
-                    
-                    # Count unique elements
-                    unique_elements = []
-                    element_counts = {}
-                    for elem in elements:
-                        if elem not in element_counts:
-                            unique_elements.append(elem)
-                            element_counts[elem] = 1
-                        else:
-                            element_counts[elem] += 1
-                    
-                    return jsonify({
-                        'success': True,
-                        'elements': unique_elements,
-                        'element_counts': element_counts,
-                        'total_atoms': len(elements)
-                    })
-                except Exception as e:
-                    continue
-        
-        return jsonify({'success': False, 'error': 'POSCAR file not found'}), 404
-    
-    except ImportError:
-        return jsonify({'success': False, 'error': 'ASE module not installed'}), 400
+        analysis = _analyze_poscar()
+        if analysis is None:
+            return jsonify({'success': False, 'error': 'POSCAR file not found'}), 404
+
+        return jsonify({
+            'success': True,
+            'elements': analysis['elements'],
+            'element_counts': analysis['element_counts'],
+            'total_atoms': analysis['total_atoms']
+        })
+
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -393,108 +884,259 @@ def calculate_dftu():
     try:
         if not HAS_DATA_MODULE:
             return jsonify({'success': False, 'error': 'data module not available'}), 400
-        
-        from ase.io import read
-        
-        poscar_paths = ['POSCAR', './POSCAR', '../POSCAR', '../../POSCAR']
-        
-        for path in poscar_paths:
-            if os.path.isfile(path):
-                try:
-                    atoms = read(path, format='vasp')
-                    elements = atoms.get_chemical_symbols()
-                    
-                    unique_elements = []
-                    ldaul, u, j = [], [], []
-                    
-                    for element in elements:
-                        if element not in unique_elements:
-                            unique_elements.append(element)
-                            if element in u_value:
-                                ldaul.append(2)  # Apply DFT+U to this element
-                                u.append(u_value[element])
-                                j.append(j_value.get(element, 0))
-                            else:
-                                ldaul.append(-1)  # No DFT+U applied
-                                u.append(0)
-                                j.append(0)
-                    
-                    return jsonify({
-                        'success': True,
-                        'LDAUL': '  '.join(map(str, ldaul)),
-                        'LDAUU': '  '.join(map(str, u)),
-                        'LDAUJ': '  '.join(map(str, j))
-                    })
-                except Exception as e:
-                    continue
-        
-        return jsonify({'success': False, 'error': 'POSCAR file not found'}), 404
-    
+
+        analysis = _analyze_poscar()
+        if analysis is None:
+            return jsonify({'success': False, 'error': 'POSCAR file not found'}), 404
+
+        return jsonify({
+            'success': True,
+            'LDAUL': analysis['LDAUL'],
+            'LDAUU': analysis['LDAUU'],
+            'LDAUJ': analysis['LDAUJ']
+        })
+
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
 @app.route('/api/calculate-magmom', methods=['POST'])
 def calculate_magmom():
-    """Calculate MAGMOM based on POSCAR elements."""
+    """Calculate MAGMOM based on POSCAR elements, with optional per-site overrides and element moments."""
     try:
         if not HAS_DATA_MODULE:
             return jsonify({'success': False, 'error': 'data module not available'}), 400
-        
-        from ase.io import read
-        
-        poscar_paths = ['POSCAR', './POSCAR', '../POSCAR', '../../POSCAR']
-        
-        for path in poscar_paths:
-            if os.path.isfile(path):
-                try:
-                    atoms = read(path, format='vasp')
-                    symbols = atoms.get_chemical_symbols()
-                    
-                    element_counts = {}
-                    for symbol in symbols:
-                        if symbol in element_counts:
-                            element_counts[symbol] += 1
-                        else:
-                            element_counts[symbol] = 1
-                    
-                    magmom_list = []
-                    for symbol, count in element_counts.items():
-                        magmom_per_atom = mag_value.get(symbol, 0.0)
-                        magmom_list.append(f"{count}*{magmom_per_atom}")
-                    
-                    magmom_str = "  ".join(magmom_list)
-                    
-                    return jsonify({
-                        'success': True,
-                        'MAGMOM': magmom_str
-                    })
-                except Exception as e:
-                    continue
-        
-        return jsonify({'success': False, 'error': 'POSCAR file not found'}), 404
-    
+
+        analysis = _analyze_poscar()
+        if analysis is None:
+            return jsonify({'success': False, 'error': 'POSCAR file not found'}), 404
+
+        data = request.get_json(silent=True) or {}
+        if data.get('overrides') or data.get('moments'):
+            overrides = {int(k): float(v) for k, v in (data.get('overrides') or {}).items()}
+            if any(not 0 <= k < analysis['total_atoms'] for k in overrides):
+                return jsonify({'success': False, 'error': 'Site index out of range'}), 400
+            with METRICS.phase('derive'):
+                magmom = magmom_from_header(analysis['header'], overrides, data.get('moments'))
+        else:
+            magmom = analysis['MAGMOM']
+
+        return jsonify({
+            'success': True,
+            'MAGMOM': magmom
+        })
+
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+ARCHIVE_MIMETYPES = {
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip',
+    'application/x-tar': 'tar',
+    'application/gzip': 'tar',
+    'application/x-gzip': 'tar',
+    'application/x-bzip2': 'tar',
+    'application/x-xz': 'tar',
+}
+
+
+def _is_poscar_name(name):
+    """Whether an archive member looks like a structure file (POSCAR, POSCAR_1, *.vasp, CONTCAR)."""
+    base = os.path.basename(name)
+    return base.startswith(('POSCAR', 'CONTCAR')) or base.endswith('.vasp')
+
+
+def _archive_kind(head):
+    """Detect a zip or (compressed) tar archive from its first bytes, or return None."""
+    if head.startswith(b'PK\x03\x04'):
+        return 'zip'
+    if head.startswith((b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')) or head[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+
+def _analyze_upload(name, fileobj):
+    """Parse one uploaded POSCAR header into a per-structure result."""
+    try:
+        result = {'name': name, 'success': True}
+        with METRICS.phase('poscar_parse'):
+            header = parse_poscar_header(fileobj)
+        result.update(_analysis_from_header(header))
+        return result
+    except ValueError as e:
+        return {'name': name, 'success': False, 'error': str(e)}
+
+
+def _analyze_archive(kind, fileobj, prefix=''):
+    """Yield results for every structure file in a tar (read as a stream) or zip archive."""
+    if kind == 'zip':
+        if not fileobj.seekable():
+            fileobj = BytesIO(fileobj.read())
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_poscar_name(info.filename):
+                    with archive.open(info) as member:
+                        yield _analyze_upload(prefix + info.filename, member)
+    else:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile() and _is_poscar_name(member.name):
+                    yield _analyze_upload(prefix + member.name, archive.extractfile(member))
+
+
+@app.route('/api/upload-poscar', methods=['POST'])
+def upload_poscar():
+    """Analyze uploaded POSCARs or zip/tar archives of them: elements, DFT+U and MAGMOM per structure."""
+    try:
+        results = []
+        if request.files:
+            for field in request.files:
+                for upload in request.files.getlist(field):
+                    name = upload.filename or field
+                    head = upload.stream.read(512)
+                    upload.stream.seek(0)
+                    kind = _archive_kind(head)
+                    if kind:
+                        results.extend(_analyze_archive(kind, upload.stream, prefix=name + ':'))
+                    else:
+                        results.append(_analyze_upload(name, upload.stream))
+        elif request.mimetype in ARCHIVE_MIMETYPES:
+            results.extend(_analyze_archive(ARCHIVE_MIMETYPES[request.mimetype], request.stream))
+        elif request.content_length or request.headers.get('Transfer-Encoding'):
+            results.append(_analyze_upload('POSCAR', request.stream))
+        else:
+            return jsonify({'success': False, 'error': 'No POSCAR uploaded'}), 400
+
+        if not results:
+            return jsonify({'success': False, 'error': 'No POSCAR found in upload'}), 400
+        return jsonify({'success': True, 'count': len(results), 'structures': results})
+
+    except (tarfile.TarError, zipfile.BadZipFile) as e:
+        return jsonify({'success': False, 'error': f'Invalid archive: {e}'}), 400
+
+
+def _request_header(data):
+    """Return (header, None) for the request's POSCAR text or the server POSCAR, else (None, error response)."""
+    if data.get('poscar'):
+        try:
+            with METRICS.phase('poscar_parse'):
+                return parse_poscar_header(str(data['poscar']).splitlines()), None
+        except ValueError as e:
+            return None, (jsonify({'success': False, 'error': str(e)}), 400)
+    analysis = _analyze_poscar()
+    if analysis is None:
+        return None, (jsonify({'success': False, 'error': 'POSCAR file not found'}), 404)
+    return analysis['header'], None
+
+
+def _request_incar_params(data):
+    """Merge the parameters in the order they take effect: standard, selected tasks, custom; raises ValueError."""
+    tasks = data.get('tasks') or []
+    if not isinstance(tasks, list) or not all(isinstance(task, str) for task in tasks):
+        raise ValueError('tasks must be a list of task names')
+    custom_params = data.get('custom_params') or {}
+    if not isinstance(custom_params, dict):
+        raise ValueError('custom_params must be an object')
+    registry = TASK_STATE.registry
+    incar = {}
+    for section_params in standard_incar.values():
+        incar.update(section_params)
+    for task in tasks:
+        entry = registry.find_display(task.strip())
+        if entry is not None:
+            incar.update(entry.params)
+    incar.update(custom_params)
+    return incar
+
+
+@app.route('/api/plan-parallel', methods=['POST'])
+def plan_parallel_settings():
+    """Recommend NCORE, KPAR and NPAR for the POSCAR and the selected tasks."""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    try:
+        layout = {key: int(data[key]) if data.get(key) not in (None, '') else None
+                  for key in ('cores_per_node', 'nodes', 'nkpts', 'nbands')}
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'cores_per_node, nodes, nkpts and nbands must be integers'}), 400
+    if not layout['cores_per_node']:
+        return jsonify({'success': False, 'error': 'cores_per_node is required'}), 400
+
+    header, error = _request_header(data)
+    if error is not None:
+        return error
+
+    try:
+        plan = plan_parallel(header, layout['cores_per_node'], layout['nodes'] or 1,
+                             nkpts=layout['nkpts'], nbands=layout['nbands'], incar=_request_incar_params(data))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'params': plan.params,
+        'NCORE': plan.ncore,
+        'KPAR': plan.kpar,
+        'NPAR': plan.npar,
+        'NBANDS': plan.nbands,
+        'nkpts': plan.nkpts,
+        'cores': plan.cores,
+        'notes': plan.notes
+    })
+
+
+def _kpoints_options(options):
+    """Return (kspacing, style) from a {"kspacing", "style"} object; raises ValueError."""
+    options = options if isinstance(options, dict) else {}
+    kspacing = options.get('kspacing')
+    try:
+        kspacing = float(kspacing) if kspacing not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('kspacing must be a number')
+    return kspacing, options.get('style')
+
+
+@app.route('/api/generate-kpoints', methods=['POST'])
+def generate_kpoints():
+    """Generate an automatic-mesh KPOINTS for the POSCAR and the selected tasks."""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    header, error = _request_header(data)
+    if error is not None:
+        return error
+    try:
+        kspacing, style = _kpoints_options(data)
+        kpoints = kpoints_for(header, _request_incar_params(data), kspacing, style)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'kpoints_content': render_kpoints(kpoints),
+        'style': kpoints.style,
+        'mesh': kpoints.mesh,
+        'kspacing': kpoints.kspacing,
+        'notes': kpoints.notes
+    })
+
+
 @app.route('/api/calculate-neb-images', methods=['POST'])
 def calculate_neb_images():
-    """Count NEB image folders and calculate IMAGE number."""
+    """Count NEB image folders, calculate the IMAGES number and check the image POSCARs against 00."""
     try:
         # Look for folders named 00, 01, 02, etc.
-        folders = [f for f in os.listdir('.') if os.path.isdir(f)]
-        image_folders = [f for f in folders if f.isdigit() and len(f) == 2]
+        check = check_neb_job('.')
         
-        if image_folders:
-            image_count = len(image_folders) - 2  # Total folders minus initial and final
-            if image_count < 0:
-                image_count = 0
+        if check.folders:
+            image_count = max(check.images or 0, 0)  # Total folders minus initial and final
             
             return jsonify({
                 'success': True,
                 'IMAGES': str(image_count),
-                'folder_count': len(image_folders)
+                'folder_count': len(check.folders),
+                'consistent': check.ok,
+                'errors': check.errors
             })
         else:
             return jsonify({'success': False, 'error': 'No image folders found (00, 01, 02...)'})
@@ -503,5 +1145,8 @@ def calculate_neb_images():
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+SERVER_STATE['ready'] = True
+
+
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5001)
@@ -0,0 +1,230 @@
+"""
+Fingerprinted, precompressed static files for the INCAR Generator web interface.
+
+Every file of an asset directory (static/, figs/) is read once when the
+store is built. Its sha256 gives it a fingerprinted name such as
+css/style.3f2a9c1e07b4.css. Text files also get gzip variants, and
+brotli variants when the optional brotli module is installed. All of
+this is kept in memory, so a request is served from a dict lookup
+without touching the disk.
+
+Fingerprinted URLs (from asset_url() in the templates) change whenever
+the content does, so they are sent with
+Cache-Control: public, max-age=<1 year>, immutable and browsers never
+ask for them again. Plain URLs keep working: they are sent with
+Cache-Control: no-cache and a strong ETag plus Last-Modified, so a
+browser revalidates them and gets a 304 while the file is unchanged.
+
+Meant for the few hundred KB of UI files. When the app runs in debug
+mode, a changed file is picked up on its next request.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from collections import namedtuple
+
+from flask import Response, abort, current_app, request, url_for
+
+# One year, the longest lifetime caches honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Types worth compressing; images such as JPEG and PNG are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml', 'application/wasm')
+
+_FINGERPRINT_LENGTH = 12
+_FINGERPRINTED = re.compile(r'^(.*)\.([0-9a-f]{%d})(\.[^./]+)$' % _FINGERPRINT_LENGTH)
+
+
+class Asset(namedtuple('Asset', ['name', 'stamp', 'digest', 'mimetype', 'mtime', 'data', 'variants'])):
+    """One file of an asset directory.
+
+    stamp is (mtime_ns, size) when it was read, digest the sha256 of data
+    and variants maps a content coding ('br', 'gzip') to compressed bytes.
+    """
+    __slots__ = ()
+
+    @property
+    def fingerprinted_name(self):
+        """Return the name with the content hash before the extension: js/main.<hash>.js."""
+        root, ext = os.path.splitext(self.name)
+        return f'{root}.{self.digest[:_FINGERPRINT_LENGTH]}{ext}'
+
+
+def _compressors():
+    """Return [(coding, compress)] in order of preference; brotli only if installed."""
+    import gzip
+    compressors = []
+    try:
+        import brotli
+        compressors.append(('br', lambda data: brotli.compress(data, quality=11)))
+    except ImportError:
+        pass
+    compressors.append(('gzip', lambda data: gzip.compress(data, 9, mtime=0)))
+    return compressors
+
+
+def _is_compressible(mimetype):
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+class AssetStore:
+    """In-memory copy of one directory of static files, served by a Flask endpoint.
+
+    endpoint is the name of the view that serves the directory; it must
+    take the file name as its filename argument.
+    """
+
+    def __init__(self, directory, endpoint, min_compress_size=512):
+        self.directory = os.path.realpath(str(directory))
+        self.endpoint = endpoint
+        self.min_compress_size = min_compress_size
+        self.compressors = _compressors()
+        self._lock = threading.Lock()
+        self.assets = {}         # name -> Asset
+        self.fingerprints = {}   # fingerprinted name -> name
+        self.scan()
+
+    def scan(self):
+        """(Re)read every file below the directory, skipping hidden ones."""
+        assets = {}
+        if os.path.isdir(self.directory):
+            for dirpath, dirnames, filenames in os.walk(self.directory):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+                for filename in sorted(filenames):
+                    if filename.startswith('.'):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                    asset = self._load(name)
+                    if asset is not None:
+                        assets[name] = asset
+        with self._lock:
+            self.assets = assets
+            self.fingerprints = {asset.fingerprinted_name: name for name, asset in assets.items()}
+
+    def _load(self, name):
+        """Read one file and build its compressed variants, or return None if it is gone."""
+        path = os.path.join(self.directory, *name.split('/'))
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                data = f.read()
+        except OSError:
+            return None
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        variants = {}
+        if len(data) >= self.min_compress_size and _is_compressible(mimetype):
+            for coding, compress in self.compressors:
+                compressed = compress(data)
+                # A variant that saves almost nothing is not worth a Vary header
+                if len(compressed) < len(data) * 0.9:
+                    variants[coding] = compressed
+        return Asset(name, (st.st_mtime_ns, st.st_size), hashlib.sha256(data).hexdigest(),
+                     mimetype, st.st_mtime, data, variants)
+
+    def _refresh(self, name):
+        """Re-read name if it changed on disk (debug mode only)."""
+        asset = self.assets.get(name)
+        path = os.path.realpath(os.path.join(self.directory, *name.split('/')))
+        if asset is None and (not path.startswith(self.directory + os.sep)
+                              or any(part.startswith('.') for part in name.split('/'))):
+            return None
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if asset is not None and asset.stamp == stamp:
+            return asset
+        asset = self._load(name) if stamp is not None else None
+        with self._lock:
+            assets = dict(self.assets)
+            if asset is None:
+                assets.pop(name, None)
+            else:
+                assets[name] = asset
+            self.assets = assets
+            self.fingerprints = {a.fingerprinted_name: n for n, a in assets.items()}
+        return asset
+
+    def lookup(self, filename):
+        """Return (asset, fingerprinted) for a plain or fingerprinted name; asset is None if unknown."""
+        name = self.fingerprints.get(filename)
+        fingerprinted = name is not None
+        if name is None:
+            name = filename
+            if current_app.debug:
+                match = _FINGERPRINTED.match(filename)
+                if match and match.group(1) + match.group(3) in self.assets:
+                    # An edited file still requested under its old fingerprint
+                    name = match.group(1) + match.group(3)
+        if current_app.debug:
+            asset = self._refresh(name)
+            fingerprinted = fingerprinted and asset is not None and asset.fingerprinted_name == filename
+            return asset, fingerprinted
+        return self.assets.get(name), fingerprinted
+
+    def url(self, filename, **values):
+        """URL of filename under its fingerprinted name (the plain one if the file is unknown)."""
+        asset = self._refresh(filename) if current_app.debug else self.assets.get(filename)
+        return url_for(self.endpoint, filename=asset.fingerprinted_name if asset else filename, **values)
+
+    def send(self, filename):
+        """Serve filename: the best compressed variant the client accepts, with caching headers."""
+        asset, fingerprinted = self.lookup(filename)
+        if asset is None:
+            abort(404)
+
+        coding = None
+        for candidate in asset.variants:
+            if request.accept_encodings[candidate]:
+                coding = candidate
+                break
+        data = asset.variants[coding] if coding else asset.data
+
+        response = Response(data, mimetype=asset.mimetype)
+        if coding:
+            response.headers['Content-Encoding'] = coding
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        # Each coding is a different representation, so it gets its own strong ETag
+        etag = asset.digest[:32]
+        response.set_etag(f'{etag}-{coding}' if coding else etag)
+        response.last_modified = asset.mtime
+        if fingerprinted:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def stats(self):
+        """Return the number of files and their plain and compressed sizes in bytes."""
+        assets = list(self.assets.values())
+        sizes = {'files': len(assets), 'bytes': sum(len(a.data) for a in assets)}
+        for coding, _ in self.compressors:
+            sizes[f'{coding}_bytes'] = sum(len(a.variants.get(coding, a.data)) for a in assets)
+        return sizes
+
+
+def init_assets(app, stores):
+    """Serve app's static folder from an AssetStore and add asset_url() to the templates.
+
+    stores maps endpoint names to AssetStores; a 'static' store replaces
+    Flask's static file view. In a template, asset_url('css/style.css')
+    (or asset_url('QQ.jpg', 'get_fig')) returns the fingerprinted URL.
+    """
+    stores = dict(stores)
+    if 'static' in stores:
+        app.view_functions['static'] = stores['static'].send
+
+    def asset_url(filename, endpoint='static'):
+        return stores[endpoint].url(filename)
+
+    app.jinja_env.globals['asset_url'] = asset_url
+    return stores
@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the INCAR generator.
+
+Times the core generation path (resolve_tasks, build_incar, the legacy
+analyze_tasks + generate_incar), POSCAR handling on synthetic structures
+of 10 to 1,000,000 atoms, batch generation over 1 to 10,000 job folders
+and every route of the Flask app through its test client. All inputs are
+generated in a temporary directory, so runs are reproducible on any
+Linux box; results are written as JSON and can be compared between runs.
+
+Usage:
+    python3 bench.py -o before.json                  # full suite
+    python3 bench.py --quick -o after.json           # small sizes, fewer repeats
+    python3 bench.py --only core,poscar --compare before.json
+    python3 bench.py --compare before.json after.json   # compare two saved runs
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+# Make the repo modules importable when started from another directory
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+
+import incar_core
+
+FORMAT_VERSION = 1
+GROUPS = ('core', 'poscar', 'batch', 'app')
+
+ATOM_COUNTS = (10, 1000, 100000, 1000000)
+FOLDER_COUNTS = (1, 100, 1000, 10000)
+QUICK_ATOM_COUNTS = (10, 1000, 10000)
+QUICK_FOLDER_COUNTS = (1, 10, 100)
+
+# Built-in task names, added one at a time for the core benchmarks
+CORE_TASKS = ['single', 'dftu', 'ispin', 'vdwd3bj', 'dipole', 'hse06', 'neb']
+
+# Species cycled through by the synthetic POSCARs (U values and moments for most)
+SPECIES = ('Fe', 'O', 'Ce', 'H', 'Ni', 'C')
+
+
+# ============================================================================
+# Synthetic inputs
+# ============================================================================
+
+def synthetic_poscar(natoms, species=SPECIES[:4]):
+    """Return the text of a VASP 5 POSCAR with natoms atoms split over the species."""
+    counts = [natoms // len(species)] * len(species)
+    for i in range(natoms - sum(counts)):
+        counts[i] += 1
+    species = [s for s, c in zip(species, counts) if c]
+    counts = [c for c in counts if c]
+
+    lines = [
+        f'synthetic {natoms} atoms',
+        '1.0',
+        '  20.0000000000   0.0000000000   0.0000000000',
+        '   0.0000000000  20.0000000000   0.0000000000',
+        '   0.0000000000   0.0000000000  20.0000000000',
+        '  ' + '  '.join(species),
+        '  ' + '  '.join(str(c) for c in counts),
+        'Direct',
+    ]
+    step = 1.0 / natoms
+    lines.extend(f'  {i * step:.8f}  {(i * 0.618034) % 1:.8f}  {(i * 0.414214) % 1:.8f}'
+                 for i in range(natoms))
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_potcar(species=SPECIES[:4], lines_per_dataset=20000):
+    """Return the text of a POTCAR with one PAW dataset header per species and filler data."""
+    filler = '  8.44421852E-01  7.57954403E-01  4.20571581E-01\n' * lines_per_dataset
+    datasets = []
+    for i, symbol in enumerate(species):
+        datasets.append(
+            f'  PAW_PBE {symbol} 06Sep2000\n 8.0000000000\n parameters from PSCTR are:\n'
+            f'   TITEL  = PAW_PBE {symbol} 06Sep2000\n'
+            f'   POMASS =   50.000; ZVAL   =    8.000    mass and valenz\n'
+            f'   ENMAX  =  {300 + 25 * i:.3f}; ENMIN  =  200.000 eV\n'
+            f' Description\n{filler} End of Dataset\n')
+    return ''.join(datasets)
+
+
+def make_job_tree(root, nfolders, poscar_text):
+    """Create nfolders job folders below root, each with the same POSCAR."""
+    for i in range(nfolders):
+        folder = os.path.join(root, f'{i // 100:03d}', f'job_{i:05d}')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'POSCAR'), 'w') as f:
+            f.write(poscar_text)
+
+
+def make_archive(poscar_text, nfiles):
+    """Return a gzipped tar holding nfiles job folders with a POSCAR each."""
+    data = poscar_text.encode()
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for i in range(nfiles):
+            info = tarfile.TarInfo(f'job_{i:04d}/POSCAR')
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+# ============================================================================
+# Timing
+# ============================================================================
+
+class Runner:
+    """Time callables and collect the results."""
+
+    def __init__(self, repeat=5, min_time=0.2, verbose=True):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.verbose = verbose
+        self.results = []
+
+    def bench(self, name, func, setup=None, repeat=None, **params):
+        """Time func() and record per-call statistics under name[params].
+
+        Fast calls are looped until a run takes at least min_time. With a
+        setup function (e.g. clearing a cache) every call is timed on its
+        own and setup runs untimed before each one.
+        """
+        repeat = repeat or self.repeat
+        loops = 1
+        if setup is None:
+            while True:
+                elapsed = self._time(func, loops)
+                if elapsed >= self.min_time or loops >= 1 << 20:
+                    break
+                loops *= 10 if elapsed < self.min_time / 10 else 2
+
+        timings = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            timings.append(self._time(func, loops) / loops)
+
+        result = {
+            'id': name + (('[' + ','.join(f'{k}={v}' for k, v in params.items()) + ']') if params else ''),
+            'name': name,
+            'params': params,
+            'repeat': repeat,
+            'loops': loops,
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.mean(timings),
+            'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        }
+        self.results.append(result)
+        if self.verbose:
+            print(f"{result['id']:<60} {_format_time(result['median']):>10}"
+                  f"  (min {_format_time(result['min'])}, {repeat}x{loops})", file=sys.stderr)
+        return result
+
+    @staticmethod
+    def _time(func, loops):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            return time.perf_counter() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+
+def _format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3g} {unit}'
+    return f'{seconds / 1e-9:.3g} ns'
+
+
+# ============================================================================
+# Benchmark groups
+# ============================================================================
+
+def bench_core(runner, workdir):
+    """Task resolution and INCAR rendering for 1 to len(CORE_TASKS) tasks."""
+    header = incar_core.parse_poscar_header(io.StringIO(synthetic_poscar(100)))
+    job = os.path.join(workdir, 'core_job')
+    os.makedirs(job)
+    with open(os.path.join(job, 'POSCAR'), 'w') as f:
+        f.write(synthetic_poscar(100))
+
+    for n in range(1, len(CORE_TASKS) + 1):
+        tasks = CORE_TASKS[:n]
+        runner.bench('core.resolve_tasks', lambda: incar_core.resolve_tasks(tasks, header, 1), tasks=n)
+        runner.bench('core.build_incar', lambda: incar_core.build_incar(tasks, header, 1), tasks=n)
+        resolved = incar_core.resolve_tasks(tasks, header, 1)[:3]
+        runner.bench('core.render_incar', lambda: incar_core.render_incar(*resolved), tasks=n)
+
+        # Legacy path used by the original scripts: reads the POSCAR in the
+        # current directory, prints, and rewrites the module-level tables
+        def legacy():
+            saved = {k: dict(v) for k, v in incar_core.standard_incar.items()}
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    dict_tasks, dict_task_groups = incar_core.analyze_tasks(tasks)
+                    incar_core.generate_incar(incar_core.standard_incar, dict_tasks, dict_task_groups)
+            finally:
+                incar_core.standard_incar.clear()
+                incar_core.standard_incar.update(saved)
+
+        with _chdir(job):
+            runner.bench('core.analyze_tasks+generate_incar', legacy, tasks=n)
+
+    incar_path = os.path.join(job, 'INCAR')
+    with open(incar_path, 'w') as f:
+        f.write(incar_core.build_incar(CORE_TASKS, header, 1)['content'])
+    edits = [('KPAR', '4'), ('LREAL', None), ('ENCUT', '520')]
+    runner.bench('core.edit_incar_file', lambda: incar_core.edit_incar_file(incar_path, edits, dry_run=True))
+    with open(incar_path) as f:
+        incar_text = f.read()
+    rules = incar_core.get_rule_set()
+    runner.bench('core.validate_incar', lambda: rules.check(incar_core.parse_incar_params(incar_text)))
+
+    potcar_path = os.path.join(job, 'POTCAR')
+    with open(potcar_path, 'w') as f:
+        f.write(synthetic_potcar())
+    index = incar_core.PotcarIndex(os.path.join(workdir, 'potcar_index.json'))
+    index.entries(potcar_path)
+    runner.bench('core.read_potcar', lambda: incar_core.read_potcar(potcar_path))
+    runner.bench('core.potcar_index_lookup', lambda: index.entries(potcar_path))
+
+    # One POSCAR read for INCAR and KPOINTS, against the INCAR alone
+    runner.bench('core.build_incar_in_dir', lambda: incar_core.build_incar_in_dir(job, ['dftu', 'ispin', 'dipole']))
+    runner.bench('core.build_input_set', lambda: incar_core.build_input_set(job, ['dftu', 'ispin', 'dipole']))
+
+
+def bench_poscar(runner, workdir, atom_counts):
+    """Header parsing, DFT+U and MAGMOM on synthetic POSCARs."""
+    for natoms in atom_counts:
+        path = os.path.join(workdir, f'POSCAR_{natoms}')
+        with open(path, 'w') as f:
+            f.write(synthetic_poscar(natoms))
+        header = incar_core.read_poscar_header(path)
+
+        runner.bench('poscar.read_poscar_header', lambda: incar_core.read_poscar_header(path), atoms=natoms)
+        runner.bench('poscar.dftu_params', lambda: incar_core.dftu_params(header.elements), atoms=natoms)
+        runner.bench('poscar.magmom_from_header', lambda: incar_core.magmom_from_header(header), atoms=natoms)
+        runner.bench('poscar.magmom_from_header+overrides',
+                     lambda: incar_core.magmom_from_header(header, {0: 5.0, natoms - 1: -5.0}),
+                     atoms=natoms)
+
+
+def bench_batch(runner, workdir, folder_counts, workers=None):
+    """batch_generate over project trees of increasing size."""
+    poscar_text = synthetic_poscar(100)
+    tasks = ['single', 'dftu', 'ispin']
+    for nfolders in folder_counts:
+        root = os.path.join(workdir, f'batch_{nfolders}')
+        make_job_tree(root, nfolders, poscar_text)
+        runner.bench('batch.find_poscar_dirs', lambda: incar_core.find_poscar_dirs(root),
+                     folders=nfolders)
+        # Large trees take seconds per run, a few runs are enough
+        repeat = min(runner.repeat, 3) if nfolders >= 1000 else None
+        folders = incar_core.find_poscar_dirs(root)
+
+        def remove_incars():
+            for folder in folders:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(os.path.join(folder, 'INCAR'))
+
+        runner.bench('batch.batch_generate',
+                     lambda: incar_core.batch_generate(root, tasks, workers=workers),
+                     setup=remove_incars, repeat=repeat, folders=nfolders)
+        # Reruns over INCARs that are already up to date
+        runner.bench('batch.batch_generate (unchanged)',
+                     lambda: incar_core.batch_generate(root, tasks, workers=workers),
+                     repeat=repeat, folders=nfolders)
+        manifest = os.path.join(root, incar_core.WRITE_MANIFEST)
+        incar_core.batch_generate(root, tasks, workers=workers, manifest=manifest)
+        runner.bench('batch.batch_generate (unchanged, manifest)',
+                     lambda: incar_core.batch_generate(root, tasks, workers=workers, manifest=manifest),
+                     repeat=repeat, folders=nfolders)
+        runner.bench('batch.audit_incar_files',
+                      lambda: incar_core.audit_incar_files(incar_core.find_incar_files(root), workers=workers),
+                      repeat=min(runner.repeat, 3) if nfolders >= 1000 else None,
+                      folders=nfolders)
+        shutil.rmtree(root)
+
+
+def bench_app(runner, workdir, atom_counts):
+    """Every route of app.py through the Flask test client."""
+    import app as app_module
+
+    flask_app = app_module.app
+    # Raw POSCAR bodies of the largest structures exceed the default 16 MB limit
+    flask_app.config['POSCAR_UPLOAD_MAX_LENGTH'] = 1 << 31
+    client = flask_app.test_client()
+    covered = set()
+
+    def route(rule, method, name=None, setup=None, expect=200, **kwargs):
+        covered.add(rule)
+        url = kwargs.pop('url', rule)
+        params = kwargs.pop('params', {})
+        call = getattr(client, method.lower())
+
+        def request():
+            # A callable body (e.g. a multipart upload) is rebuilt for every request
+            body = {k: v() if callable(v) else v for k, v in kwargs.items()}
+            response = call(url, **body)
+            response.get_data()
+            response.close()
+            if response.status_code != expect:
+                raise RuntimeError(f'{method} {url} returned {response.status_code}')
+
+        runner.bench(name or f'app.{method} {rule}', request, setup=setup, **params)
+
+    # Static pages and simple JSON routes
+    for rule in ('/', '/test', '/simple-test', '/health', '/ready', '/api/task-categories',
+                 '/api/standard-params', '/api/cache-stats'):
+        route(rule, 'GET')
+    route('/metrics', 'GET', expect=200 if app_module.METRICS.enabled else 404)
+    figs = sorted(p.name for p in (ROOT / 'figs').glob('*') if p.is_file())
+    if figs:
+        route('/figs/<filename>', 'GET', url=f'/figs/{figs[0]}')
+        etag = client.get(f'/figs/{figs[0]}').headers['ETag']
+        route('/figs/<filename>', 'GET', name='app.GET /figs/<filename> (If-None-Match)', expect=304,
+              url=f'/figs/{figs[0]}', headers={'If-None-Match': etag})
+    route('/static/<path:filename>', 'GET', name='app.GET /static/js/main.js (gzip)',
+          url='/static/js/main.js', headers={'Accept-Encoding': 'gzip'})
+    route('/api/task-params', 'POST', json={'task': 'DFT+U'})
+    route('/api/autocomplete', 'GET', name='app.GET /api/autocomplete (prefix)', url='/api/autocomplete?q=LDA&kind=param')
+    route('/api/autocomplete', 'GET', name='app.GET /api/autocomplete (typo)', url='/api/autocomplete?q=hsee06')
+    route('/api/download-incar', 'POST', json={'content': 'ENCUT = 400\n' * 50})
+
+    # generate-incar with one task from 1 to all categories, cold and cached
+    categories = list(app_module.TASK_REGISTRY.by_category.values())
+    sections = {section: True for section in incar_core.standard_incar}
+    for n in range(1, len(categories) + 1):
+        body = {'tasks': [entries[0].display for entries in categories[:n]],
+                'include_sections': sections,
+                'custom_params': {'ENCUT': '520', 'KPAR': '2'}}
+        task_params = {entry.display: entry.params for entries in categories[:n] for entry in entries[:1]}
+        standard = {section: incar_core.standard_incar[section] for section in sections}
+        runner.bench('app._generate_incar_content_organized',
+                     lambda: app_module._generate_incar_content_organized(
+                         task_params, dict(standard), body['custom_params']),
+                     categories=n)
+        route('/api/generate-incar', 'POST', name='app.POST /api/generate-incar (cold)',
+              setup=app_module.INCAR_CACHE.clear, json=body, params={'categories': n})
+        route('/api/generate-incar', 'POST', name='app.POST /api/generate-incar (cached)',
+              json=body, params={'categories': n})
+    etag = client.post('/api/generate-incar', json=body).get_etag()[0]
+    route('/api/generate-incar', 'POST', name='app.POST /api/generate-incar (304)', expect=304,
+          json=body, headers={'If-None-Match': f'"{etag}"'})
+
+    poscar_100 = synthetic_poscar(100)
+    for nconfigs in (10, 100):
+        configs = [{'name': f'job_{i}', 'tasks': body['tasks'], 'include_sections': sections,
+                    'custom_params': {'ENCUT': str(400 + i)}, 'poscar': poscar_100}
+                   for i in range(nconfigs)]
+        route('/api/generate-incar-batch', 'POST', setup=app_module.INCAR_CACHE.clear,
+              json={'configs': configs}, params={'configs': nconfigs})
+
+    # POSCAR endpoints read ./POSCAR; run them from a folder per structure size
+    for natoms in atom_counts:
+        folder = os.path.join(workdir, f'app_{natoms}')
+        os.makedirs(folder)
+        poscar_text = synthetic_poscar(natoms)
+        with open(os.path.join(folder, 'POSCAR'), 'w') as f:
+            f.write(poscar_text)
+        with _chdir(folder):
+            for rule in ('/api/read-poscar', '/api/calculate-dftu', '/api/calculate-magmom'):
+                route(rule, 'POST', name=f'app.POST {rule} (cold)',
+                      setup=app_module.POSCAR_CACHE.clear, params={'atoms': natoms})
+                route(rule, 'POST', name=f'app.POST {rule} (cached)', params={'atoms': natoms})
+            route('/api/calculate-magmom', 'POST', name='app.POST /api/calculate-magmom (overrides)',
+                  json={'overrides': {'0': 5.0}}, params={'atoms': natoms})
+        body_bytes = poscar_text.encode()
+        route('/api/upload-poscar', 'POST', name='app.POST /api/upload-poscar (raw)',
+              data=body_bytes, content_type='text/plain', params={'atoms': natoms})
+
+    archive = make_archive(poscar_100, 100)
+    route('/api/upload-poscar', 'POST', name='app.POST /api/upload-poscar (tar.gz)',
+          data=archive, content_type='application/gzip', params={'files': 100})
+    route('/api/upload-poscar', 'POST', name='app.POST /api/upload-poscar (multipart)',
+          data=lambda: {'file': (io.BytesIO(poscar_100.encode()), 'POSCAR')},
+          content_type='multipart/form-data', params={'files': 1})
+
+    # User presets in a throwaway database
+    flask_app.config['PRESET_DB'] = os.path.join(workdir, 'presets.db')
+    store = app_module.get_preset_store()
+    for i in range(2000):
+        store.create(f'preset {i:04d}', {'ISPIN': 1 + i % 2, 'ENCUT': 400 + i % 7 * 50, f'TAG{i % 50}': i},
+                     owner=f'user{i % 20}', category=f'cat{i % 5}')
+    route('/api/presets', 'GET', name='app.GET /api/presets (tag filter)',
+          url='/api/presets?tag=ISPIN=2&tag=ENCUT=500&per_page=50')
+    route('/api/presets', 'GET', name='app.GET /api/presets (owner, name prefix)',
+          url='/api/presets?owner=user3&name=preset%2001')
+    route('/api/presets/<int:preset_id>', 'GET', url='/api/presets/1000')
+    counter = iter(range(10 ** 9))
+    route('/api/presets', 'POST', expect=201,
+          json=lambda: {'name': f'bench {next(counter)}', 'params': {'ISPIN': 2, 'LDAU': '.TRUE.'}})
+    route('/api/presets/<int:preset_id>', 'PUT', url='/api/presets/1000',
+          json={'description': 'touched by bench'})
+    route('/api/generate-incar', 'POST', name='app.POST /api/generate-incar (presets)',
+          json={'tasks': [categories[0][0].display], 'presets': [1, 2, 3]})
+
+    route('/api/plan-parallel', 'POST',
+          json={'cores_per_node': 128, 'nodes': 4, 'tasks': ['HSE06', 'Opt'], 'poscar': synthetic_poscar(100)})
+    route('/api/generate-kpoints', 'POST', json={'tasks': ['Slab'], 'poscar': synthetic_poscar(100)})
+
+    neb = os.path.join(workdir, 'app_neb')
+    for i in range(8):
+        os.makedirs(os.path.join(neb, f'{i:02d}'))
+    with _chdir(neb):
+        route('/api/calculate-neb-images', 'POST')
+
+    return sorted(rule.rule for rule in flask_app.url_map.iter_rules()
+                  if rule.endpoint != 'static' and rule.rule not in covered)
+
+
+@contextlib.contextmanager
+def _chdir(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+# ============================================================================
+# Reports
+# ============================================================================
+
+def environment():
+    """Return the machine and code version a run was made on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit or None,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def compare(old, new, metric='median', threshold=0.25):
+    """Print old vs new timings per benchmark id; return the ids that got slower."""
+    old_results = {r['id']: r for r in old['results']}
+    regressions = []
+    print(f"{'benchmark':<60} {'old':>10} {'new':>10} {'change':>8}")
+    for result in new['results']:
+        before = old_results.get(result['id'])
+        if before is None:
+            print(f"{result['id']:<60} {'-':>10} {_format_time(result[metric]):>10}      new")
+            continue
+        ratio = result[metric] / before[metric] if before[metric] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  SLOWER'
+            regressions.append(result['id'])
+        elif ratio < 1 / (1 + threshold):
+            flag = '  faster'
+        print(f"{result['id']:<60} {_format_time(before[metric]):>10} "
+              f"{_format_time(result[metric]):>10} {ratio:>7.2f}x{flag}")
+    missing = set(old_results) - {r['id'] for r in new['results']}
+    for result_id in sorted(missing):
+        print(f"{result_id:<60} {_format_time(old_results[result_id][metric]):>10} {'-':>10}  missing")
+    print(f"\n{len(regressions)} benchmark(s) more than {threshold:.0%} slower ({metric}).")
+    return regressions
+
+
+def run(args):
+    """Run the selected groups and return the report dict."""
+    groups = args.only.split(',') if args.only else list(GROUPS)
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise SystemExit(f"Unknown group(s): {', '.join(sorted(unknown))}; choose from {', '.join(GROUPS)}")
+
+    atom_counts = QUICK_ATOM_COUNTS if args.quick else ATOM_COUNTS
+    folder_counts = QUICK_FOLDER_COUNTS if args.quick else FOLDER_COUNTS
+    if args.max_atoms:
+        atom_counts = [n for n in atom_counts if n <= args.max_atoms]
+    if args.max_folders:
+        folder_counts = [n for n in folder_counts if n <= args.max_folders]
+
+    runner = Runner(repeat=args.repeat or (3 if args.quick else 5),
+                    min_time=0.05 if args.quick else 0.2,
+                    verbose=not args.quiet)
+    report = {'format': FORMAT_VERSION, 'environment': environment(),
+              'config': {'groups': groups, 'atoms': list(atom_counts), 'folders': list(folder_counts),
+                         'repeat': runner.repeat, 'min_time': runner.min_time},
+              'skipped': {}, 'results': runner.results}
+
+    workdir = tempfile.mkdtemp(prefix='incar_bench_')
+    # POTCARs met by the benchmarks must not end up in the user's real index
+    saved_index = os.environ.get('INCAR_POTCAR_INDEX')
+    os.environ['INCAR_POTCAR_INDEX'] = os.path.join(workdir, 'potcar_index.json')
+    try:
+        for group in groups:
+            if group == 'core':
+                bench_core(runner, workdir)
+            elif group == 'poscar':
+                bench_poscar(runner, workdir, atom_counts)
+            elif group == 'batch':
+                bench_batch(runner, workdir, folder_counts, args.workers)
+            elif group == 'app':
+                try:
+                    # Some routes (e.g. /test) open files relative to the repo
+                    with _chdir(ROOT):
+                        uncovered = bench_app(runner, workdir, atom_counts)
+                except ImportError as e:
+                    report['skipped']['app'] = f'{e.name} is not installed'
+                    continue
+                if uncovered:
+                    # A new route without a benchmark shows up here
+                    report['skipped']['app routes'] = uncovered
+    finally:
+        if saved_index is None:
+            os.environ.pop('INCAR_POTCAR_INDEX', None)
+        else:
+            os.environ['INCAR_POTCAR_INDEX'] = saved_index
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark INCAR generation, POSCAR handling and the web API.'
+    )
+    parser.add_argument('-o', '--output', help='write the JSON report to this file (default: stdout)')
+    parser.add_argument('--only', help=f"comma-separated groups to run ({', '.join(GROUPS)})")
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller structures and trees, fewer repeats')
+    parser.add_argument('--max-atoms', type=int, help='skip structures larger than this')
+    parser.add_argument('--max-folders', type=int, help='skip batch trees larger than this')
+    parser.add_argument('-r', '--repeat', type=int, help='timed runs per benchmark (default: 5, quick: 3)')
+    parser.add_argument('-j', '--workers', type=int, help='worker processes for batch_generate')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='baseline report to compare with; give two reports to compare them without running')
+    parser.add_argument('--metric', choices=['median', 'min', 'mean'], default='median',
+                        help='statistic used by --compare (default: median)')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown reported as a regression (default: 0.25)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.compare and len(args.compare) > 2:
+        print('--compare takes a baseline report and optionally a second report', file=sys.stderr)
+        return 2
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1]) as f:
+            report = json.load(f)
+    else:
+        report = run(args)
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        elif not args.compare:
+            print(text)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline, report, args.metric, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,8 +5,9 @@ Consolidated from brain.incar and brain.data modules
 """
 
 import os
-import sys
-from difflib import SequenceMatcher
+import re
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
 
 # ============================================================================
 # Part 0: DFT+U, Spin, and other elemental parameters
@@ -32,6 +33,26 @@ mag_value = {
     'Ti': 0.0, 'Zn': 0.0, 'Sn': 0.0, 'O': 0.0
 }
 
+### Periodic table, indexed by atomic number
+chemical_symbols = [
+    'X',
+    'H', 'He',
+    'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar',
+    'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn',
+    'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr',
+    'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd',
+    'In', 'Sn', 'Sb', 'Te', 'I', 'Xe',
+    'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy',
+    'Ho', 'Er', 'Tm', 'Yb', 'Lu', 'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt',
+    'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn',
+    'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf',
+    'Es', 'Fm', 'Md', 'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds',
+    'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og'
+]
+
+atomic_numbers = {symbol: z for z, symbol in enumerate(chemical_symbols)}
+
 # ============================================================================
 # Part 1: Standard INCAR parameters
 # ============================================================================
@@ -47,6 +68,11 @@ standard_incar = {
     'd_ncore': {'NCORE': '8'}
 }
 
+# Read-only copy of the defaults above; analyze_tasks still edits standard_incar
+# in place for older scripts, so build_incar starts from this one instead
+STANDARD_DEFAULTS = MappingProxyType({section: MappingProxyType(dict(params))
+                                      for section, params in standard_incar.items()})
+
 # ============================================================================
 # Part 2: Task-specific INCAR parameters
 # ============================================================================
@@ -85,76 +111,295 @@ tasks_recorded = [i.split('_')[2].lower() for i in tasks_incar.keys()]
 # Part 3: Parameter update functions for special cases
 # ============================================================================
 
-def check_pos_car():
-    """Check if POSCAR exists and return element list."""
-    poscar_paths = ['POSCAR', './01/POSCAR']
-    ele_list = []
+class PoscarHeader(namedtuple('PoscarHeader', [
+        'comment', 'scale', 'lattice', 'elements', 'counts',
+        'selective_dynamics', 'coordinates'])):
+    """Header of a POSCAR file: everything above the coordinate block, one entry per species block."""
+    __slots__ = ()
+
+    @property
+    def total_atoms(self):
+        return sum(self.counts)
+
+    def symbols(self):
+        """Return the per-atom chemical symbols, like ase.Atoms.get_chemical_symbols."""
+        symbols = []
+        for element, count in zip(self.elements, self.counts):
+            symbols.extend([element] * count)
+        return symbols
+
+    def unique_elements(self):
+        """Return the species in order of first appearance."""
+        return list(dict.fromkeys(self.elements))
+
+    def element_counts(self):
+        """Return {element: number of atoms}, in order of first appearance."""
+        element_counts = {}
+        for element, count in zip(self.elements, self.counts):
+            element_counts[element] = element_counts.get(element, 0) + count
+        return element_counts
+
+    def cell(self):
+        """Return the lattice vectors in Angstrom, with the scaling factor (or a negative volume) applied."""
+        if len(self.scale) == 3:
+            return [[x * s for x, s in zip(vector, self.scale)] for vector in self.lattice]
+        scale = self.scale[0]
+        if scale < 0:
+            scale = (-scale / _triple_product(self.lattice)) ** (1 / 3)
+        return [[x * scale for x in vector] for vector in self.lattice]
+
+    @property
+    def volume(self):
+        """Cell volume in cubic Angstrom."""
+        return _triple_product(self.cell())
+
+    def reciprocal_lengths(self):
+        """Return the lengths of the reciprocal lattice vectors (with 2 pi) in 1/Angstrom."""
+        a, b, c = self.cell()
+        volume = _triple_product((a, b, c))
+        return [2 * _PI * _norm(_cross(u, v)) / volume for u, v in ((b, c), (c, a), (a, b))]
+
+
+_PI = 3.141592653589793
+
+
+def _cross(u, v):
+    return [u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]]
+
+
+def _norm(u):
+    return sum(x * x for x in u) ** 0.5
+
+
+def _triple_product(vectors):
+    a, b, c = vectors
+    return abs(sum(x * y for x, y in zip(a, _cross(b, c))))
+
+
+def _species_name(token):
+    """Return the element of a species label such as Fe_pv, Fe_pv/2a3c..., Fe1 or the pseudo-H H.75."""
+    token = token.split('/')[0].split('_')[0]
+    match = re.match(r'[A-Z][a-z]?', token)
+    return match.group(0) if match else token
+
+
+def read_potcar_species(path):
+    """Return the element of each dataset in a POTCAR, in order (see read_potcar)."""
+    return [entry.element for entry in read_potcar(path)]
+
+
+def parse_poscar_header(lines, potcar=None):
+    """Parse a POSCAR header from an iterator of lines (str or bytes); raises ValueError if malformed."""
+    line_number = 0
+
+    def next_line():
+        nonlocal line_number
+        line = next(lines, None)
+        if line is None:
+            raise ValueError('POSCAR header is truncated')
+        line_number += 1
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        return line.strip()
+
+    def numbers(line, wanted):
+        # The leading numbers of the line; anything after them is a comment
+        values = []
+        for token in line.split()[:max(wanted)]:
+            try:
+                values.append(float(token))
+            except ValueError:
+                break
+        if len(values) not in wanted:
+            raise ValueError(f'line {line_number}: expected {" or ".join(map(str, wanted))} numbers, '
+                             f'got {line!r}')
+        return values
+
+    lines = iter(lines)
+    try:
+        comment = next_line()
+        scale = numbers(next_line(), (1, 3))
+        lattice = [numbers(next_line(), (3,)) for _ in range(3)]
+
+        tokens = next_line().split()
+        if tokens and all(t.isdigit() for t in tokens):
+            # VASP4: no species line, the counts come straight after the lattice
+            counts = [int(t) for t in tokens]
+            elements = None
+        else:
+            elements = [_species_name(t) for t in tokens]
+            counts = [int(t) for t in next_line().split()]
+    except ValueError as e:
+        raise ValueError(f'Malformed POSCAR header: {e}')
+
+    mode = next_line()
+    selective_dynamics = mode[:1] in ('s', 'S')
+    if selective_dynamics:
+        mode = next_line()
+    coordinates = 'Cartesian' if mode[:1] in ('c', 'C', 'k', 'K') else 'Direct'
+
+    if elements is None:
+        candidates = []
+        if potcar and os.path.isfile(potcar):
+            candidates.append(read_potcar_species(potcar))
+        candidates.append([_species_name(t) for t in comment.split()])
+        for candidate in candidates:
+            if len(candidate) == len(counts) and all(e in atomic_numbers for e in candidate):
+                elements = candidate
+                break
+        else:
+            raise ValueError('VASP4 POSCAR without species: no matching POTCAR or comment line')
+    elif len(elements) != len(counts):
+        raise ValueError('POSCAR species and counts lines have different lengths')
+
+    return PoscarHeader(comment, scale, lattice, elements, counts,
+                        selective_dynamics, coordinates)
+
+
+def read_poscar_header(path):
+    """Read the header of the POSCAR at path, using a POTCAR next to it for VASP4 species."""
+    potcar = os.path.join(os.path.dirname(os.path.abspath(path)), 'POTCAR')
+    with open(path, 'rb') as f:
+        return parse_poscar_header(f, potcar=potcar)
+
+
+def find_poscar_header(poscar_paths=('POSCAR', './01/POSCAR'), strict=False):
+    """Return the header of the first readable POSCAR in poscar_paths, or None (strict: raise on a malformed one)."""
     for path in poscar_paths:
         if os.path.isfile(path):
             try:
-                from ase.io import read
-                atoms = read(path, format='vasp')
-                ele_list = atoms.get_chemical_symbols()
-                return True, ele_list
-            except ImportError:
-                # ASE not available, try basic parsing
-                with open(path, 'r') as f:
-                    lines = f.readlines()
-                    if len(lines) > 5:
-                        # Line 6 contains element names
-                        elements = lines[5].split()
-                        # Line 7 contains counts
-                        counts = list(map(int, lines[6].split()))
-                        ele_list = []
-                        for elem, count in zip(elements, counts):
-                            ele_list.extend([elem] * count)
-                        return True, ele_list
-    
+                return read_poscar_header(path)
+            except (OSError, ValueError) as e:
+                if strict:
+                    raise ValueError(f'{path}: {e}')
+                continue
+    return None
+
+
+def dftu_params(elements):
+    """Return the LDAUL/LDAUU/LDAUJ strings for the species, in order of first appearance."""
+    ldaul, u, j = [], [], []
+    for element in dict.fromkeys(elements):
+        if element in u_value:
+            ldaul.append(2)  # Apply DFT+U to this element
+            u.append(u_value[element])
+            j.append(j_value.get(element, 0))
+        else:
+            ldaul.append(-1)  # No DFT+U applied
+            u.append(0)
+            j.append(0)
+    return {
+        'LDAUL': '  '.join(map(str, ldaul)),
+        'LDAUU': '  '.join(map(str, u)),
+        'LDAUJ': '  '.join(map(str, j))
+    }
+
+
+def magmom_param(element_counts):
+    """Return the MAGMOM string for {element: count}; prefer magmom_from_header for repeated species."""
+    magmom_list = []
+    for symbol, count in element_counts.items():
+        magmom_per_atom = mag_value.get(symbol, 0.0)
+        magmom_list.append(f"{count}*{magmom_per_atom}")
+    return "  ".join(magmom_list)
+
+
+def moment_table(moments=None):
+    """Return the initial moment of every element, updated with moments, as a list indexed by atomic number."""
+    values = dict(mag_value)
+    values.update(moments or {})
+    return [float(values.get(symbol, 0.0)) for symbol in chemical_symbols]
+
+
+def _format_magmom(runs):
+    """Format (count, moment) runs as 'count*moment' items."""
+    return "  ".join(f"{count}*{float(moment)}" for count, moment in runs)
+
+
+def build_magmom(numbers, overrides=None, moments=None):
+    """Return the run-length encoded MAGMOM string for a sequence of atomic numbers, one per site."""
+    table = moment_table(moments)
+    try:
+        import numpy as np
+    except ImportError:
+        site_moments = [table[z] for z in numbers]
+        for index, moment in (overrides or {}).items():
+            site_moments[int(index)] = float(moment)
+        runs = []
+        for moment in site_moments:
+            if runs and runs[-1][1] == moment:
+                runs[-1][0] += 1
+            else:
+                runs.append([1, moment])
+        return _format_magmom(runs)
+
+    site_moments = np.asarray(table)[np.asarray(numbers, dtype=np.intp)]
+    if overrides:
+        indices = np.fromiter((int(i) for i in overrides), dtype=np.intp, count=len(overrides))
+        site_moments[indices] = np.fromiter((float(m) for m in overrides.values()),
+                                            dtype=float, count=len(overrides))
+    if not len(site_moments):
+        return ''
+    starts = np.concatenate(([0], np.flatnonzero(site_moments[1:] != site_moments[:-1]) + 1))
+    counts = np.diff(np.append(starts, len(site_moments)))
+    return _format_magmom(zip(counts.tolist(), site_moments[starts].tolist()))
+
+
+def magmom_from_header(header, overrides=None, moments=None):
+    """Return the MAGMOM string for the atoms of a PoscarHeader, in POSCAR order."""
+    if overrides:
+        numbers = []
+        for element, count in zip(header.elements, header.counts):
+            numbers.extend([atomic_numbers.get(element, 0)] * count)
+        return build_magmom(numbers, overrides, moments)
+
+    table = moment_table(moments)
+    runs = []
+    for element, count in zip(header.elements, header.counts):
+        if element in atomic_numbers:
+            moment = table[atomic_numbers[element]]
+        else:
+            moment = float((moments or {}).get(element, mag_value.get(element, 0.0)))
+        if runs and runs[-1][1] == moment:
+            runs[-1][0] += count
+        elif count:
+            runs.append([count, moment])
+    return _format_magmom(runs)
+
+
+def check_pos_car():
+    """Check if POSCAR exists and return element list."""
+    header = find_poscar_header()
+    if header is not None:
+        return True, header.symbols()
+
     print('POSCAR Not Found. Be careful about the D2, DFT+U parameters.')
     return False, []
 
 
 def dftu_update(dftu):
     """Update DFT+U parameters based on POSCAR elements."""
-    is_poscar_here, ele_list = check_pos_car()
-    if not is_poscar_here:
+    header = find_poscar_header()
+    if header is None:
         print("POSCAR not found. Skipping DFT+U parameter update.")
         return dftu
 
-    unique_elements = []
-    ldaul, u, j = [], [], []
-
-    for element in ele_list:
-        if element not in unique_elements:
-            unique_elements.append(element)
-            if element in u_value:
-                ldaul.append(2)  # Apply DFT+U to this element
-                u.append(u_value[element])
-                j.append(j_value[element])
-            else:
-                ldaul.append(-1)  # No DFT+U applied
-                u.append(0)
-                j.append(0)
-
     # Update DFT+U parameters in the INCAR dictionary
-    dftu.update({
-        'LDAUL': '  '.join(map(str, ldaul)),
-        'LDAUU': '  '.join(map(str, u)),
-        'LDAUJ': '  '.join(map(str, j))
-    })
+    params = dftu_params(header.elements)
+    dftu.update(params)
 
-    print(f"LDAUL set to: {ldaul}")
-    print(f"LDAUU set to: {u}")
-    print(f"LDAUJ set to: {j}")
+    print(f"LDAUL set to: {params['LDAUL']}")
+    print(f"LDAUU set to: {params['LDAUU']}")
+    print(f"LDAUJ set to: {params['LDAUJ']}")
 
     return dftu
 
 
 def neb_update(neb):
     """Add the IMAGE numbers to NEB calculation."""
-    folders = [f for f in os.listdir('.') if os.path.isdir(f)]
-    images = len([i for i in folders if i.isdigit()]) - 2
-    neb.update({'IMAGES': str(images)})
+    images = count_neb_images('.')
+    if images is not None:
+        neb.update({'IMAGES': str(images)})
     return neb
 
 
@@ -168,47 +413,141 @@ def freq_update(freq):
 def spin_update(ispin):
     """Update MAGMOM based on element magnetic moments from POSCAR."""
     try:
-        from ase.io import read
-        atoms = read("POSCAR")
-        symbols = atoms.get_chemical_symbols()
-    except:
-        try:
-            with open("POSCAR", 'r') as f:
-                lines = f.readlines()
-                if len(lines) > 5:
-                    elements = lines[5].split()
-                    counts = list(map(int, lines[6].split()))
-                    symbols = []
-                    for elem, count in zip(elements, counts):
-                        symbols.extend([elem] * count)
-                else:
-                    print("POSCAR format not recognized. Skipping MAGMOM update.")
-                    return ispin
-        except FileNotFoundError:
-            print("POSCAR cannot be found. Exiting.")
-            return ispin
-
-    element_counts = {}
-    for symbol in symbols:
-        element_counts[symbol] = element_counts.get(symbol, 0) + 1
-
-    magmom_list = []
-    for symbol, count in element_counts.items():
-        magmom_per_atom = mag_value.get(symbol, 0.0)
-        magmom_list.append(f"{count}*{magmom_per_atom}")
+        header = read_poscar_header("POSCAR")
+    except FileNotFoundError:
+        print("POSCAR cannot be found. Exiting.")
+        return ispin
+    except (OSError, ValueError):
+        print("POSCAR format not recognized. Skipping MAGMOM update.")
+        return ispin
 
-    magmom_str = "  ".join(magmom_list)
+    magmom_str = magmom_from_header(header)
     ispin.update({'MAGMOM': magmom_str})
 
     print(f"MAGMOM line updated: {magmom_str}")
     return ispin
 
 
-def analyze_tasks(tasks):
-    """Analyze and validate requested tasks."""
-    vdw_list = []
-    unsupported_tasks = []
+def neb_image_folders(directory='.'):
+    """Return the sorted NEB image folder names (two digits: 00, 01, ...) in directory."""
+    # scandir gets the entry types with the listing, so no stat() per entry
+    with os.scandir(directory) as entries:
+        return sorted(e.name for e in entries
+                      if len(e.name) == 2 and e.name.isdigit() and e.is_dir())
+
+
+def count_neb_images(directory='.'):
+    """Return the NEB IMAGES number (image folders minus the two end points), or None without image folders."""
+    try:
+        folders = neb_image_folders(directory)
+    except OSError:
+        return None
+    return len(folders) - 2 if len(folders) >= 2 else None
+
+
+class NebCheck(namedtuple('NebCheck', ['directory', 'folders', 'images', 'elements', 'counts', 'errors'])):
+    """Result of check_neb_jobs for one NEB job folder; errors lists every problem found."""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def _format_composition(header):
+    return ' '.join(f'{e}{n}' for e, n in zip(header.elements, header.counts))
+
+
+def _read_image_header(job, folder):
+    """Return (header, error) for the POSCAR of one NEB image folder."""
+    path = os.path.join(job, folder, 'POSCAR')
+    try:
+        with open(path, 'rb') as f:
+            return parse_poscar_header(f, potcar=os.path.join(job, 'POTCAR')), None
+    except FileNotFoundError:
+        return None, f'{folder}/POSCAR: not found'
+    except (OSError, ValueError) as e:
+        return None, f'{folder}/POSCAR: {e}'
+
+
+def _check_images(job, folders, headers):
+    """Compare the image headers of one job and return its NebCheck."""
+    errors = []
+    if len(folders) < 3:
+        errors.append(f'{len(folders)} image folder(s); an NEB needs 00, at least one image and the end point')
+    if folders:
+        missing = [f'{i:02d}' for i in range(int(folders[-1]) + 1) if f'{i:02d}' not in folders]
+        if missing:
+            errors.append(f"image folders are not contiguous, missing: {' '.join(missing)}")
+
+    for header, error in headers.values():
+        if error:
+            errors.append(error)
+
+    reference = None
+    for name in (folders[0], folders[-1]) if folders else ():
+        if headers[name][0] is not None:
+            reference, reference_name = headers[name][0], name
+            break
+    if reference is not None:
+        for folder in folders:
+            header = headers[folder][0]
+            if header is not None and (header.elements != reference.elements
+                                       or header.counts != reference.counts):
+                errors.append(f'{folder}/POSCAR: {_format_composition(header)} differs from '
+                              f'{reference_name}/POSCAR: {_format_composition(reference)}')
+
+    return NebCheck(
+        directory=job,
+        folders=folders,
+        images=len(folders) - 2 if len(folders) >= 2 else None,
+        elements=list(reference.elements) if reference else None,
+        counts=list(reference.counts) if reference else None,
+        errors=errors,
+    )
+
+
+def check_neb_jobs(directories, workers=None):
+    """Check many NEB job folders, reading only the image POSCAR headers on a thread pool; one NebCheck each."""
+    jobs = []
+    for directory in directories:
+        try:
+            jobs.append((directory, neb_image_folders(directory)))
+        except OSError as e:
+            jobs.append((directory, None, str(e)))
+
+    reads = [(job[0], folder) for job in jobs if job[1] for folder in job[1]]
+    if workers is None:
+        workers = min(64, (os.cpu_count() or 1) * 8)
+    workers = max(1, min(workers, len(reads)))
+    if workers == 1:
+        results = [_read_image_header(job, folder) for job, folder in reads]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda read: _read_image_header(*read), reads))
+    headers = dict(zip(reads, results))
+
+    checks = []
+    for job in jobs:
+        if job[1] is None:
+            checks.append(NebCheck(job[0], [], None, None, None, [job[2]]))
+            continue
+        directory, folders = job
+        checks.append(_check_images(directory, folders,
+                                    {folder: headers[(directory, folder)] for folder in folders}))
+    return checks
+
+
+def check_neb_job(directory='.'):
+    """Check the image folders of one NEB job (see check_neb_jobs)."""
+    return check_neb_jobs([directory])[0]
 
+
+def _scan_tasks(tasks):
+    """Return (notes, vdW tasks, unsupported tasks) for the requested task names."""
+    registry = get_task_registry()
+    notes, vdw_list, unsupported_tasks = [], [], []
     for task in tasks:
         task_lower = task.lower()
 
@@ -216,53 +555,103 @@ def analyze_tasks(tasks):
         if 'vdw' in task_lower:
             vdw_list.append(task)
         if 'scan' in task_lower:
-            print("VASP 5.4.3 or higher is required for METAGGA = SCAN functional.")
-            print("See: https://cms.mpi.univie.ac.at/wiki/index.php/METAGGA")
+            notes.append("VASP 5.4.3 or higher is required for METAGGA = SCAN functional.")
+            notes.append("See: https://cms.mpi.univie.ac.at/wiki/index.php/METAGGA")
+        if task not in registry.by_name:
+            unsupported_tasks.append(task)
+    return notes, vdw_list, unsupported_tasks
 
-    # Check if multiple vdW types are set
+
+def resolve_tasks(tasks, header=None, images=None, magmom_overrides=None, potcar=None):
+    """Resolve task names into INCAR parameters without touching module state."""
+    notes, vdw_list, unsupported_tasks = _scan_tasks(tasks)
     if len(vdw_list) >= 2:
-        print("You cannot set more than one vdW type at the same time.")
-        print(f"Detected vdW types: {' '.join(vdw_list)}")
-        print("Please confirm your vdW type and rerun the command.")
-        exit()
+        raise ValueError(f"You cannot set more than one vdW type at the same time: {' '.join(vdw_list)}")
+    if unsupported_tasks:
+        raise ValueError(_unsupported_tasks_message(unsupported_tasks))
 
+    registry = get_task_registry()
+    standard = {section: dict(params) for section, params in STANDARD_DEFAULTS.items()}
     dict_tasks = {}
     dict_task_groups = {}
+    messages = list(notes)
+
+    if potcar is not None and 'd_elec' in standard:
+        standard['d_elec']['ENCUT'] = str(potcar.encut)
+        messages.append(f"ENCUT set to {potcar.encut} from the POTCAR ENMAX values")
+        if potcar.nelect is not None:
+            messages.append(f"POTCAR: NELECT = {potcar.nelect:g}, NBANDS about {potcar.nbands}")
 
     for task in tasks:
-        if task in tasks_recorded:
-            for k_task, v_task in tasks_incar.items():
-                task_type = k_task.split('_')[2].lower()
-                if task == task_type:
-                    # Handle specific task updates
-                    if task == 'dftu':
-                        dftu_update(v_task)
-                    elif task == 'neb':
-                        neb_update(v_task)
-                    elif task in ['vdwoptb86b', 'vdwoptb88', 'vdwdf2', 'vdwdf', 'vdwoptpbe', 'vdwrevdf2']:
-                        print("Reminder: Copy vdw_kernel.bindat file to your job folder!\n" * 3)
-                    elif task == 'ispin':
-                        spin_update(v_task)
-                        standard_incar['d_elec']['ISPIN'] = '2'
-                    elif task == 'freq':
-                        freq_update(v_task)
-                    
-                    # Update task dictionaries
-                    dict_tasks.update(v_task)
-                    dict_task_groups[k_task] = v_task
-        else:
-            unsupported_tasks.append(task)
+        entry = registry.by_name[task]
+        v_task = dict(entry.params)
+        # Handle specific task updates
+        if task == 'dftu':
+            if header is None:
+                messages.append("POSCAR not found. Skipping DFT+U parameter update.")
+            else:
+                v_task.update(dftu_params(header.elements))
+                messages.extend(f"{k} set to: {v_task[k]}" for k in ('LDAUL', 'LDAUU', 'LDAUJ'))
+        elif task == 'neb':
+            if images is None:
+                messages.append("Number of NEB images unknown. Skipping IMAGES update.")
+            else:
+                v_task['IMAGES'] = str(images)
+        elif task in ['vdwoptb86b', 'vdwoptb88', 'vdwdf2', 'vdwdf', 'vdwoptpbe', 'vdwrevdf2']:
+            messages.append("Reminder: Copy vdw_kernel.bindat file to your job folder!")
+        elif task == 'ispin':
+            if header is None:
+                messages.append("POSCAR not found. Skipping MAGMOM update.")
+            else:
+                v_task['MAGMOM'] = magmom_from_header(header, magmom_overrides)
+                messages.append(f"MAGMOM line updated: {v_task['MAGMOM']}")
+            standard['d_elec']['ISPIN'] = '2'
+        elif task == 'freq':
+            # NCORE/parallelization cannot be used for frequency calculations
+            standard.pop('d_ncore', None)
+
+        # Update task dictionaries
+        dict_tasks.update(v_task)
+        dict_task_groups[entry.key] = v_task
+
+    return standard, dict_tasks, dict_task_groups, messages
+
+
+def analyze_tasks(tasks):
+    """Analyze and validate requested tasks, updating standard_incar in place as older scripts expect."""
+    notes, vdw_list, unsupported_tasks = _scan_tasks(tasks)
+    for note in notes:
+        print(note)
+
+    # Check if multiple vdW types are set
+    if len(vdw_list) >= 2:
+        print("You cannot set more than one vdW type at the same time.")
+        print(f"Detected vdW types: {' '.join(vdw_list)}")
+        print("Please confirm your vdW type and rerun the command.")
+        exit()
 
     # Handle unsupported tasks
     if unsupported_tasks:
         print("The following tasks are not supported:\n")
+        guessed = False
         for task in unsupported_tasks:
-            print(f"- {task}")
-        print("\nSupported tasks:\n")
-        print(" ".join(f"- {recorded_task}" for recorded_task in tasks_recorded))
+            names = did_you_mean(task)
+            guessed = guessed or bool(names)
+            print(f"- {task}" + (f"    did you mean: {', '.join(names)}?" if names else ""))
+        if not guessed:
+            print("\nSupported tasks:\n")
+            print(" ".join(f"- {recorded_task}" for recorded_task in tasks_recorded))
         print("\nPlease use one of the supported tasks above and rerun the command.")
         exit()
 
+    header = find_poscar_header()
+    standard, dict_tasks, dict_task_groups, messages = resolve_tasks(
+        tasks, header=header, images=count_neb_images('.'))
+    for message in messages[len(notes):]:
+        print(message)
+
+    standard_incar.clear()
+    standard_incar.update(standard)
     return dict_tasks, dict_task_groups
 
 
@@ -270,24 +659,257 @@ def analyze_tasks(tasks):
 # Part 4: INCAR file generation and manipulation
 # ============================================================================
 
-def generate_incar(standard_incar, dict_tasks, dict_task_groups):
-    """Create INCAR file."""
-    incar_out = open('INCAR', 'w')
-    for k_std, v_std in standard_incar.items():
+def render_incar(standard, dict_tasks, dict_task_groups):
+    """Return the INCAR text for the standard sections and the task groups."""
+    lines = []
+    for k_std, v_std in standard.items():
         # Write the standard incar parameters
-        incar_out.write('%s\n' % (k_std.upper().replace('D_', '#')))
+        lines.append('%s\n' % (k_std.upper().replace('D_', '#')))
         for k, v in v_std.items():
-            if k not in dict_tasks.keys():
+            if k not in dict_tasks:
                 # Write the parameters are not affected by the user's task
-                incar_out.write('%s = %s \n' % (k, v))
-        incar_out.write('\n')
+                lines.append('%s = %s \n' % (k, v))
+        lines.append('\n')
 
     for k_task, v_task in dict_task_groups.items():
         # Write the specific parameters for the tasks
-        incar_out.write('\n%s \n' % (k_task.upper().replace('D_', '#')))
+        lines.append('\n%s \n' % (k_task.upper().replace('D_', '#')))
         for k, v in v_task.items():
-            incar_out.write('%s = %s \n' % (k, v))
-    incar_out.close()
+            lines.append('%s = %s \n' % (k, v))
+    return ''.join(lines)
+
+
+def generate_incar(standard_incar, dict_tasks, dict_task_groups, path='INCAR'):
+    """Create INCAR file (left untouched if it already has this content)."""
+    write_if_changed(path, render_incar(standard_incar, dict_tasks, dict_task_groups))
+
+
+def build_incar(tasks, header=None, images=None, magmom_overrides=None, potcar=None):
+    """Build the INCAR for the tasks from structure data, without side effects (see resolve_tasks)."""
+    standard, dict_tasks, dict_task_groups, messages = resolve_tasks(
+        tasks, header, images, magmom_overrides, potcar)
+    layers = [('standard', 'standard', {k: v for params in standard.values() for k, v in params.items()})]
+    layers += [('task', key[len('d_cal_'):] if key.startswith('d_cal_') else key, params)
+               for key, params in dict_task_groups.items()]
+
+    findings = []
+    if potcar is not None:
+        findings.extend(IncarFinding('error', 'potcar-order', ('POTCAR',), error) for error in potcar.errors)
+        findings.append(IncarFinding('info', 'potcar-encut', ('ENCUT',),
+                                     f"ENCUT = {potcar.encut} from the POTCAR replaces the standard "
+                                     f"{STANDARD_DEFAULTS['d_elec']['ENCUT']}"))
+    findings.extend(get_rule_set().check_layers(layers))
+
+    return {
+        'content': render_incar(standard, dict_tasks, dict_task_groups),
+        'standard': standard,
+        'params': dict_tasks,
+        'task_groups': dict_task_groups,
+        'messages': messages,
+        'validation': findings
+    }
+
+
+def build_incar_in_dir(directory, tasks, potcar=False):
+    """Build the INCAR for the job in directory; with potcar, its POTCAR sets ENCUT and is checked."""
+    header = find_poscar_header([os.path.join(directory, 'POSCAR'),
+                                 os.path.join(directory, '01', 'POSCAR')], strict=True)
+    potcar_error = None
+    if not potcar:
+        potcar = None
+    else:
+        try:
+            _, potcar = potcar_settings_in_dir(directory, header)
+            if potcar is None:
+                potcar_error = 'no POTCAR in the folder'
+        except (OSError, ValueError) as e:
+            potcar, potcar_error = None, e
+    result = build_incar(tasks, header=header, images=count_neb_images(directory), potcar=potcar)
+    if potcar_error is not None:
+        result['messages'].append(f"POTCAR not used: {potcar_error}")
+        result['validation'].insert(0, IncarFinding('warning', 'potcar-missing', ('ENCUT',),
+                                                    f"ENCUT not taken from the POTCAR: {potcar_error}"))
+    result['header'] = header
+    result['potcar'] = potcar
+    return result
+
+
+def _atomic_write(path, content, mode=None):
+    """Write content (str or bytes) to path through a temporary file and a rename; returns its os.stat_result."""
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(path))
+    if mode is None:
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except OSError:
+            mode = 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        data = content if isinstance(content, bytes) else content.encode('utf-8')
+        while data:
+            data = data[os.write(fd, data):]
+        os.fchmod(fd, mode)
+        stat = os.fstat(fd)
+        os.close(fd)
+        fd = None
+        os.replace(tmp_path, path)
+        return stat
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        os.unlink(tmp_path)
+        raise
+
+
+def write_if_changed(path, content, known=None):
+    """Write content to path unless the file already holds it; returns (written, (size, mtime_ns, sha256))."""
+    import hashlib
+    data = content.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = None
+    if stat is not None and stat.st_size == len(data):
+        if known is not None and tuple(known[:2]) == (stat.st_size, stat.st_mtime_ns):
+            unchanged = known[2] == digest
+        else:
+            with open(path, 'rb') as f:
+                unchanged = f.read() == data
+        if unchanged:
+            return False, (stat.st_size, stat.st_mtime_ns, digest)
+    stat = _atomic_write(path, data, None if stat is None else stat.st_mode & 0o7777)
+    return True, (stat.st_size, stat.st_mtime_ns, digest)
+
+
+class IncarDocument:
+    """An INCAR file parsed once for any number of in-memory edits, matched by exact tag name."""
+
+    def __init__(self, text=''):
+        self._lines = []  # [statements, comment, original text or None once edited]
+        self._index = {}  # TAG -> list of line numbers holding it, in file order
+        self._final_newline = text.endswith('\n') or not text
+        for line in text.splitlines():
+            self._append_line(line)
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'r') as f:
+            return cls(f.read())
+
+    @staticmethod
+    def _parse_line(line):
+        # ';', '#' and '!' inside a quoted value such as SYSTEM = "a; b" are text
+        parts, comment, start, quoted = [], '', 0, False
+        for i, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif quoted:
+                continue
+            elif char == ';':
+                parts.append(line[start:i])
+                start = i + 1
+            elif char in '#!':
+                comment = line[i:]
+                break
+        parts.append(line[start:len(line) - len(comment)])
+        statements = []
+        for statement in parts:
+            if '=' in statement:
+                name, value = statement.split('=', 1)
+                if name.strip():
+                    statements.append([name.strip(), value.strip()])
+            elif statement.strip():
+                # Not a parameter; keep the text as it is
+                statements.append([None, statement.strip()])
+        return statements, comment
+
+    def _append_line(self, text, statements=None, comment=''):
+        if statements is None:
+            statements, comment = self._parse_line(text)
+        lineno = len(self._lines)
+        self._lines.append([statements, comment, text])
+        for name, _ in statements:
+            if name is not None:
+                self._index.setdefault(name.upper(), []).append(lineno)
+
+    def __contains__(self, name):
+        return bool(self._index.get(name.upper()))
+
+    def get(self, name, default=None):
+        """Return the value of the first statement setting name, or default."""
+        for lineno in self._index.get(name.upper(), []):
+            for key, value in self._lines[lineno][0]:
+                if key is not None and key.upper() == name.upper():
+                    return value
+        return default
+
+    def params(self):
+        """Return {tag: value} of all statements; later duplicates win, as in VASP."""
+        params = {}
+        for statements, _, _ in self._lines:
+            for key, value in statements:
+                if key is not None:
+                    params[key.upper()] = value
+        return params
+
+    def set(self, name, value):
+        """Set name to value in place (dropping duplicates), or append it."""
+        lines = self._index.get(name.upper())
+        if not lines:
+            self._append_line(None, [[name, str(value)]])
+            return
+        if len(lines) == 1 and self.get(name) == str(value):
+            return  # Already set: leave the line as written
+        first = True
+        for lineno in lines:
+            line = self._lines[lineno]
+            kept = []
+            for statement in line[0]:
+                if statement[0] is not None and statement[0].upper() == name.upper():
+                    if not first:
+                        continue
+                    statement = [name, str(value)]
+                    first = False
+                kept.append(statement)
+            line[0] = kept
+            line[2] = None
+        self._index[name.upper()] = lines[:1]
+
+    def delete(self, name):
+        """Remove every statement setting name."""
+        for lineno in self._index.pop(name.upper(), []):
+            line = self._lines[lineno]
+            line[0] = [s for s in line[0] if s[0] is None or s[0].upper() != name.upper()]
+            line[2] = None
+
+    def apply(self, edits):
+        """Apply (name, value) edits in order; a value of None deletes the parameter."""
+        for name, value in edits:
+            if value is None:
+                self.delete(name)
+            else:
+                self.set(name, value)
+
+    def render(self):
+        """Return the INCAR text."""
+        out = []
+        for statements, comment, text in self._lines:
+            if text is not None:
+                out.append(text)
+                continue
+            if not statements:
+                # All statements deleted: the line goes, with its comment
+                continue
+            code = '; '.join(value if key is None else f'{key} = {value}'
+                             for key, value in statements)
+            out.append(f'{code} {comment}' if comment else code)
+        text = '\n'.join(out)
+        return text + '\n' if out and self._final_newline else text
+
+    def write(self, path):
+        """Write the document to path atomically; returns False if the file already matched."""
+        return write_if_changed(path, self.render())[0]
 
 
 def incar_alter(parameter, value):
@@ -296,27 +918,9 @@ def incar_alter(parameter, value):
         print("INCAR file not found.")
         return
 
-    f = open('INCAR', 'r')
-    lines = f.readlines()
-    f.close()
-    
-    is_or_not = False
-    with open('INCAR') as myfile:
-        if parameter in myfile.read():
-            is_or_not = True
-    
-    if is_or_not:
-        f = open('INCAR', 'w')
-        for line in lines:
-            if parameter in line:
-                f.write('%s = %s\n' % (parameter, value))
-            else:
-                f.write(line)
-        f.close()
-    else:
-        f = open('INCAR', 'a+')
-        f.write('%s = %s\n' % (parameter, value))
-        f.close()
+    incar = IncarDocument.read('INCAR')
+    incar.set(parameter, value)
+    incar.write('INCAR')
 
 
 def incar_delete(parameter):
@@ -325,14 +929,20 @@ def incar_delete(parameter):
         print("INCAR file not found.")
         return
 
-    f = open('INCAR', 'r')
-    lines = f.readlines()
-    f.close()
-    f = open('INCAR', 'w')
-    for line in lines:
-        if parameter not in line:
-            f.write(line)
-    f.close()
+    incar = IncarDocument.read('INCAR')
+    incar.delete(parameter)
+    incar.write('INCAR')
+
+
+def _apply_ncore(incar, ncore):
+    """Set NCORE in an IncarDocument, or remove it for finite differences (IBRION 5-8)."""
+    ibrion = incar.get('IBRION')
+    if ibrion is None:
+        return
+    if ibrion not in ['5', '6', '7', '8']:
+        incar.set('NCORE', ncore)
+    else:
+        incar.delete('NCORE')
 
 
 def set_ncore(ncore):
@@ -340,41 +950,1352 @@ def set_ncore(ncore):
     if not os.path.isfile('INCAR'):
         print('No INCAR found. Can not add the NCORE parameter to it.')
     else:
-        file_in = open('INCAR', 'r')
-        lines = file_in.readlines()
-        file_in.close()
-        for line in lines:
-            if 'IBRION' in line:
-                value = line.rstrip().split('=')[1].strip()
-                if value not in ['5', '6', '7', '8']:
-                    incar_alter('NCORE', ncore)
-                else:
-                    incar_delete('NCORE')
+        incar = IncarDocument.read('INCAR')
+        _apply_ncore(incar, ncore)
+        incar.write('INCAR')
 
 
 def similar(a, b):
     """Calculate similarity ratio between two strings."""
+    from difflib import SequenceMatcher
     return SequenceMatcher(None, a, b).ratio()
 
 
+# ============================================================================
+# Part 5: Batch generation over a project tree
+# ============================================================================
+
+def find_poscar_dirs(root):
+    """Return sorted job folders below root that contain a POSCAR, counting an NEB job once."""
+    folders = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        if '00' in dirnames and os.path.isfile(os.path.join(dirpath, '01', 'POSCAR')):
+            folders.append(dirpath)
+            dirnames[:] = [d for d in dirnames if not d.isdigit()]
+        elif 'POSCAR' in filenames:
+            folders.append(dirpath)
+    return sorted(folders)
+
+
+def find_neb_jobs(root):
+    """Return sorted NEB job folders below root: folders with 00 and more two-digit image folders."""
+    jobs = []
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                subdirs = [e.name for e in entries if not e.name.startswith('.') and e.is_dir()]
+        except OSError:
+            continue
+        images = [d for d in subdirs if len(d) == 2 and d.isdigit()]
+        if '00' in images and len(images) >= 2:
+            jobs.append(path)
+            subdirs = [d for d in subdirs if d not in images]
+        stack.extend(os.path.join(path, d) for d in subdirs)
+    return sorted(jobs)
+
+
+class BatchResult(namedtuple('BatchResult', ['folder', 'error', 'written', 'messages'])):
+    """Outcome of one batch folder; error is None on success."""
+    __slots__ = ()
+
+
+# Default name of batch_generate's manifest, kept in the project root
+WRITE_MANIFEST = '.incar_manifest.json'
+
+
+def load_write_manifest(path):
+    """Return the {INCAR path: stamp} manifest saved at path ({} if missing or unreadable)."""
+    import json
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_write_manifest(path, manifest):
+    """Save a {INCAR path: stamp} manifest atomically."""
+    import json
+    _atomic_write(path, json.dumps(manifest, separators=(',', ':'), sort_keys=True))
+
+
+def _generate_in_folder(folder, tasks, known=None, kpoints=None, potcar=False):
+    """Generate the INCAR (and KPOINTS) inside one folder, returning (folder, error, written, stamp, messages)."""
+    try:
+        if kpoints is None:
+            result = build_incar_in_dir(folder, tasks, potcar)
+        else:
+            result = build_input_set(folder, tasks, potcar=potcar, **kpoints)
+        written, stamp = write_if_changed(os.path.join(folder, 'INCAR'), result['content'], known)
+        if kpoints is not None and result['kpoints_content'] is not None:
+            written = write_if_changed(os.path.join(folder, 'KPOINTS'), result['kpoints_content'])[0] or written
+        return folder, None, written, stamp, result['messages']
+    except Exception as e:
+        return folder, f'{type(e).__name__}: {e}', False, None, []
+
+
+def _generate_chunk(folders, tasks, known=None, kpoints=None, potcar=False):
+    """Process-pool entry point: return the folder results and the PotcarIndex additions of one chunk."""
+    known = known or {}
+    results = [_generate_in_folder(folder, tasks, known.get(os.path.join(folder, 'INCAR')), kpoints, potcar)
+               for folder in folders]
+    return results, get_potcar_index().additions() if potcar else None
+
+
+def batch_generate(folders, tasks, workers=None, chunksize=None, progress=None, manifest=None,
+                   kpoints=None, potcar=False):
+    """Generate INCARs for the given tasks in many folders (or below one root) on a process pool."""
+    if isinstance(folders, (str, os.PathLike)):
+        folders = find_poscar_dirs(folders)
+    folders = [os.path.abspath(f) for f in folders]
+
+    registry = get_task_registry()
+    unsupported = [task for task in tasks if task not in registry.by_name]
+    if unsupported:
+        raise ValueError(_unsupported_tasks_message(unsupported))
+
+    total = len(folders)
+    results = []
+    if not total:
+        return results
+
+    stamps = load_write_manifest(manifest) if manifest else {}
+    stamps_before = dict(stamps)
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, total)
+    if chunksize is None:
+        # A few chunks per worker keeps the pool balanced without paying
+        # one round trip per folder.
+        chunksize = max(1, min(64, total // (workers * 4)))
+
+    index = get_potcar_index() if potcar else None
+
+    def _report(chunk):
+        chunk_results, potcar_additions = chunk
+        if index is not None:
+            index.merge(potcar_additions)
+        for folder, error, written, stamp, messages in chunk_results:
+            results.append(BatchResult(folder, error, written, messages))
+            if manifest:
+                incar = os.path.join(folder, 'INCAR')
+                if stamp is None:
+                    stamps.pop(incar, None)
+                else:
+                    stamps[incar] = list(stamp)
+            if progress:
+                progress(len(results), total, folder, error)
+
+    def _known(chunk):
+        # Only the stamps of its own folders are sent to a worker
+        if not stamps:
+            return None
+        return {path: stamps[path] for path in (os.path.join(f, 'INCAR') for f in chunk) if path in stamps}
+
+    chunks = [folders[i:i + chunksize] for i in range(0, total, chunksize)]
+    if workers == 1:
+        for chunk in chunks:
+            _report(_generate_chunk(chunk, tasks, _known(chunk), kpoints, potcar))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_generate_chunk, chunk, tasks, _known(chunk), kpoints, potcar) for chunk in chunks]
+            for future in as_completed(futures):
+                _report(future.result())
+
+    if manifest and stamps != stamps_before:
+        save_write_manifest(manifest, stamps)
+    if index is not None:
+        try:
+            index.save()
+        except OSError:
+            pass
+    return results
+
+
+def find_incar_files(target):
+    """Return sorted INCAR paths for a directory (searched recursively) or a glob pattern."""
+    if os.path.isdir(target):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(target):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            if 'INCAR' in filenames:
+                paths.append(os.path.join(dirpath, 'INCAR'))
+        return sorted(paths)
+    import glob
+    return sorted(p for p in glob.glob(target, recursive=True) if os.path.isfile(p))
+
+
+def edit_incar_file(path, edits, ncore=None, dry_run=False):
+    """Apply edits and the set_ncore rule to one INCAR, returning (path, changed, diff, error)."""
+    try:
+        with open(path, 'r') as f:
+            original = f.read()
+        incar = IncarDocument(original)
+        incar.apply(edits)
+        if ncore is not None:
+            _apply_ncore(incar, ncore)
+        updated = incar.render()
+        if updated == original:
+            return path, False, '', None
+
+        import difflib
+        diff = ''.join(difflib.unified_diff(
+            original.splitlines(True), updated.splitlines(True),
+            fromfile=path, tofile=path
+        ))
+        if not dry_run:
+            _atomic_write(path, updated)
+        return path, True, diff, None
+    except Exception as e:
+        return path, False, '', f'{type(e).__name__}: {e}'
+
+
+def bulk_edit_incars(paths, edits, ncore=None, dry_run=False, workers=None, progress=None):
+    """Apply the same edits to many INCAR files on a thread pool, reporting progress as each completes."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    edits = list(edits)
+    workers = workers or min(64, (os.cpu_count() or 1) * 8)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(edit_incar_file, path, edits, ncore, dry_run): i
+                   for i, path in enumerate(paths)}
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            if progress:
+                progress(result)
+    return [results[i] for i in range(len(results))]
+
+
+# ============================================================================
+# Part 6: Compiled task registry
+# ============================================================================
+
+TASK_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'task_config.json')
+
+
+class TaskEntry(namedtuple('TaskEntry', ['key', 'name', 'display', 'category', 'params', 'aliases'])):
+    """One task preset, built-in (key d_cal_*) or from task_config.json, with read-only params."""
+    __slots__ = ()
+
+
+def task_display_name(key):
+    """Return the readable name of a built-in task key, e.g. d_cal_vdwD3bj -> vdW-D3-BJ."""
+    readable_name = key.replace('d_cal_', '')
+    # Handle special cases like vdwD3bj -> vdW-D3-BJ
+    if 'vdw' in readable_name.lower():
+        if 'bj' in readable_name:
+            readable_name = 'vdW-D3-BJ'
+        elif 'zero' in readable_name:
+            readable_name = 'vdW-D3-Zero'
+    elif 'ml' in readable_name.lower():
+        # ML cases: mltrain -> ML-Train
+        parts = readable_name.split('ml')
+        readable_name = 'ML-' + parts[1].capitalize()
+    else:
+        # Standard case: convert underscores to spaces and title case
+        readable_name = readable_name.replace('_', ' ').title()
+    return readable_name
+
+
+def normalize_task_name(name):
+    """Fold a task name for alias matching: case, spaces, '-', '_' and '+' are ignored."""
+    return ''.join(c for c in name.lower() if c not in ' -_+')
+
+
+class TaskRegistry:
+    """Immutable index of all task presets by key, name, display name, alias and category."""
+
+    def __init__(self, tasks=None, task_categories=None):
+        if tasks is None:
+            tasks = tasks_incar
+        entries = []
+        for key, params in tasks.items():
+            entries.append((key, key.split('_')[2].lower(), task_display_name(key), None, params))
+        for category, category_tasks in (task_categories or {}).items():
+            for task_name, task_data in category_tasks.items():
+                entries.append((task_name, task_name, task_name, category, task_data['params']))
+
+        by_key, by_name, by_display, by_alias, by_category = {}, {}, {}, {}, {}
+        for key, name, display, category, params in entries:
+            aliases = tuple(dict.fromkeys(normalize_task_name(n) for n in (key, name, display)))
+            entry = TaskEntry(key, name, display, category,
+                              MappingProxyType(dict(params)), aliases)
+            # Later task_config.json entries with the same name replace earlier ones
+            by_key[key] = entry
+            if category is None:
+                by_name.setdefault(name, entry)
+            else:
+                by_category.setdefault(category, []).append(entry)
+            by_display.setdefault(display.lower(), entry)
+            for alias in aliases:
+                by_alias.setdefault(alias, entry)
+
+        self.by_key = MappingProxyType(by_key)
+        self.by_name = MappingProxyType(by_name)
+        self.by_display = MappingProxyType(by_display)
+        self.by_alias = MappingProxyType(by_alias)
+        self.by_category = MappingProxyType({k: tuple(v) for k, v in by_category.items()})
+
+    def __len__(self):
+        return len(self.by_key)
+
+    def __contains__(self, key):
+        return key in self.by_key
+
+    def entries(self):
+        return list(self.by_key.values())
+
+    def names(self):
+        """Return the sorted canonical names of the built-in tasks."""
+        return sorted(self.by_name)
+
+    def find_display(self, display):
+        """Return the entry with this display name (case-insensitive), or None."""
+        return self.by_display.get(display.lower())
+
+    def lookup(self, name):
+        """Resolve a task by canonical name, display name or alias, or return None."""
+        entry = self.by_name.get(name)
+        if entry is None:
+            entry = self.by_display.get(name.lower())
+        if entry is None:
+            entry = self.by_alias.get(normalize_task_name(name))
+        return entry
+
+
+def load_task_config(path=None):
+    """Load the task categories from task_config.json ({} if the file is missing)."""
+    path = path or TASK_CONFIG_PATH
+    if not os.path.isfile(path):
+        return {}
+    import json
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def validate_task_config(task_categories):
+    """Check loaded task_config.json data ({category: {task: {"params": {TAG: value}}}}); raises ValueError."""
+    if not isinstance(task_categories, dict) or not task_categories:
+        raise ValueError('task_config.json must be a non-empty object of categories')
+    for category, category_tasks in task_categories.items():
+        if not isinstance(category_tasks, dict):
+            raise ValueError(f'Category {category!r} must map task names to presets')
+        for task_name, task_data in category_tasks.items():
+            where = f'{category}/{task_name}'
+            if not str(task_name).strip():
+                raise ValueError(f'Empty task name in category {category!r}')
+            if not isinstance(task_data, dict) or not isinstance(task_data.get('params'), dict):
+                raise ValueError(f'{where}: expected an object with a "params" object')
+            for tag, value in task_data['params'].items():
+                if not tag.strip() or any(c.isspace() or c in '=#!' for c in tag.strip()):
+                    raise ValueError(f'{where}: invalid INCAR tag {tag!r}')
+                if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    raise ValueError(f'{where}: value of {tag} must be a string or number')
+
+
+def build_task_registry(task_categories=None):
+    """Build a TaskRegistry from tasks_incar and the given task_config.json categories."""
+    return TaskRegistry(tasks_incar, task_categories)
+
+
+_task_registry = None
+
+
+def get_task_registry():
+    """Return the shared registry of tasks_incar and task_config.json, building it on first use."""
+    global _task_registry
+    if _task_registry is None:
+        _task_registry = build_task_registry(load_task_config())
+    return _task_registry
+
+
+class Suggestion(namedtuple('Suggestion', ['text', 'kind', 'target', 'score'])):
+    """One ranked candidate: matched text, kind ('task', 'preset' or 'tag'), target name and 0-1 score."""
+    __slots__ = ()
+
+
+def _trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestionIndex:
+    """"Did you mean" and autocomplete lookups over task names and INCAR tags, through a trigram index."""
+
+    # Trigram candidates rescored with SequenceMatcher per lookup
+    POOL_SIZE = 32
+
+    def __init__(self, items=()):
+        """items: iterable of (text, kind, target)."""
+        entries, seen = [], set()
+        for text, kind, target in items:
+            key = normalize_task_name(text)
+            if key and (key, kind, target) not in seen:
+                seen.add((key, kind, target))
+                entries.append((key, text, kind, target))
+
+        postings = {}
+        for i, (key, _, _, _) in enumerate(entries):
+            for trigram in _trigrams(key):
+                postings.setdefault(trigram, []).append(i)
+
+        self._entries = entries
+        self._sizes = [len(_trigrams(key)) for key, _, _, _ in entries]
+        self._postings = postings
+        self._sorted = sorted((key, i) for i, (key, _, _, _) in enumerate(entries))
+        self._keys = [key for key, _ in self._sorted]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def complete(self, prefix, limit=10, kinds=None):
+        """Return up to limit names starting with prefix (shortest first), topped up with fuzzy matches."""
+        from bisect import bisect_left
+        key = normalize_task_name(prefix)
+        if not key or limit <= 0:
+            return []
+
+        matches = []
+        for i in range(bisect_left(self._keys, key), len(self._keys)):
+            entry_key, index = self._sorted[i]
+            if not entry_key.startswith(key):
+                break
+            if kinds is None or self._entries[index][2] in kinds:
+                matches.append(index)
+        matches.sort(key=lambda i: (len(self._entries[i][0]), self._entries[i][0]))
+
+        results, seen = [], set()
+        for index in matches:
+            _, text, kind, target = self._entries[index]
+            if (kind, target) not in seen:
+                seen.add((kind, target))
+                results.append(Suggestion(text, kind, target, 1.0))
+                if len(results) == limit:
+                    return results
+
+        for suggestion in self.suggest(prefix, limit, kinds):
+            if (suggestion.kind, suggestion.target) not in seen:
+                seen.add((suggestion.kind, suggestion.target))
+                results.append(suggestion)
+                if len(results) == limit:
+                    break
+        return results
+
+    def suggest(self, query, limit=5, kinds=None, cutoff=0.6):
+        """Return up to limit close matches for query, best first."""
+        key = normalize_task_name(query)
+        if not key or limit <= 0:
+            return []
+
+        query_trigrams = _trigrams(key)
+        shared = {}
+        for trigram in query_trigrams:
+            for index in self._postings.get(trigram, ()):
+                shared[index] = shared.get(index, 0) + 1
+        # Take the names sharing the most trigrams, then order those by the
+        # Dice coefficient (ties go to similar lengths)
+        by_count = {}
+        for index, count in shared.items():
+            if kinds is None or self._entries[index][2] in kinds:
+                by_count.setdefault(count, []).append(index)
+        pool = []
+        for count in sorted(by_count, reverse=True):
+            pool.extend(by_count[count])
+            if len(pool) >= self.POOL_SIZE:
+                break
+        size = len(query_trigrams)
+        pool.sort(key=lambda i: (-2.0 * shared[i] / (size + self._sizes[i]),
+                                 abs(len(self._entries[i][0]) - len(key))))
+
+        scored = {}
+        for index in pool[:self.POOL_SIZE]:
+            entry_key, text, kind, target = self._entries[index]
+            score = similar(key, entry_key)
+            if score >= cutoff and score > scored.get((kind, target), (0,))[0]:
+                scored[(kind, target)] = (score, text)
+
+        ranked = sorted(scored.items(), key=lambda item: (-item[1][0], len(item[1][1]), item[1][1]))
+        return [Suggestion(text, kind, target, round(score, 3))
+                for (kind, target), (score, text) in ranked[:limit]]
+
+
+def build_suggestion_index(registry=None):
+    """Index the tasks and presets of a registry and all INCAR tags they and standard_incar use."""
+    registry = registry or get_task_registry()
+    items = []
+    tags = {}
+    for params in standard_incar.values():
+        tags.update(dict.fromkeys(params))
+    for entry in registry.entries():
+        if entry.category is None:
+            items.append((entry.name, 'task', entry.name))
+            items.append((entry.display, 'task', entry.name))
+        else:
+            items.append((entry.display, 'preset', entry.display))
+        tags.update(dict.fromkeys(entry.params))
+    items.extend((tag, 'tag', tag) for tag in tags)
+    return SuggestionIndex(items)
+
+
+_suggestion_index = None
+
+
+def get_suggestion_index():
+    """Return the suggestion index of the shared registry, building it on first use."""
+    global _suggestion_index
+    if _suggestion_index is None:
+        _suggestion_index = build_suggestion_index(get_task_registry())
+    return _suggestion_index
+
+
+def did_you_mean(name, kinds=('task',), limit=3):
+    """Return the close task (or, with kinds, tag) names for an unknown name."""
+    return [s.target for s in get_suggestion_index().suggest(name, limit, kinds)]
+
+
+def _unsupported_tasks_message(tasks):
+    parts = []
+    for task in tasks:
+        names = did_you_mean(task)
+        parts.append(f"{task} (did you mean: {', '.join(names)}?)" if names else task)
+    return f"Unsupported tasks: {', '.join(parts)}"
+
+
 # ============================================================================
 # Utility functions
 # ============================================================================
 
 def get_available_tasks():
     """Return list of available task names."""
-    return sorted(tasks_recorded)
+    return get_task_registry().names()
 
 
 def get_task_params(task_name):
     """Get parameters for a specific task."""
-    task_name_lower = task_name.lower()
-    for key, params in tasks_incar.items():
-        if task_name_lower == key.split('_')[2].lower():
-            return params
-    return None
+    entry = get_task_registry().by_name.get(task_name.lower())
+    if entry is None:
+        return None
+    return dict(entry.params)
 
 
 def get_standard_params():
     """Return the standard INCAR parameters."""
     return standard_incar.copy()
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss counters."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        import threading
+        self._data = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._event_class = threading.Event
+
+    def get(self, key, default=None):
+        """Return the cached value for key (marking it recently used), or default."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, calling compute() once for concurrent misses."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            event = self._pending.get(key)
+            owner = event is None
+            if owner:
+                event = self._pending[key] = self._event_class()
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                if key in self._data:
+                    return self._data[key]
+            # The computation we waited for failed (or was evicted already)
+            return compute()
+
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    def pop(self, key, default=None):
+        """Remove key and return its value, or default if it is not cached."""
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return size and hit/miss counters as a dict."""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }
+
+
+# ============================================================================
+# Part 7: INCAR validation rules
+# ============================================================================
+
+SEVERITIES = ('error', 'warning', 'info')
+
+# Condition meaning "this tag must not be set"
+MISSING = object()
+
+
+class IncarRule(namedtuple('IncarRule', ['id', 'severity', 'when', 'message'])):
+    """A consistency rule: when maps tags to conditions (None: set, MISSING: not set, or a predicate)."""
+    __slots__ = ()
+
+    @property
+    def anchor(self):
+        return next((tag for tag, test in self.when.items() if test is not MISSING), None)
+
+
+class IncarFinding(namedtuple('IncarFinding', ['severity', 'rule', 'tags', 'message'])):
+    """A problem found in an INCAR: severity, rule id, the tags involved and a message."""
+    __slots__ = ()
+
+
+def _is_true(value):
+    return value.strip().upper().lstrip('.').startswith('T')
+
+
+def _as_int(value):
+    try:
+        return int(float(value.split()[0]))
+    except (ValueError, IndexError):
+        return None
+
+
+def _one_of(*choices):
+    """Condition: the value (first word, case-insensitive) is one of choices."""
+    choices = frozenset(choice.upper() for choice in choices)
+    return lambda value: value.split()[0].upper() in choices if value.split() else False
+
+
+def _int_in(values):
+    """Condition: the value is an integer in values (e.g. a range)."""
+    return lambda value: _as_int(value) in values
+
+
+def _int_not_in(values):
+    """Condition: the value is an integer that is not in values."""
+    return lambda value: _as_int(value) is not None and _as_int(value) not in values
+
+
+INCAR_RULES = (
+    IncarRule('hybrid-algo', 'error',
+              {'LHFCALC': _is_true, 'ALGO': _one_of('F', 'FAST', 'VF', 'VERYFAST', 'V')},
+              'ALGO = {ALGO} does not work with LHFCALC = {LHFCALC}; use ALGO = Damped, All or Normal'),
+    IncarRule('finite-differences-ncore', 'error',
+              {'IBRION': _int_in(range(5, 9)), 'NCORE': _int_not_in((1,))},
+              'IBRION = {IBRION} (finite differences) does not support NCORE = {NCORE}; remove NCORE'),
+    IncarRule('lepsilon-ncore', 'error',
+              {'LEPSILON': _is_true, 'NCORE': _int_not_in((1,))},
+              'LEPSILON = {LEPSILON} does not support NCORE = {NCORE}; remove NCORE'),
+    IncarRule('multiple-vdw', 'error',
+              {'LUSE_VDW': _is_true, 'IVDW': _int_not_in((0,))},
+              'IVDW = {IVDW} and LUSE_VDW = {LUSE_VDW} both add a vdW correction; choose one'),
+    IncarRule('non-selfconsistent-relaxation', 'error',
+              {'ICHARG': _int_in(range(10, 20)), 'NSW': _int_not_in((0,))},
+              'ICHARG = {ICHARG} keeps the charge density fixed and cannot be used with NSW = {NSW}'),
+    IncarRule('metagga-gga', 'warning',
+              {'METAGGA': None, 'GGA': None},
+              'GGA = {GGA} is set together with METAGGA = {METAGGA}; remove GGA'),
+    IncarRule('npar-ncore', 'warning',
+              {'NPAR': None, 'NCORE': None},
+              'NPAR = {NPAR} takes precedence over NCORE = {NCORE}; set only one of them'),
+    IncarRule('magmom-without-spin', 'warning',
+              {'MAGMOM': None, 'ISPIN': _int_in((1,))},
+              'MAGMOM is ignored with ISPIN = 1'),
+    IncarRule('ldau-without-u', 'warning',
+              {'LDAU': _is_true, 'LDAUU': MISSING},
+              'LDAU = {LDAU} is set without LDAUU, so no U values are applied'),
+    IncarRule('neb-ibrion', 'warning',
+              {'IMAGES': _int_not_in((0,)), 'IBRION': _int_not_in((1, 2, 3))},
+              'NEB with IMAGES = {IMAGES} needs IBRION = 1, 2 or 3, not {IBRION}'),
+    IncarRule('tetrahedron-relaxation', 'warning',
+              {'ISMEAR': _int_in((-5,)), 'NSW': _int_not_in((0,)), 'IBRION': _int_in((1, 2, 3))},
+              'ISMEAR = -5 gives inaccurate forces for relaxations; use ISMEAR = 0 or 1'),
+)
+
+
+class RuleSet:
+    """Rules compiled into an index from anchor tag (the first tag that must be set) to its rules."""
+
+    def __init__(self, rules=INCAR_RULES):
+        self.rules = tuple(rules)
+        by_anchor = {}
+        seen = set()
+        for rule in self.rules:
+            if rule.id in seen:
+                raise ValueError(f'Duplicate rule id: {rule.id}')
+            seen.add(rule.id)
+            if rule.severity not in SEVERITIES:
+                raise ValueError(f'Rule {rule.id}: unknown severity {rule.severity!r}')
+            if rule.anchor is None:
+                raise ValueError(f'Rule {rule.id} needs at least one tag that must be set')
+            tests = tuple((tag.upper(), test) for tag, test in rule.when.items())
+            by_anchor.setdefault(rule.anchor.upper(), []).append((rule, tests))
+        self.by_anchor = MappingProxyType({tag: tuple(entries) for tag, entries in by_anchor.items()})
+
+    def check(self, params):
+        """Return the IncarFindings of the rules that fire for {tag: value} params."""
+        params = {str(tag).upper(): str(value) for tag, value in params.items()}
+        findings = []
+        for tag in params:
+            for rule, tests in self.by_anchor.get(tag, ()):
+                for name, test in tests:
+                    value = params.get(name)
+                    if test is MISSING:
+                        if value is not None:
+                            break
+                    elif value is None or (test is not None and not test(value)):
+                        break
+                else:
+                    findings.append(IncarFinding(
+                        rule.severity, rule.id, tuple(t for t, test in tests if test is not MISSING),
+                        rule.message.format_map(params)))
+        findings.sort(key=lambda finding: SEVERITIES.index(finding.severity))
+        return findings
+
+    def check_layers(self, layers):
+        """Check (kind, name, params) layers of increasing priority, also reporting every replaced value."""
+        effective, origin = {}, {}
+        findings = []
+        for kind, name, params in layers:
+            for tag, value in params.items():
+                tag = str(tag).upper()
+                value = ' '.join(str(value).split())
+                previous = effective.get(tag)
+                if previous is not None and previous != value:
+                    previous_kind, previous_name = origin[tag]
+                    conflict = kind == 'task' and previous_kind == 'task'
+                    findings.append(IncarFinding(
+                        'warning' if conflict else 'info',
+                        'task-conflict' if conflict else 'override', (tag,),
+                        f'{tag} = {value} from {name} replaces {tag} = {previous} from {previous_name}'))
+                effective[tag] = value
+                origin[tag] = (kind, name)
+        findings = self.check(effective) + findings
+        findings.sort(key=lambda finding: SEVERITIES.index(finding.severity))
+        return findings
+
+
+_rule_set = None
+
+
+def get_rule_set():
+    """Return the RuleSet of INCAR_RULES, compiling it on first use."""
+    global _rule_set
+    if _rule_set is None:
+        _rule_set = RuleSet(INCAR_RULES)
+    return _rule_set
+
+
+_incar_patterns = None
+
+
+def parse_incar_params(text):
+    """Return {TAG: value} of INCAR text like IncarDocument.params, with a regex fast path for unquoted text."""
+    global _incar_patterns
+    if '"' in text:
+        # Quoted values may hold ';', '#' or '!'
+        return IncarDocument(text).params()
+    if _incar_patterns is None:
+        _incar_patterns = (re.compile(r'[#!][^\n]*'), re.compile(r'(?m)(?:^|;)([^=;\n]*)=([^;\n]*)'))
+    comment, statement = _incar_patterns
+    params = {}
+    for name, value in statement.findall(comment.sub('', text)):
+        name = name.strip()
+        if name:
+            params[name.upper()] = value.strip()
+    return params
+
+
+def validate_incar_file(path, rules=None, cache=None):
+    """Check one INCAR file (cache maps contents to findings); returns (path, findings, error)."""
+    rules = rules or get_rule_set()
+    try:
+        with open(path, 'r') as f:
+            text = f.read()
+        if cache is None:
+            return path, rules.check(parse_incar_params(text)), None
+        return path, cache.get_or_compute(text, lambda: rules.check(parse_incar_params(text))), None
+    except Exception as e:
+        return path, [], f'{type(e).__name__}: {e}'
+
+
+def audit_incar_files(paths, rules=None, workers=None, progress=None):
+    """Check many INCAR files on a thread pool, like bulk_edit_incars."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    rules = rules or get_rule_set()
+    cache = LRUCache(maxsize=4096)
+    workers = workers or min(64, (os.cpu_count() or 1) * 8)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(validate_incar_file, path, rules, cache): i for i, path in enumerate(paths)}
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            if progress:
+                progress(result)
+    return [results[i] for i in range(len(results))]
+
+
+# ============================================================================
+# Part 8: Parallelization planner (NCORE, KPAR, NPAR)
+# ============================================================================
+
+# Noble-gas cores, used to guess valence electrons when no POTCAR is at hand
+_NOBLE_GAS_CORES = (0, 2, 10, 18, 36, 54, 86)
+
+
+def estimate_valence(element):
+    """Guess the valence electrons of the recommended PAW dataset of an element; raises ValueError if unknown."""
+    z = atomic_numbers.get(element)
+    if z is None:
+        raise ValueError(f'unknown element {element!r}')
+    core = max(c for c in _NOBLE_GAS_CORES if c < z) if z > 2 else 0
+    valence = z - core
+    if core >= 54 and valence > 16:
+        valence -= 14  # 4f
+    if core >= 18 and valence > 12:
+        valence -= 10  # filled d shell
+    return valence
+
+
+def estimate_nelect(header, zvals=None):
+    """Number of valence electrons: ZVAL per element from zvals, estimate_valence otherwise."""
+    zvals = zvals or {}
+    return sum(count * (zvals.get(element) or estimate_valence(element))
+               for element, count in zip(header.elements, header.counts))
+
+
+def estimate_nbands(nelect, natoms, ispin=1, noncollinear=False):
+    """VASP's default NBANDS for nelect electrons and natoms ions."""
+    nbands = max(int(round((nelect + 2) / 2)) + max(natoms // 2, 3), int(0.6 * nelect))
+    if ispin == 2:
+        nbands += natoms // 2
+    if noncollinear:
+        nbands *= 2
+    return nbands
+
+
+def kpoint_mesh(header, kspacing=0.25):
+    """Return the Gamma-centred mesh VASP would use for KSPACING = kspacing (1/Angstrom)."""
+    import math
+    return [max(1, math.ceil(length / kspacing)) for length in header.reciprocal_lengths()]
+
+
+def estimate_irreducible_kpoints(mesh):
+    """Rough irreducible k-point count of a mesh: time reversal only, no crystal symmetry."""
+    total = mesh[0] * mesh[1] * mesh[2]
+    return max(1, (total + 1) // 2)
+
+
+class ParallelPlan(namedtuple('ParallelPlan', [
+        'params', 'ncore', 'kpar', 'npar', 'nbands', 'nkpts', 'cores', 'notes'])):
+    """Parallel settings for one job; params maps INCAR tags to values, None to remove."""
+    __slots__ = ()
+
+
+def _divisors(n):
+    return [d for d in range(1, n + 1) if n % d == 0]
+
+
+def _ncore_target(natoms):
+    """Cores per band: small cells scale badly over many cores per band, large ones need them."""
+    if natoms < 20:
+        return 2
+    if natoms < 100:
+        return 4
+    if natoms < 400:
+        return 8
+    return 16
+
+
+def plan_parallel(header, cores_per_node, nodes=1, nkpts=None, nbands=None, nelect=None,
+                  incar=None, kspacing=None):
+    """Choose NCORE, KPAR and NPAR for the structure in header on nodes x cores_per_node cores."""
+    import math
+    if cores_per_node < 1 or nodes < 1:
+        raise ValueError('cores_per_node and nodes must be at least 1')
+    incar = {str(tag).upper(): str(value) for tag, value in (incar or {}).items()}
+    cores = cores_per_node * nodes
+    natoms = header.total_atoms
+    notes = []
+
+    if nkpts is None:
+        kspacing = _kspacing(incar, kspacing)
+        mesh = kpoint_mesh(header, kspacing)
+        nkpts = estimate_irreducible_kpoints(mesh)
+        notes.append(f'{nkpts} irreducible k-points estimated from a '
+                     f'{mesh[0]}x{mesh[1]}x{mesh[2]} mesh (KSPACING = {kspacing})')
+    if nbands is None:
+        nbands = _as_int(incar['NBANDS']) if 'NBANDS' in incar else None
+    if nbands is None:
+        nelect = nelect if nelect is not None else estimate_nelect(header)
+        noncollinear = any(_is_true(incar.get(tag, 'F')) for tag in ('LNONCOLLINEAR', 'LSORBIT'))
+        nbands = estimate_nbands(nelect, natoms, _as_int(incar.get('ISPIN', '1')) or 1, noncollinear)
+        notes.append(f'NBANDS estimated as {nbands} for {nelect:g} valence electrons')
+
+    hybrid = _is_true(incar.get('LHFCALC', 'F'))
+    no_ncore = (_as_int(incar.get('IBRION', '')) in range(5, 9)
+                or _is_true(incar.get('LEPSILON', 'F')) or _is_true(incar.get('LCALCEPS', 'F')))
+    if hybrid or no_ncore:
+        ncore = 1
+    else:
+        target = _ncore_target(natoms)
+        ncore = max(d for d in _divisors(cores_per_node) if d <= target)
+
+    # k-point groups: evenly loaded, aligned with node boundaries, each at
+    # least one band group, and without more band groups than bands
+    best = None
+    for kpar in _divisors(cores):
+        group = cores // kpar
+        if kpar > nkpts or group % ncore:
+            continue
+        if group % cores_per_node and cores_per_node % group:
+            continue
+        balance = nkpts / (kpar * math.ceil(nkpts / kpar))
+        score = (round(kpar * balance, 9), -kpar)
+        if best is None or score > best[0]:
+            best = (score, kpar)
+    if best is None:
+        raise ValueError(f'No KPAR fits {cores} cores with NCORE = {ncore}')
+    kpar = best[1]
+    group = cores // kpar
+    npar = group // ncore
+    if not hybrid and not no_ncore:
+        # More band groups than bands would leave cores idle
+        while npar > nbands and cores_per_node % (ncore * 2) == 0 and group % (ncore * 2) == 0:
+            ncore *= 2
+            npar = group // ncore
+
+    nbands_used = math.ceil(nbands / npar) * npar
+    if nbands_used > nbands:
+        notes.append(f'NBANDS is rounded up from {nbands} to {nbands_used} (a multiple of NPAR = {npar})')
+    if nkpts % kpar:
+        notes.append(f'{nkpts} k-points do not divide evenly over KPAR = {kpar}')
+    if kpar > 1 and natoms >= 400:
+        notes.append(f'KPAR = {kpar} raises the memory needed per core; lower it if the job runs out of memory')
+
+    if hybrid:
+        params = {'KPAR': str(kpar), 'NCORE': '1', 'NPAR': None}
+        notes.append(f'Hybrid functional: NCORE = 1, the {npar} cores of each KPAR group work on separate bands; '
+                     'the cost grows with the square of the k-points')
+    elif no_ncore:
+        params = {'KPAR': str(kpar), 'NCORE': '1', 'NPAR': None}
+        notes.append('Finite differences / LEPSILON: NCORE > 1 is not supported, so NCORE = 1')
+    else:
+        params = {'KPAR': str(kpar), 'NCORE': str(ncore), 'NPAR': None}
+    return ParallelPlan(params, ncore, kpar, npar, nbands_used, nkpts, cores, notes)
+
+
+# ============================================================================
+# Part 9: POTCAR metadata (ENMAX, ZVAL, TITEL) and its on-disk index
+# ============================================================================
+
+class PotcarEntry(namedtuple('PotcarEntry', ['titel', 'symbol', 'element', 'enmax', 'enmin', 'zval'])):
+    """Header values of one dataset of a POTCAR, e.g. TITEL 'PAW_PBE Fe_pv 06Sep2000', symbol 'Fe_pv'."""
+    __slots__ = ()
+
+
+def _potcar_value(data, key, start, end):
+    """Return the text after 'key =' in data[start:end], up to ';' or the end of the line."""
+    at = data.find(key, start, end)
+    if at < 0:
+        return None
+    at = data.find(b'=', at, end) + 1
+    stop = data.find(b'\n', at, end)
+    text = bytes(data[at:stop if stop >= 0 else end]).decode('ascii', 'replace')
+    return text.split(';')[0].strip()
+
+
+def scan_potcar(data):
+    """Return the PotcarEntry of every dataset in POTCAR bytes (or an mmap), reading only the headers."""
+    entries = []
+    start = 0
+    while True:
+        titel_at = data.find(b'TITEL', start)
+        if titel_at < 0:
+            return entries
+        end = data.find(b'End of Dataset', titel_at)
+        end = len(data) if end < 0 else end
+        titel = _potcar_value(data, b'TITEL', titel_at, end)
+        words = titel.split()
+        symbol = words[1] if len(words) > 1 else words[0]
+        enmax = _potcar_value(data, b'ENMAX', titel_at, end)
+        enmin = _potcar_value(data, b'ENMIN', titel_at, end)
+        zval = _potcar_value(data, b'ZVAL', titel_at, end)
+        if enmax is None or zval is None:
+            raise ValueError(f'POTCAR dataset {titel!r} has no ENMAX or ZVAL')
+        entries.append(PotcarEntry(titel, symbol, _species_name(symbol), float(enmax),
+                                   float(enmin.split()[0]) if enmin else None, float(zval.split()[0])))
+        start = end + 1
+
+
+def _map_file(path):
+    """Return the content of path as an mmap (or b'' for an empty file), and the open file."""
+    import mmap
+    f = open(path, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b'', f
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), f
+    except BaseException:
+        f.close()
+        raise
+
+
+def read_potcar(path):
+    """Return the PotcarEntry list of the POTCAR at path, scanning the file (no index)."""
+    data, f = _map_file(path)
+    with f:
+        try:
+            return scan_potcar(data)
+        finally:
+            if data:
+                data.close()
+
+
+def default_potcar_index_path():
+    """INCAR_POTCAR_INDEX, or potcar_index.json in the user's cache directory."""
+    if os.environ.get('INCAR_POTCAR_INDEX'):
+        return os.environ['INCAR_POTCAR_INDEX']
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'incar-gen', 'potcar_index.json')
+
+
+class PotcarIndex:
+    """Persistent JSON index of POTCAR datasets by file sha256, and of job paths by (size, mtime_ns)."""
+
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path or default_potcar_index_path()
+        self.files = {}
+        self.datasets = {}
+        self.library = {}
+        self.dirty = False
+        self.scans = 0
+        self._added = {'files': {}, 'datasets': {}}
+        self._changed = set()  # paths added since load, the only ones save() checks
+        self._prune = False
+        self._loaded = False
+        import threading
+        self._lock = threading.RLock()
+
+    def _read_file(self):
+        import json
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data if isinstance(data, dict) and data.get('version') == self.VERSION else None
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        data = self._read_file() or {}
+        self.files = data.get('files', {})
+        self.datasets = data.get('datasets', {})
+        self.library = data.get('library', {})
+        self._loaded = True
+
+    def entries(self, path):
+        """Return the PotcarEntry list of the POTCAR at path, from the index when possible."""
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        with self._lock:
+            self._ensure_loaded()
+            known = self.files.get(path)
+            if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                cached = self.datasets.get(known[2])
+                if cached is not None:
+                    return [PotcarEntry(*entry) for entry in cached]
+
+        import hashlib
+        data, f = _map_file(path)
+        with f:
+            try:
+                digest = hashlib.sha256(data).hexdigest()
+                with self._lock:
+                    cached = self.datasets.get(digest)
+                if cached is None:
+                    entries = scan_potcar(data)
+                    self.scans += 1
+                else:
+                    entries = [PotcarEntry(*entry) for entry in cached]
+            finally:
+                if data:
+                    data.close()
+        with self._lock:
+            self.datasets[digest] = self._added['datasets'][digest] = [list(entry) for entry in entries]
+            self.files[path] = self._added['files'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+            self._changed.add(path)
+            self.dirty = True
+        return entries
+
+    def additions(self):
+        """Return and forget the files and datasets added since the last call (for merge())."""
+        with self._lock:
+            added, self._added = self._added, {'files': {}, 'datasets': {}}
+        return added
+
+    def merge(self, added):
+        """Take over the additions() of another process's index."""
+        if not added or not (added['files'] or added['datasets']):
+            return
+        with self._lock:
+            self._ensure_loaded()
+            self.datasets.update(added['datasets'])
+            self.files.update(added['files'])
+            self._changed.update(added['files'])
+            self.dirty = True
+
+    def index_library(self, root):
+        """Index every POTCAR below a library root (e.g. potpaw_PBE); returns {symbol: sha256}."""
+        root = os.path.realpath(root)
+        symbols = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            if 'POTCAR' in filenames:
+                path = os.path.join(dirpath, 'POTCAR')
+                try:
+                    self.entries(path)
+                except (OSError, ValueError):
+                    continue
+                symbols[os.path.basename(dirpath)] = self.files[os.path.realpath(path)][2]
+        with self._lock:
+            self._ensure_loaded()
+            self.library[root] = symbols
+            self.dirty = True
+        return symbols
+
+    def library_entry(self, symbol, root=None):
+        """Return the PotcarEntry for a library symbol such as 'Fe_pv', or None."""
+        with self._lock:
+            self._ensure_loaded()
+            roots = [os.path.realpath(root)] if root else list(self.library)
+            for library_root in roots:
+                digest = self.library.get(library_root, {}).get(symbol)
+                if digest and self.datasets.get(digest):
+                    return PotcarEntry(*self.datasets[digest][0])
+        return None
+
+    def save(self):
+        """Write the index if it changed, merged with the file's current content."""
+        with self._lock:
+            if not self.dirty:
+                return False
+            import json
+            on_disk = self._read_file() or {}
+            for key in ('files', 'datasets', 'library'):
+                merged = on_disk.get(key, {})
+                merged.update(getattr(self, key))
+                setattr(self, key, merged)
+            # Forget job folders that are gone: the ones added here, or all of them after prune()
+            for path in list(self.files if self._prune else self._changed):
+                if not os.path.isfile(path):
+                    self.files.pop(path, None)
+            used = {known[2] for known in self.files.values()}
+            used.update(digest for symbols in self.library.values() for digest in symbols.values())
+            self.datasets = {digest: entries for digest, entries in self.datasets.items() if digest in used}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            _atomic_write(self.path, json.dumps({
+                'version': self.VERSION, 'files': self.files,
+                'datasets': self.datasets, 'library': self.library
+            }, separators=(',', ':')))
+            self._changed = set()
+            self._prune = self.dirty = False
+            return True
+
+    def prune(self):
+        """Make the next save() check every indexed job folder, not only the new ones."""
+        with self._lock:
+            self._prune = self.dirty = True
+
+
+_potcar_index = None
+
+
+def get_potcar_index():
+    """Return this process's PotcarIndex at default_potcar_index_path()."""
+    global _potcar_index
+    if _potcar_index is None:
+        _potcar_index = PotcarIndex()
+    return _potcar_index
+
+
+class PotcarSettings(namedtuple('PotcarSettings', ['encut', 'nelect', 'nbands', 'errors'])):
+    """Values derived from the POTCAR datasets of a job; errors lists species-order problems."""
+    __slots__ = ()
+
+
+def check_potcar_order(header, entries):
+    """Return the problems of POTCAR datasets vs POSCAR species blocks (one dataset per block, same order)."""
+    if len(entries) != len(header.elements):
+        return [f"POTCAR has {len(entries)} datasets ({' '.join(e.symbol for e in entries)}) "
+                f"but POSCAR has {len(header.elements)} species ({' '.join(header.elements)})"]
+    return [f'Species {i + 1}: POSCAR has {element}, POTCAR has {entry.symbol}'
+            for i, (element, entry) in enumerate(zip(header.elements, entries))
+            if entry.element != element]
+
+
+def potcar_settings(entries, header=None, ispin=1, encut_factor=1.3):
+    """Derive ENCUT, NELECT and NBANDS from POTCAR entries (and the POSCAR header)."""
+    import math
+    encut = int(math.ceil(encut_factor * max(entry.enmax for entry in entries) / 10) * 10)
+    if header is None:
+        return PotcarSettings(encut, None, None, [])
+    errors = check_potcar_order(header, entries)
+    if errors:
+        return PotcarSettings(encut, None, None, errors)
+    nelect = sum(entry.zval * count for entry, count in zip(entries, header.counts))
+    return PotcarSettings(encut, nelect, estimate_nbands(nelect, header.total_atoms, ispin), [])
+
+
+def potcar_settings_in_dir(directory, header=None, index=None):
+    """Return (entries, PotcarSettings) for the POTCAR in directory, or (None, None) without one."""
+    path = os.path.join(directory, 'POTCAR')
+    if not os.path.isfile(path):
+        return None, None
+    entries = (index or get_potcar_index()).entries(path)
+    if not entries:
+        return None, None
+    return entries, potcar_settings(entries, header)
+
+
+# ============================================================================
+# Part 10: KPOINTS and the full input set from one structure read
+# ============================================================================
+
+KPOINTS_STYLES = ('Gamma', 'Monkhorst-Pack')
+
+
+class KpointsMesh(namedtuple('KpointsMesh', ['style', 'mesh', 'kspacing', 'notes'])):
+    """Automatic k-point mesh for a KPOINTS file: style is 'Gamma' or 'Monkhorst-Pack'."""
+    __slots__ = ()
+
+
+def _kpoints_style(style):
+    # VASP only reads the first letter of the style line
+    initial = str(style or 'Gamma').strip()[:1].upper()
+    if initial not in ('G', 'M'):
+        raise ValueError(f"Unknown KPOINTS style {style!r}: use one of {', '.join(KPOINTS_STYLES)}")
+    return KPOINTS_STYLES[0] if initial == 'G' else KPOINTS_STYLES[1]
+
+
+def _is_hexagonal(cell):
+    a, b, _ = cell
+    cos_gamma = sum(x * y for x, y in zip(a, b)) / (_norm(a) * _norm(b))
+    return abs(cos_gamma + 0.5) < 1e-3 and abs(_norm(a) - _norm(b)) < 1e-3 * _norm(a)
+
+
+def _kspacing(incar, kspacing=None):
+    """Return kspacing, else the KSPACING of the (upper-cased) INCAR parameters, else 0.25."""
+    if kspacing is not None:
+        return kspacing
+    try:
+        return float(incar['KSPACING']) if 'KSPACING' in incar else 0.25
+    except ValueError:
+        return 0.25
+
+
+def kpoints_for(header, incar=None, kspacing=None, style=None):
+    """Return the KpointsMesh for the structure in header and the job's INCAR parameters."""
+    incar = {str(tag).upper(): str(value) for tag, value in (incar or {}).items()}
+    style = _kpoints_style(style)
+    notes = []
+    kspacing = _kspacing(incar, kspacing)
+    if kspacing <= 0:
+        raise ValueError('The k-point spacing must be positive')
+    if 'KSPACING' in incar:
+        notes.append('The INCAR sets KSPACING, so VASP will ignore the KPOINTS file')
+
+    mesh = kpoint_mesh(header, kspacing)
+    idipol = _as_int(incar.get('IDIPOL', ''))
+    if idipol == 4:
+        mesh = [1, 1, 1]
+        style = KPOINTS_STYLES[0]
+        notes.append('IDIPOL = 4 (isolated molecule): Gamma point only')
+    elif idipol in (1, 2, 3):
+        mesh[idipol - 1] = 1
+        notes.append(f"Slab: one k-point along lattice vector {'abc'[idipol - 1]} (IDIPOL = {idipol})")
+    if style == KPOINTS_STYLES[1] and _is_hexagonal(header.cell()):
+        notes.append('Hexagonal cell: a Monkhorst-Pack mesh breaks its symmetry, Gamma is recommended')
+    return KpointsMesh(style, mesh, kspacing, notes)
+
+
+def render_kpoints(kpoints):
+    """Return the text of an automatic-mesh KPOINTS file for a KpointsMesh."""
+    return (f'Automatic mesh, KSPACING = {kpoints.kspacing:g} 1/Angstrom\n'
+            f'0\n'
+            f'{kpoints.style}\n'
+            f'  {kpoints.mesh[0]} {kpoints.mesh[1]} {kpoints.mesh[2]}\n'
+            f'  0 0 0\n')
+
+
+def build_input_set(directory, tasks, kspacing=None, kpoints_style=None, potcar=False):
+    """Build the INCAR and KPOINTS of the job in directory from a single POSCAR read."""
+    result = build_incar_in_dir(directory, tasks, potcar)
+    header = result['header']
+    if header is None:
+        result['messages'].append("POSCAR not found. Skipping KPOINTS.")
+        result['kpoints'] = result['kpoints_content'] = None
+        return result
+    incar = {k: v for params in result['standard'].values() for k, v in params.items()}
+    incar.update(result['params'])
+    kpoints = kpoints_for(header, incar, kspacing, kpoints_style)
+    result['messages'].extend(kpoints.notes)
+    result['kpoints'] = kpoints
+    result['kpoints_content'] = render_kpoints(kpoints)
+    return result
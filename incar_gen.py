@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+INCAR Generator Command Line Interface
+Generate INCAR files from the terminal using the incar_core module.
+
+Usage:
+    incar-gen dftu ispin --dir path/to/job       # same as: incar-gen generate ...
+    python3 incar_gen.py generate dftu ispin --dir path/to/job
+    python3 incar_gen.py generate single dipole --kpoints --dir path/to/slab
+    python3 incar_gen.py batch path/to/project single ispin --workers 16
+    python3 incar_gen.py edit path/to/project --set KPAR=4 --delete LREAL --dry-run
+    python3 incar_gen.py neb path/to/reactions
+    python3 incar_gen.py validate path/to/project
+    python3 incar_gen.py parallel --dir path/to/job --cores-per-node 128 --nodes 2 --write
+    python3 incar_gen.py potcar --dir path/to/job
+"""
+
+import argparse
+import os
+import sys
+
+import incar_core
+
+
+def cmd_generate(args):
+    """Generate INCAR (and with --kpoints KPOINTS) in a single job folder."""
+    try:
+        if args.kpoints:
+            result = incar_core.build_input_set(args.dir, args.tasks, args.kspacing, args.kpoints_style,
+                                                args.potcar_encut)
+        else:
+            result = incar_core.build_incar_in_dir(args.dir, args.tasks, args.potcar_encut)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    for message in result['messages']:
+        print(message)
+    for finding in result['validation']:
+        if finding.severity != 'info':
+            print(f'{finding.severity}: {finding.message} [{finding.rule}]', file=sys.stderr)
+
+    content = result['content']
+    if args.cores_per_node:
+        if result['header'] is None:
+            print('POSCAR not found. Skipping the NCORE/KPAR plan.')
+        else:
+            incar = incar_core.IncarDocument(content)
+            potcar = result['potcar']
+            kpoints = result.get('kpoints')
+            plan = _plan(args, result['header'], incar.params(), potcar.nelect if potcar else None,
+                         incar_core.estimate_irreducible_kpoints(kpoints.mesh) if kpoints else None)
+            if plan is None:
+                return 2
+            incar.apply(plan.params.items())
+            content = incar.render()
+
+    path = os.path.join(args.dir, 'INCAR')
+    if incar_core.write_if_changed(path, content)[0]:
+        print(f"INCAR written to {os.path.abspath(path)}")
+    else:
+        print(f"INCAR unchanged: {os.path.abspath(path)}")
+    if result.get('kpoints_content'):
+        path = os.path.join(args.dir, 'KPOINTS')
+        if incar_core.write_if_changed(path, result['kpoints_content'])[0]:
+            print(f"KPOINTS written to {os.path.abspath(path)}")
+        else:
+            print(f"KPOINTS unchanged: {os.path.abspath(path)}")
+    if args.potcar_encut:
+        _save_potcar_index(incar_core.get_potcar_index())
+    return 0
+
+
+def _save_potcar_index(index):
+    try:
+        index.save()
+    except OSError as e:
+        print(f'Could not save the POTCAR index {index.path}: {e}', file=sys.stderr)
+
+
+def cmd_batch(args):
+    """Generate INCARs in every job folder below a root directory."""
+    folders = incar_core.find_poscar_dirs(args.root)
+    if not folders:
+        print(f"No folders with a POSCAR found under {args.root}")
+        return 1
+
+    width = len(str(len(folders)))
+
+    def progress(done, total, folder, error):
+        if error is None:
+            if not args.quiet:
+                print(f"[{done:>{width}}/{total}] {folder}: ok")
+        else:
+            print(f"[{done:>{width}}/{total}] {folder}: FAILED - {error}", file=sys.stderr)
+
+    manifest = args.manifest
+    if manifest == '':
+        manifest = os.path.join(args.root, incar_core.WRITE_MANIFEST)
+    try:
+        results = incar_core.batch_generate(
+            folders, args.tasks, workers=args.workers,
+            chunksize=args.chunksize, progress=progress, manifest=manifest,
+            kpoints={'kspacing': args.kspacing, 'kpoints_style': args.kpoints_style} if args.kpoints else None,
+            potcar=args.potcar_encut
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    if not args.quiet:
+        noted = sorted((result for result in results if result.messages), key=lambda result: result.folder)
+        if noted:
+            print()
+        for result in noted:
+            print(f"{result.folder}:")
+            for message in result.messages:
+                print(f"    {message}")
+
+    failed = sum(1 for result in results if result.error is not None)
+    written = sum(1 for result in results if result.written)
+    files = 'INCAR/KPOINTS pairs' if args.kpoints else 'INCARs'
+    print(f"\n{written} {files} written, {len(results) - written - failed} unchanged, {failed} failed.")
+    return 1 if failed else 0
+
+
+class _EditAction(argparse.Action):
+    """Collect --set/--delete options into one ordered list of (name, value) edits."""
+
+    def __call__(self, parser, namespace, value, option_string=None):
+        edits = getattr(namespace, self.dest) or []
+        if option_string == '--delete':
+            edits.append((value, None))
+        else:
+            name, sep, tag_value = value.partition('=')
+            if not sep or not name.strip():
+                parser.error(f'--set expects TAG=VALUE, got {value!r}')
+            edits.append((name.strip(), tag_value.strip()))
+        setattr(namespace, self.dest, edits)
+
+
+def cmd_edit(args):
+    """Apply the same edits to many existing INCAR files."""
+    paths = []
+    for target in args.targets:
+        paths.extend(incar_core.find_incar_files(target))
+    paths = sorted(set(paths))
+    if not paths:
+        print('No INCAR files found.')
+        return 1
+    if not args.edits and args.ncore is None:
+        print('Nothing to do: give --set, --delete or --ncore.')
+        return 2
+
+    def progress(result):
+        path, changed, diff, error = result
+        if error is not None:
+            print(f'{path}: FAILED - {error}', file=sys.stderr)
+        elif args.dry_run:
+            if diff:
+                sys.stdout.write(diff)
+        elif changed or not args.quiet:
+            print(f"{path}: {'updated' if changed else 'unchanged'}")
+
+    results = incar_core.bulk_edit_incars(
+        paths, args.edits or [], ncore=args.ncore, dry_run=args.dry_run,
+        workers=args.workers, progress=progress
+    )
+
+    changed = sum(1 for _, c, _, error in results if c and error is None)
+    failed = sum(1 for *_, error in results if error is not None)
+    verb = 'would change' if args.dry_run else 'updated'
+    print(f"\n{len(results)} INCARs checked, {changed} {verb}, {failed} failed.")
+    return 1 if failed else 0
+
+
+COMMANDS = ('generate', 'batch', 'edit', 'neb', 'validate', 'parallel', 'potcar')
+
+
+def cmd_neb(args):
+    """Check the image folders of every NEB job below the given roots."""
+    jobs = []
+    for root in args.roots:
+        found = incar_core.find_neb_jobs(root)
+        # A root that is itself a job folder may hold no further jobs
+        jobs.extend(found or ([root] if incar_core.count_neb_images(root) is not None else []))
+    if not jobs:
+        print('No NEB jobs (folders with 00, 01, ... image folders) found.')
+        return 1
+
+    checks = incar_core.check_neb_jobs(sorted(set(jobs)), workers=args.workers)
+    for check in checks:
+        if check.ok:
+            if not args.quiet:
+                composition = ' '.join(f'{e}{n}' for e, n in zip(check.elements, check.counts))
+                print(f'{check.directory}: IMAGES = {check.images}  ({composition})')
+        else:
+            print(f'{check.directory}: IMAGES = {check.images}', file=sys.stderr)
+            for error in check.errors:
+                print(f'    {error}', file=sys.stderr)
+
+    failed = sum(1 for check in checks if not check.ok)
+    print(f"\n{len(checks)} NEB jobs checked, {failed} with problems.")
+    return 1 if failed else 0
+
+
+def cmd_validate(args):
+    """Check existing INCAR files against the INCAR consistency rules."""
+    paths = []
+    for target in args.targets:
+        paths.extend(incar_core.find_incar_files(target))
+    paths = sorted(set(paths))
+    if not paths:
+        print('No INCAR files found.')
+        return 1
+
+    shown = incar_core.SEVERITIES[:incar_core.SEVERITIES.index(args.severity) + 1]
+    counts = dict.fromkeys(incar_core.SEVERITIES, 0)
+
+    def progress(result):
+        path, findings, error = result
+        if error is not None:
+            print(f'{path}: FAILED - {error}', file=sys.stderr)
+            return
+        for finding in findings:
+            counts[finding.severity] += 1
+            if finding.severity in shown:
+                print(f'{path}: {finding.severity}: {finding.message} [{finding.rule}]')
+
+    results = incar_core.audit_incar_files(paths, workers=args.workers, progress=progress)
+
+    failed = sum(1 for *_, error in results if error is not None)
+    print(f"\n{len(results)} INCARs checked: {counts['error']} errors, "
+          f"{counts['warning']} warnings, {failed} unreadable.")
+    return 1 if counts['error'] or failed else 0
+
+
+def _plan(args, header, incar_params, nelect=None, nkpts=None):
+    """Run plan_parallel with the command line layout and print the plan (None on error)."""
+    try:
+        plan = incar_core.plan_parallel(
+            header, args.cores_per_node, args.nodes, nkpts=args.nkpts or nkpts, nbands=args.nbands,
+            nelect=nelect, incar=incar_params, kspacing=args.kspacing)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return None
+    settings = ', '.join(f'{tag} = {value}' for tag, value in plan.params.items() if value is not None)
+    details = [] if plan.params.get('NPAR') else [f'NPAR = {plan.npar}']
+    details += [f'NBANDS = {plan.nbands}', f'{plan.nkpts} k-points']
+    print(f"{settings} on {plan.cores} cores ({', '.join(details)})")
+    for note in plan.notes:
+        print(f'    {note}')
+    return plan
+
+
+def cmd_parallel(args):
+    """Recommend NCORE, KPAR and NPAR for the job in a folder."""
+    header = incar_core.find_poscar_header([os.path.join(args.dir, 'POSCAR'),
+                                            os.path.join(args.dir, '01', 'POSCAR')])
+    if header is None:
+        print(f'No POSCAR found in {args.dir}', file=sys.stderr)
+        return 1
+    path = os.path.join(args.dir, 'INCAR')
+    incar = incar_core.IncarDocument.read(path) if os.path.isfile(path) else None
+    try:
+        _, potcar = incar_core.potcar_settings_in_dir(args.dir, header)
+    except (OSError, ValueError):
+        potcar = None
+    plan = _plan(args, header, incar.params() if incar else None, potcar.nelect if potcar else None)
+    if plan is None:
+        return 2
+    if args.write:
+        if incar is None:
+            print(f'No INCAR in {args.dir} to update.', file=sys.stderr)
+            return 1
+        incar.apply(plan.params.items())
+        print(f"INCAR {'updated' if incar.write(path) else 'unchanged'}: {os.path.abspath(path)}")
+    return 0
+
+
+def cmd_potcar(args):
+    """Show the POTCAR datasets of a job and the settings derived from them, or index a library."""
+    index = incar_core.PotcarIndex(args.index) if args.index else incar_core.get_potcar_index()
+    if args.library:
+        for root in args.library:
+            symbols = index.index_library(root)
+            print(f'{len(symbols)} POTCARs indexed from {root}')
+        # Indexing a library is rare enough to also drop the job folders that are gone
+        index.prune()
+        _save_potcar_index(index)
+        print(f'Index: {index.path}')
+        return 0
+
+    header = incar_core.find_poscar_header([os.path.join(args.dir, 'POSCAR'),
+                                            os.path.join(args.dir, '01', 'POSCAR')])
+    try:
+        entries, settings = incar_core.potcar_settings_in_dir(args.dir, header, index)
+    except (OSError, ValueError) as e:
+        print(f'Cannot read the POTCAR: {e}', file=sys.stderr)
+        return 1
+    _save_potcar_index(index)
+    if entries is None:
+        print(f'No POTCAR found in {args.dir}', file=sys.stderr)
+        return 1
+
+    width = max(len(entry.symbol) for entry in entries)
+    for entry in entries:
+        print(f'{entry.symbol:<{width}}  ENMAX = {entry.enmax:8.3f}  ZVAL = {entry.zval:6.3f}  ({entry.titel})')
+    print(f'\nENCUT  = {settings.encut}  (1.3 x the largest ENMAX, rounded up to 10 eV)')
+    if settings.nelect is not None:
+        print(f'NELECT = {settings.nelect:g}')
+        print(f'NBANDS = {settings.nbands}  (VASP default for ISPIN = 1)')
+    elif header is None:
+        print('No POSCAR: NELECT and NBANDS need the number of atoms.')
+    for error in settings.errors:
+        print(f'error: {error}', file=sys.stderr)
+    return 1 if settings.errors else 0
+
+
+def _add_parallel_arguments(parser, required):
+    parser.add_argument('-c', '--cores-per-node', type=int, required=required, default=None,
+                        help='MPI ranks per node' + ('' if required else '; also sets NCORE/KPAR/NPAR'))
+    parser.add_argument('-N', '--nodes', type=int, default=1, help='number of nodes (default: 1)')
+    parser.add_argument('--nkpts', type=int, default=None,
+                        help='irreducible k-points (default: estimated from the cell)')
+    parser.add_argument('--nbands', type=int, default=None,
+                        help='NBANDS (default: from the INCAR or estimated from the composition)')
+    parser.add_argument('--kspacing', type=float, default=None,
+                        help='k-point spacing in 1/Angstrom for the k-point estimate and KPOINTS '
+                             '(default: KSPACING of the task or INCAR, else 0.25)')
+
+
+def _add_potcar_argument(parser):
+    parser.add_argument('--potcar-encut', action='store_true',
+                        help="set ENCUT to 1.3 x the largest ENMAX of the folder's POTCAR "
+                             "and check its species order against the POSCAR")
+
+
+def _add_kpoints_arguments(parser):
+    parser.add_argument('-k', '--kpoints', action='store_true',
+                        help='also write a KPOINTS mesh from the same POSCAR (one k-point along '
+                             'the vacuum for dipole/workfunction slabs)')
+    parser.add_argument('--kpoints-style', choices=incar_core.KPOINTS_STYLES, default='Gamma',
+                        help='KPOINTS mesh type (default: Gamma)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='incar_gen',
+        description='Generate VASP INCAR files with the Q-robot task presets.'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p_generate = subparsers.add_parser('generate', help='generate INCAR in one folder')
+    p_generate.add_argument('tasks', nargs='+', help='task names, e.g. single dftu ispin')
+    p_generate.add_argument('--dir', default='.', help='job folder (default: current directory)')
+    _add_parallel_arguments(p_generate, required=False)
+    _add_kpoints_arguments(p_generate)
+    _add_potcar_argument(p_generate)
+    p_generate.set_defaults(func=cmd_generate)
+
+    p_batch = subparsers.add_parser('batch', help='generate INCARs for every POSCAR folder under ROOT')
+    p_batch.add_argument('root', help='project root directory to search')
+    p_batch.add_argument('tasks', nargs='+', help='task names, e.g. single dftu ispin')
+    p_batch.add_argument('-j', '--workers', type=int, default=None,
+                         help='worker processes (default: number of CPUs)')
+    p_batch.add_argument('--chunksize', type=int, default=None,
+                         help='folders handed to a worker at a time')
+    p_batch.add_argument('-q', '--quiet', action='store_true',
+                         help='only report failed folders')
+    p_batch.add_argument('--manifest', nargs='?', const='', default=None, metavar='FILE',
+                         help='record written INCARs in FILE (default: ROOT/%s) so that reruns '
+                              'skip unchanged ones without reading them' % incar_core.WRITE_MANIFEST)
+    _add_kpoints_arguments(p_batch)
+    _add_potcar_argument(p_batch)
+    p_batch.add_argument('--kspacing', type=float, default=None,
+                         help='k-point spacing in 1/Angstrom for KPOINTS '
+                              '(default: KSPACING of the task or INCAR, else 0.25)')
+    p_batch.set_defaults(func=cmd_batch)
+
+    p_edit = subparsers.add_parser('edit', help='apply the same edits to many existing INCARs')
+    p_edit.add_argument('targets', nargs='+',
+                        help='directories (searched for INCAR files) or glob patterns')
+    p_edit.add_argument('--set', dest='edits', action=_EditAction, metavar='TAG=VALUE',
+                        help='set a parameter (repeatable)')
+    p_edit.add_argument('--delete', dest='edits', action=_EditAction, metavar='TAG',
+                        help='remove a parameter (repeatable)')
+    p_edit.add_argument('--ncore', default=None,
+                        help='set NCORE, or remove it where IBRION is 5-8')
+    p_edit.add_argument('-n', '--dry-run', action='store_true',
+                        help='print a unified diff instead of writing')
+    p_edit.add_argument('-j', '--workers', type=int, default=None,
+                        help='I/O threads (default: 8 per CPU, at most 64)')
+    p_edit.add_argument('-q', '--quiet', action='store_true',
+                        help='do not list unchanged files')
+    p_edit.set_defaults(func=cmd_edit)
+
+    p_neb = subparsers.add_parser('neb', help='count IMAGES and check the image POSCARs of NEB jobs')
+    p_neb.add_argument('roots', nargs='+', help='NEB job folders or directories to search for them')
+    p_neb.add_argument('-j', '--workers', type=int, default=None,
+                       help='I/O threads (default: 8 per CPU, at most 64)')
+    p_neb.add_argument('-q', '--quiet', action='store_true',
+                       help='only report jobs with problems')
+    p_neb.set_defaults(func=cmd_neb)
+
+    p_validate = subparsers.add_parser('validate', help='check INCARs for conflicting parameters')
+    p_validate.add_argument('targets', nargs='+',
+                            help='directories (searched for INCAR files) or glob patterns')
+    p_validate.add_argument('--severity', choices=incar_core.SEVERITIES, default='warning',
+                            help='least severe findings to list (default: warning)')
+    p_validate.add_argument('-j', '--workers', type=int, default=None,
+                            help='I/O threads (default: 8 per CPU, at most 64)')
+    p_validate.set_defaults(func=cmd_validate)
+
+    p_parallel = subparsers.add_parser('parallel', help='recommend NCORE, KPAR and NPAR for a job')
+    p_parallel.add_argument('--dir', default='.', help='job folder (default: current directory)')
+    _add_parallel_arguments(p_parallel, required=True)
+    p_parallel.add_argument('-w', '--write', action='store_true',
+                            help="apply the plan to the folder's INCAR")
+    p_parallel.set_defaults(func=cmd_parallel)
+
+    p_potcar = subparsers.add_parser('potcar', help='ENCUT, NELECT and NBANDS from the POTCAR of a job')
+    p_potcar.add_argument('--dir', default='.', help='job folder (default: current directory)')
+    p_potcar.add_argument('--library', nargs='+', metavar='ROOT',
+                          help='index every POTCAR below these library roots instead')
+    p_potcar.add_argument('--index', default=None,
+                          help='index file (default: $INCAR_POTCAR_INDEX or ~/.cache/incar-gen/potcar_index.json)')
+    p_potcar.set_defaults(func=cmd_potcar)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # "incar-gen TASK ..." is short for "incar-gen generate TASK ..."
+    if argv and argv[0] not in COMMANDS and not argv[0].startswith('-'):
+        argv.insert(0, 'generate')
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
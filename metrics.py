@@ -0,0 +1,235 @@
+"""
+Request and phase timing for the INCAR Generator web interface.
+
+Collects per-route request counts, error counts, in-flight gauges and
+latency histograms, plus histograms for named internal phases (POSCAR
+lookup, parsing, DFT+U/MAGMOM derivation, rendering), and renders them in
+the Prometheus text format. No client library is needed.
+
+Recording a request costs two perf_counter() calls and a few dict updates
+under one lock. When disabled, the request hooks return at once and
+phase() hands out a shared no-op timer.
+
+Counters are kept per process: under a multi-worker server each worker
+reports its own numbers (the pid label tells them apart).
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds; +Inf is implied
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Bucketed observation counts with their sum (not thread-safe on its own)."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yield (upper bound label, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets + (None,), self.counts):
+            total += count
+            yield ('+Inf' if bound is None else repr(bound)), total
+
+
+class _PhaseTimer:
+    """Context manager that records its duration under a phase name."""
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class Metrics:
+    """Thread-safe store of request and phase metrics for one process."""
+
+    def __init__(self, prefix='incar', buckets=DEFAULT_BUCKETS, enabled=True):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._collectors = []
+        self.reset()
+
+    def reset(self):
+        """Drop all recorded values."""
+        with self._lock:
+            self._requests = {}   # (route, method, status) -> count
+            self._errors = {}     # (route, method) -> count
+            self._latency = {}    # (route, method) -> Histogram
+            self._in_flight = {}  # route -> gauge
+            self._phases = {}     # phase -> Histogram
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def request_started(self, route):
+        with self._lock:
+            self._in_flight[route] = self._in_flight.get(route, 0) + 1
+
+    def request_finished(self, route, method, status, duration, error=False):
+        key = (route, method)
+        with self._lock:
+            self._in_flight[route] = self._in_flight.get(route, 1) - 1
+            status_key = (route, method, status)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            if error:
+                self._errors[key] = self._errors.get(key, 0) + 1
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def observe_phase(self, name, duration):
+        with self._lock:
+            histogram = self._phases.get(name)
+            if histogram is None:
+                histogram = self._phases[name] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def phase(self, name):
+        """Return a context manager timing the enclosed block as phase name."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _PhaseTimer(self, name)
+
+    def add_collector(self, collect):
+        """Register collect(), returning [(name, type, help, [(labels dict, value)])], run on render."""
+        self._collectors.append(collect)
+
+    # ------------------------------------------------------------------
+    # Flask integration
+    # ------------------------------------------------------------------
+
+    def init_app(self, app):
+        """Time every request of a Flask app."""
+        from flask import g, request
+
+        @app.before_request
+        def _metrics_before():
+            if not self.enabled:
+                return
+            g._metrics_route = request.url_rule.rule if request.url_rule else '<unmatched>'
+            g._metrics_start = time.perf_counter()
+            self.request_started(g._metrics_route)
+
+        @app.after_request
+        def _metrics_after(response):
+            g._metrics_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def _metrics_teardown(exc):
+            start = g.pop('_metrics_start', None)
+            if start is None:
+                return
+            status = 500 if exc is not None else g.pop('_metrics_status', 500)
+            self.request_finished(g._metrics_route, request.method, status,
+                                  time.perf_counter() - start, error=status >= 500)
+
+    # ------------------------------------------------------------------
+    # Exposition
+    # ------------------------------------------------------------------
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        p = self.prefix
+        pid = os.getpid()
+        with self._lock:
+            requests = sorted(self._requests.items())
+            errors = sorted(self._errors.items())
+            in_flight = sorted(self._in_flight.items())
+            latency = sorted((k, list(h.cumulative()), h.sum, h.count) for k, h in self._latency.items())
+            phases = sorted((k, list(h.cumulative()), h.sum, h.count) for k, h in self._phases.items())
+
+        lines = [
+            f'# HELP {p}_http_requests_total Requests handled, by route, method and status.',
+            f'# TYPE {p}_http_requests_total counter',
+        ]
+        for (route, method, status), count in requests:
+            lines.append(f'{p}_http_requests_total{_labels(route=route, method=method, status=status, pid=pid)} {count}')
+
+        lines += [
+            f'# HELP {p}_http_request_errors_total Requests that failed with a 5xx status or an exception.',
+            f'# TYPE {p}_http_request_errors_total counter',
+        ]
+        for (route, method), count in errors:
+            lines.append(f'{p}_http_request_errors_total{_labels(route=route, method=method, pid=pid)} {count}')
+
+        lines += [
+            f'# HELP {p}_http_requests_in_flight Requests being handled right now.',
+            f'# TYPE {p}_http_requests_in_flight gauge',
+        ]
+        for route, count in in_flight:
+            lines.append(f'{p}_http_requests_in_flight{_labels(route=route, pid=pid)} {count}')
+
+        def histogram(name, help_text, rows, label_name):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, buckets, total, count in rows:
+                labels = dict(zip(label_name, key if isinstance(key, tuple) else (key,)), pid=pid)
+                for bound, cumulative in buckets:
+                    lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(**labels)} {total!r}')
+                lines.append(f'{name}_count{_labels(**labels)} {count}')
+
+        histogram(f'{p}_http_request_duration_seconds', 'Request latency, by route and method.',
+                  latency, ('route', 'method'))
+        histogram(f'{p}_phase_duration_seconds',
+                  'Time spent in internal phases (POSCAR lookup, parse, derivation, rendering).',
+                  phases, ('phase',))
+
+        for collect in self._collectors:
+            for name, metric_type, help_text, samples in collect():
+                lines.append(f'# HELP {p}_{name} {help_text}')
+                lines.append(f'# TYPE {p}_{name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{p}_{name}{_labels(**labels, pid=pid)} {value}')
+
+        return '\n'.join(lines) + '\n'
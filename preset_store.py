@@ -0,0 +1,253 @@
+"""
+Persistent store for user parameter presets, backed by SQLite.
+
+Each preset is a named set of INCAR parameters with an owner, a project
+and a category. Its tags are also kept one row per tag in preset_tags, so
+"presets with ISPIN = 2" is an index lookup rather than a scan of every
+parameter set. Presets are read on demand; an LRUCache keeps the recently
+used ones in memory.
+
+Each thread gets its own connection. The database runs in WAL mode, so
+several server workers can share one file. A change committed by another
+connection (another thread or worker process) is noticed through
+PRAGMA data_version and empties the cache.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+from incar_core import LRUCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS presets (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT NOT NULL,
+    owner       TEXT NOT NULL DEFAULT '',
+    project     TEXT NOT NULL DEFAULT '',
+    category    TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    params      TEXT NOT NULL,
+    created     REAL NOT NULL,
+    updated     REAL NOT NULL,
+    UNIQUE (owner, project, name)
+);
+CREATE INDEX IF NOT EXISTS presets_name ON presets (name);
+CREATE INDEX IF NOT EXISTS presets_category ON presets (category, name);
+
+CREATE TABLE IF NOT EXISTS preset_tags (
+    preset_id INTEGER NOT NULL REFERENCES presets (id) ON DELETE CASCADE,
+    tag       TEXT NOT NULL,
+    value     TEXT NOT NULL,
+    PRIMARY KEY (preset_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS preset_tags_tag ON preset_tags (tag, value);
+"""
+
+FIELDS = ('name', 'owner', 'project', 'category', 'description')
+
+
+def normalize_params(params):
+    """Return {TAG: value} with upper-case tags and whitespace-collapsed string values.
+
+    Raises ValueError for anything that cannot be written to an INCAR.
+    """
+    if not isinstance(params, dict) or not params:
+        raise ValueError('params must be a non-empty object of INCAR tags')
+    normalized = {}
+    for tag, value in params.items():
+        tag = str(tag).strip().upper()
+        if not tag or any(c.isspace() or c in '=#!' for c in tag):
+            raise ValueError(f'Invalid INCAR tag: {tag!r}')
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f'Value of {tag} must be a string or number')
+        normalized[tag] = ' '.join(str(value).split())
+    return normalized
+
+
+def _normalize_value(value):
+    return ' '.join(str(value).split())
+
+
+class PresetStore:
+    """CRUD and indexed queries over the presets of one SQLite file."""
+
+    def __init__(self, path, cache_size=1024):
+        self.path = str(path)
+        self.cache = LRUCache(maxsize=cache_size)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            db.execute('PRAGMA foreign_keys = ON')
+            self._local.db = db
+            self._local.data_version = None
+        return db
+
+    def _check_external_changes(self, db):
+        # data_version only moves when another connection commits
+        version = db.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._local.data_version:
+            if self._local.data_version is not None:
+                self.cache.clear()
+            self._local.data_version = version
+
+    def close(self):
+        """Close this thread's connection."""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    @staticmethod
+    def _to_dict(row):
+        preset = {key: row[key] for key in ('id',) + FIELDS + ('created', 'updated')}
+        preset['params'] = json.loads(row['params'])
+        return preset
+
+    # ------------------------------------------------------------------
+    # CRUD
+    # ------------------------------------------------------------------
+
+    def create(self, name, params, owner='', project='', category='', description=''):
+        """Add a preset and return it. Raises ValueError for invalid data or a duplicate name."""
+        name = str(name or '').strip()
+        if not name:
+            raise ValueError('A preset needs a name')
+        params = normalize_params(params)
+        now = time.time()
+        db = self._connect()
+        try:
+            with db:
+                cursor = db.execute(
+                    'INSERT INTO presets (name, owner, project, category, description, params, created, updated)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (name, str(owner), str(project), str(category), str(description),
+                     json.dumps(params), now, now))
+                preset_id = cursor.lastrowid
+                db.executemany('INSERT INTO preset_tags (preset_id, tag, value) VALUES (?, ?, ?)',
+                               [(preset_id, tag, value) for tag, value in params.items()])
+        except sqlite3.IntegrityError:
+            raise ValueError(f'A preset named {name!r} already exists for this owner and project')
+        return self.get(preset_id)
+
+    def get(self, preset_id):
+        """Return the preset with this id, or None."""
+        db = self._connect()
+        self._check_external_changes(db)
+        preset = self.cache.get(preset_id)
+        if preset is None:
+            row = db.execute('SELECT * FROM presets WHERE id = ?', (preset_id,)).fetchone()
+            if row is None:
+                return None
+            preset = self._to_dict(row)
+            self.cache.put(preset_id, preset)
+        # Callers get their own copy; the cached one stays untouched
+        return dict(preset, params=dict(preset['params']))
+
+    def get_many(self, preset_ids):
+        """Return {id: preset} for the ids that exist."""
+        presets = {}
+        for preset_id in preset_ids:
+            preset = self.get(preset_id)
+            if preset is not None:
+                presets[preset_id] = preset
+        return presets
+
+    def update(self, preset_id, **changes):
+        """Change name/owner/project/category/description/params; return the preset or None."""
+        unknown = set(changes) - set(FIELDS) - {'params'}
+        if unknown:
+            raise ValueError(f"Unknown preset fields: {', '.join(sorted(unknown))}")
+        columns, values = [], []
+        for field in FIELDS:
+            if field in changes:
+                value = str(changes[field] if changes[field] is not None else '').strip()
+                if field == 'name' and not value:
+                    raise ValueError('A preset needs a name')
+                columns.append(f'{field} = ?')
+                values.append(value)
+        params = normalize_params(changes['params']) if 'params' in changes else None
+        if params is not None:
+            columns.append('params = ?')
+            values.append(json.dumps(params))
+        columns.append('updated = ?')
+        values.append(time.time())
+
+        db = self._connect()
+        try:
+            with db:
+                cursor = db.execute(f"UPDATE presets SET {', '.join(columns)} WHERE id = ?",
+                                    values + [preset_id])
+                if cursor.rowcount == 0:
+                    return None
+                if params is not None:
+                    db.execute('DELETE FROM preset_tags WHERE preset_id = ?', (preset_id,))
+                    db.executemany('INSERT INTO preset_tags (preset_id, tag, value) VALUES (?, ?, ?)',
+                                   [(preset_id, tag, value) for tag, value in params.items()])
+        except sqlite3.IntegrityError:
+            raise ValueError('A preset with this name already exists for this owner and project')
+        finally:
+            self.cache.pop(preset_id)
+        return self.get(preset_id)
+
+    def delete(self, preset_id):
+        """Remove a preset; returns False if it did not exist."""
+        db = self._connect()
+        with db:
+            deleted = db.execute('DELETE FROM presets WHERE id = ?', (preset_id,)).rowcount
+        self.cache.pop(preset_id)
+        return bool(deleted)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def query(self, owner=None, project=None, category=None, name=None, tags=None,
+              limit=50, offset=0):
+        """Return (presets, total) matching all given filters, ordered by name.
+
+        name matches a prefix. tags maps TAG to a value (presets setting
+        TAG to that value) or to None (presets setting TAG at all).
+        """
+        where, args = [], []
+        for column, value in (('owner', owner), ('project', project), ('category', category)):
+            if value is not None:
+                where.append(f'{column} = ?')
+                args.append(value)
+        if name:
+            # Prefix match that can use the name index (no LIKE escaping issues)
+            where.append('name >= ? AND name < ?')
+            args += [name, name + '\U0010ffff']
+        for tag, value in (tags or {}).items():
+            if value is None:
+                where.append('id IN (SELECT preset_id FROM preset_tags WHERE tag = ?)')
+                args.append(str(tag).strip().upper())
+            else:
+                where.append('id IN (SELECT preset_id FROM preset_tags WHERE tag = ? AND value = ?)')
+                args += [str(tag).strip().upper(), _normalize_value(value)]
+        clause = f" WHERE {' AND '.join(where)}" if where else ''
+
+        db = self._connect()
+        self._check_external_changes(db)
+        total = db.execute(f'SELECT COUNT(*) FROM presets{clause}', args).fetchone()[0]
+        rows = db.execute(f'SELECT * FROM presets{clause} ORDER BY name, id LIMIT ? OFFSET ?',
+                          args + [max(0, int(limit)), max(0, int(offset))]).fetchall()
+        presets = []
+        for row in rows:
+            preset = self._to_dict(row)
+            self.cache.put(preset['id'], preset)
+            presets.append(dict(preset, params=dict(preset['params'])))
+        return presets, total
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM presets').fetchone()[0]
@@ -2,6 +2,10 @@
 """
 Q-robot INCAR Generator Launcher
 Simple script to start the web interface with helpful information
+
+Usage:
+    python3 run.py                                   # development server
+    python3 run.py --production --workers 4 --threads 8   # see serve.py
 """
 
 import os
@@ -12,6 +16,12 @@ import subprocess
 import time
 
 def main():
+    if '--production' in sys.argv[1:]:
+        # Multi-worker server; remaining options are passed on to serve.py
+        import serve
+        argv = [arg for arg in sys.argv[1:] if arg != '--production']
+        sys.exit(serve.main(argv))
+
     print("\n" + "="*60)
     print("🤖 Q-robot INCAR Generator - Web Interface")
     print("="*60)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Production server for the INCAR Generator web interface.
+
+Serves app.py with a pool of worker processes and threads instead of
+Flask's single development server. The app (task registry and
+task_config.json) is loaded once in the parent process before the
+workers are forked. On SIGTERM each worker stops reporting ready on
+/ready, finishes its in-flight requests and exits.
+
+Uses gunicorn where available (Linux/macOS), otherwise waitress
+(threads only, also on Windows); requirements.txt installs the one that
+fits the platform.
+
+Usage:
+    python3 serve.py --workers 4 --threads 8 --port 5001
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Make app.py importable when started from another directory
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def run_gunicorn(host, port, workers, threads, timeout, graceful_timeout):
+    """Run app:app under gunicorn with a preloaded application."""
+    from gunicorn.app.base import BaseApplication
+
+    import app as app_module
+
+    def post_worker_init(worker):
+        # Report "draining" on /ready as soon as the worker is asked to stop;
+        # gunicorn then lets in-flight requests finish within graceful_timeout
+        handle_exit = worker.handle_exit
+
+        def drain_and_exit(sig, frame):
+            app_module.mark_draining()
+            handle_exit(sig, frame)
+
+        worker.handle_exit = drain_and_exit
+        signal.signal(signal.SIGTERM, drain_and_exit)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+            self.cfg.set('timeout', timeout)
+            self.cfg.set('graceful_timeout', graceful_timeout)
+            self.cfg.set('post_worker_init', post_worker_init)
+
+        def load(self):
+            return app_module.app
+
+    Server().run()
+
+
+def run_waitress(host, port, threads, graceful_timeout):
+    """Run the app under waitress (one process, a pool of threads)."""
+    import _thread
+    from waitress import create_server
+
+    import app as app_module
+
+    server = create_server(app_module.app, host=host, port=port, threads=threads)
+
+    def stop_when_idle():
+        # Keep the event loop running until in-flight responses are sent
+        deadline = time.monotonic() + graceful_timeout
+        while time.monotonic() < deadline and any(
+                channel.requests or channel.total_outbufs_len
+                for channel in list(server.active_channels.values())):
+            time.sleep(0.1)
+        _thread.interrupt_main()
+
+    def drain_and_exit(sig, frame):
+        app_module.mark_draining()
+        server.accepting = False  # Stop taking new connections
+        threading.Thread(target=stop_when_idle, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain_and_exit)
+    print(f"Serving on http://{host}:{port} with {threads} threads")
+    server.run()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Run the INCAR Generator web interface in production mode.')
+    parser.add_argument('--host', default='0.0.0.0', help='address to bind (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=5001, help='port to bind (default: 5001)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (gunicorn only; default: number of CPUs)')
+    parser.add_argument('-t', '--threads', type=int, default=4,
+                        help='threads per worker (default: 4)')
+    parser.add_argument('--timeout', type=int, default=60,
+                        help='seconds before a stuck worker is restarted (default: 60)')
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds to finish in-flight requests on shutdown (default: 30)')
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress'], default='auto',
+                        help='server to use (default: gunicorn if installed, else waitress)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    server = args.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn'
+        except ImportError:
+            server = 'waitress'
+
+    try:
+        if server == 'gunicorn':
+            run_gunicorn(args.host, args.port, args.workers, args.threads,
+                         args.timeout, args.graceful_timeout)
+        else:
+            run_waitress(args.host, args.port, args.threads, args.graceful_timeout)
+    except ImportError as e:
+        print(f"Error: {e.name} is not installed. Run: pip install {e.name}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
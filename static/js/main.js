@@ -9,8 +9,64 @@ let currentParams = {};
 document.addEventListener('DOMContentLoaded', function() {
     initializeTaskCategories();
     loadStandardParameters();
+    initializeAutocomplete();
 });
 
+/**
+ * Suggest task names and INCAR tags while typing (served by /api/autocomplete)
+ */
+function initializeAutocomplete() {
+    const taskSearch = document.getElementById('taskSearch');
+    if (taskSearch) {
+        attachAutocomplete(taskSearch, 'taskSuggestions', 'task');
+        taskSearch.addEventListener('change', () => {
+            // Picking a suggestion selects the matching task button
+            const name = taskSearch.value.trim().toLowerCase();
+            const btn = Array.from(document.querySelectorAll('.task-btn'))
+                .find(b => b.textContent.toLowerCase() === name);
+            if (btn) {
+                if (!btn.classList.contains('active')) {
+                    btn.click();
+                }
+                taskSearch.value = '';
+            }
+        });
+    }
+    document.querySelectorAll('.param-key').forEach(input => {
+        attachAutocomplete(input, 'tagSuggestions', 'param');
+    });
+}
+
+/**
+ * Fill a datalist with autocomplete results for an input, debounced
+ */
+function attachAutocomplete(input, listId, kind) {
+    let timer = null;
+    input.setAttribute('list', listId);
+    input.setAttribute('autocomplete', 'off');
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (!query) {
+            return;
+        }
+        timer = setTimeout(() => {
+            fetch(`/api/autocomplete?kind=${kind}&q=${encodeURIComponent(query)}`)
+            .then(response => response.json())
+            .then(data => {
+                const list = document.getElementById(listId);
+                list.innerHTML = '';
+                (data.suggestions || []).forEach(suggestion => {
+                    const option = document.createElement('option');
+                    option.value = suggestion.target;
+                    list.appendChild(option);
+                });
+            })
+            .catch(error => console.error('Autocomplete error:', error));
+        }, 120);
+    });
+}
+
 /**
  * Initialize task categories with buttons
  */
@@ -111,6 +167,8 @@ function clearCategory(categoryName) {
         return btn && btn.dataset.category !== categoryName;
     });
     
+    updateParallelOptions();
+    
     // Clear task parameters display
     document.getElementById('taskParams').innerHTML = '<p class="info-text">Select tasks to see their parameters</p>';
 }
@@ -194,6 +252,18 @@ function selectTask(taskName, buttonElement, categoryName) {
                 }
             }
             
+            // NCORE and Parallel both set NCORE: only one of them at a time
+            const ncorePresets = ['NCORE', 'Parallel'];
+            if (ncorePresets.includes(taskName)) {
+                ncorePresets.forEach(task => {
+                    const btn = document.querySelector(`#btn-${task.toLowerCase()}`);
+                    if (task !== taskName && btn && btn.classList.contains('active')) {
+                        btn.classList.remove('active');
+                        selectedTasks = selectedTasks.filter(t => t !== task);
+                    }
+                });
+            }
+            
             // Special handling: if NCORE is selected and Frequency is active, unselect Frequency
             if (taskName === 'NCORE') {
                 const frequencyBtn = document.querySelector('#btn-frequency');
@@ -236,10 +306,62 @@ function selectTask(taskName, buttonElement, categoryName) {
         }
     }
     
+    // The NCORE/KPAR plan depends on the other tasks (hybrid, frequencies)
+    updateParallelOptions();
+    
     // Load task parameters for all selected tasks
     loadTaskParameters(selectedTasks);
 }
 
+/**
+ * Show the node layout inputs while Parallel is selected and refresh the plan
+ */
+function updateParallelOptions() {
+    const selected = selectedTasks.includes('Parallel');
+    document.getElementById('parallelOptions').hidden = !selected;
+    if (selected) {
+        calculateParallel();
+    } else {
+        window.parallelParams = null;
+    }
+}
+
+/**
+ * Plan NCORE/KPAR/NPAR from the POSCAR, the selected tasks and the node layout
+ */
+function calculateParallel() {
+    const summary = document.getElementById('parallelSummary');
+    fetch('/api/plan-parallel', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            cores_per_node: document.getElementById('coresPerNode').value,
+            nodes: document.getElementById('nodeCount').value,
+            tasks: selectedTasks
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            console.log('✓ Parallel settings planned:', data);
+            // Only the tags to set (NPAR is null: it follows from NCORE)
+            window.parallelParams = {};
+            Object.entries(data.params).forEach(([tag, value]) => {
+                if (value !== null) {
+                    window.parallelParams[tag] = value;
+                }
+            });
+            summary.textContent = `NCORE = ${data.NCORE}, KPAR = ${data.KPAR}, NPAR = ${data.NPAR} on ${data.cores} cores`;
+            summary.title = data.notes.join('\n');
+        } else {
+            window.parallelParams = null;
+            summary.textContent = 'Preset values used: ' + data.error;
+            summary.title = '';
+        }
+    })
+    .catch(error => console.log('Parallel planning not available:', error));
+}
+
 /**
  * Auto-calculate DFT+U parameters from POSCAR
  */
@@ -300,6 +422,9 @@ function calculateNEBImages() {
             console.log('✓ NEB IMAGES calculated:', data.IMAGES);
             // Store calculated IMAGES value
             window.nebImages = data.IMAGES;
+            if (data.errors && data.errors.length > 0) {
+                console.warn('NEB image folders are inconsistent:\n' + data.errors.join('\n'));
+            }
         } else {
             console.log('Could not auto-calculate NEB IMAGES:', data.error);
         }
@@ -499,6 +624,7 @@ function addCustomParam() {
         <button class="btn-remove" onclick="removeCustomParam(this)">✕</button>
     `;
     container.appendChild(newRow);
+    attachAutocomplete(newRow.querySelector('.param-key'), 'tagSuggestions', 'param');
 }
 
 /**
@@ -556,6 +682,11 @@ function generateINCAR() {
             customParams['MAGMOM'] = window.magmomValue;
         }
         
+        // Add the planned NCORE/KPAR if available
+        if (window.parallelParams && selectedTasks.includes('Parallel')) {
+            Object.assign(customParams, window.parallelParams);
+        }
+        
         // Add auto-calculated NEB IMAGES if available
         if (window.nebImages && selectedTasks.includes('NEB')) {
             customParams['IMAGES'] = window.nebImages;
@@ -630,11 +761,33 @@ function displayINCAR(data) {
         <strong>Parameters:</strong> ${data.param_count} | 
         <strong>Lines:</strong> ${data.incar_content.split('\n').length}
     `;
+    showValidation(stats, data.validation || []);
     
     downloadBtn.disabled = false;
 }
 
 
+/**
+ * List the errors and warnings of the INCAR rules below the preview stats
+ */
+function showValidation(container, findings) {
+    const problems = findings.filter(f => f.severity === 'error' || f.severity === 'warning');
+    if (problems.length === 0) {
+        return;
+    }
+    const list = document.createElement('ul');
+    list.className = 'validation-list';
+    problems.forEach(finding => {
+        const item = document.createElement('li');
+        item.className = 'validation-' + finding.severity;
+        item.textContent = `${finding.severity}: ${finding.message}`;
+        item.title = finding.rule;
+        list.appendChild(item);
+    });
+    container.appendChild(list);
+}
+
+
 /**
  * Download INCAR file
  */
@@ -703,6 +856,7 @@ function resetForm() {
     document.querySelectorAll('.task-btn').forEach(btn => {
         btn.classList.remove('active');
     });
+    updateParallelOptions();
     
     // Uncheck all sections
     document.querySelectorAll('.param-section input[type="checkbox"]').forEach(checkbox => {
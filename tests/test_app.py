@@ -0,0 +1,287 @@
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+pytest.importorskip('flask')
+
+import app as app_module
+import incar_core
+from test_incar_core import POSCAR
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'PRESET_DB', str(tmp_path / 'presets.db'))
+    monkeypatch.setattr(app_module, '_preset_store', None)
+    monkeypatch.setattr(app_module, 'POSCAR_CACHE', incar_core.LRUCache(maxsize=4))
+    monkeypatch.setattr(app_module, 'INCAR_CACHE', incar_core.LRUCache(maxsize=16))
+    return app_module.app.test_client()
+
+
+def generate(client, custom_params, tasks=('Single',), **headers):
+    return client.post('/api/generate-incar', headers=headers, json={
+        'tasks': list(tasks), 'include_sections': {'d_elec': True}, 'custom_params': custom_params})
+
+
+# ---------------------------------------------------------------------------
+# POSCAR endpoints
+# ---------------------------------------------------------------------------
+
+def test_poscar_analysis_is_parsed_once_and_follows_edits(client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'POSCAR').write_text(POSCAR)
+    assert client.post('/api/read-poscar').json['element_counts'] == {'Fe': 5, 'O': 1}
+    assert client.post('/api/calculate-dftu').json['LDAUL'] == '2  -1'
+    assert app_module.POSCAR_CACHE.stats()['hits'] == 1
+
+    (tmp_path / 'POSCAR').write_text(POSCAR.replace('2 1 3', '2 1 30'))
+    assert client.post('/api/read-poscar').json['total_atoms'] == 33
+
+
+def tar_of(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, text in files.items():
+            data = text.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_upload_analyzes_files_and_archive_members(client):
+    archive = tar_of({'a/POSCAR': POSCAR, 'b/POSCAR': 'garbage\n', 'b/INCAR': 'ENCUT = 400\n'})
+    response = client.post('/api/upload-poscar', content_type='multipart/form-data', data={
+        'files': [(io.BytesIO(POSCAR.encode()), 'POSCAR'), (io.BytesIO(archive), 'jobs.tar.gz')]})
+    assert response.status_code == 200
+    structures = {s['name']: s for s in response.json['structures']}
+    assert sorted(structures) == ['POSCAR', 'jobs.tar.gz:a/POSCAR', 'jobs.tar.gz:b/POSCAR']
+    assert structures['jobs.tar.gz:a/POSCAR']['MAGMOM'] == '2*3.0  1*0.0  3*3.0'
+    assert not structures['jobs.tar.gz:b/POSCAR']['success']
+
+
+def test_upload_reads_a_raw_tar_body(client):
+    response = client.post('/api/upload-poscar', data=tar_of({'job/CONTCAR': POSCAR}),
+                           content_type='application/gzip')
+    assert response.json['count'] == 1
+    assert response.json['structures'][0]['element_counts'] == {'Fe': 5, 'O': 1}
+
+
+def test_upload_without_structures_is_rejected(client):
+    assert client.post('/api/upload-poscar').status_code == 400
+    response = client.post('/api/upload-poscar', data=b'PK\x03\x04broken', content_type='application/zip')
+    assert response.status_code == 400
+    assert 'Invalid archive' in response.json['error']
+
+
+# ---------------------------------------------------------------------------
+# generate-incar cache and ETags
+# ---------------------------------------------------------------------------
+
+def test_custom_tags_are_upper_cased_and_override(client):
+    response = generate(client, {'encut': ' 520 '})
+    content = response.json['incar_content']
+    assert 'ENCUT = 520' in content
+    assert 'ENCUT = 450' not in content
+    assert 'encut' not in content
+
+
+def test_equivalent_requests_share_one_cache_entry(client):
+    first = generate(client, {'encut': '520'}, tasks=['Single', 'single'])
+    second = generate(client, {'ENCUT': ' 520'}, tasks=[' SINGLE '])
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert app_module.INCAR_CACHE.stats()['size'] == 1
+    assert app_module.INCAR_CACHE.stats()['hits'] == 1
+
+
+def test_matching_if_none_match_gets_a_304(client):
+    etag = generate(client, {'ENCUT': '520'}).headers['ETag']
+    cached = generate(client, {'Encut': '520'}, **{'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag
+    assert generate(client, {'ENCUT': '500'}, **{'If-None-Match': etag}).status_code == 200
+
+
+# ---------------------------------------------------------------------------
+# generate-incar-batch
+# ---------------------------------------------------------------------------
+
+def test_batch_streams_a_zip_with_one_folder_per_config(client):
+    response = client.post('/api/generate-incar-batch', json={'configs': [
+        {'name': 'fe o', 'tasks': ['DFT+U', 'ISPIN'], 'poscar': POSCAR},
+        {'name': 'fe o', 'tasks': ['Single'], 'custom_params': {'encut': '520'}},
+    ]})
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['fe_o/INCAR', 'fe_o_2/INCAR']
+    structured = archive.read('fe_o/INCAR').decode()
+    assert 'LDAUL = 2 -1' in structured
+    assert 'MAGMOM = 2*3.0 1*0.0 3*3.0' in structured
+    assert 'ENCUT = 520' in archive.read('fe_o_2/INCAR').decode()
+
+
+@pytest.mark.parametrize('config', [
+    {'tasks': 'Single'},
+    {'tasks': [1]},
+    {'tasks': ['Single'], 'custom_params': ['ENCUT']},
+    {'tasks': ['Single'], 'include_sections': 'd_elec'},
+    {'tasks': ['Single'], 'poscar': 3},
+    {'tasks': ['Single'], 'poscar': 'garbage'},
+])
+def test_batch_rejects_bad_configs_before_streaming(client, config):
+    response = client.post('/api/generate-incar-batch', json={'configs': [dict(config, name='job')]})
+    assert response.status_code == 400
+    assert response.json['error'].startswith('job:')
+
+
+# ---------------------------------------------------------------------------
+# Autocomplete
+# ---------------------------------------------------------------------------
+
+def test_autocomplete_filters_by_kind(client):
+    response = client.get('/api/autocomplete?q=ispi&kind=param&limit=3')
+    assert response.json['suggestions'][0]['text'] == 'ISPIN'
+    assert all(s['kind'] == 'tag' for s in response.json['suggestions'])
+    response = client.get('/api/autocomplete?q=dft%2Bu&kind=task')
+    assert response.json['suggestions'][0] == {'text': 'DFT+U', 'kind': 'preset', 'target': 'DFT+U', 'score': 1.0}
+    assert client.get('/api/autocomplete?q=x&kind=nope').status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# Task parameters in request bodies
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('url', ['/api/plan-parallel', '/api/generate-kpoints'])
+@pytest.mark.parametrize('body, error', [
+    ({'tasks': [1]}, 'tasks must be a list of task names'),
+    ({'tasks': 'Single'}, 'tasks must be a list of task names'),
+    ({'tasks': ['Single'], 'custom_params': ['ENCUT']}, 'custom_params must be an object'),
+    (['Single'], 'Expected a JSON object'),
+])
+def test_structure_endpoints_reject_badly_typed_tasks(client, url, body, error):
+    if isinstance(body, dict):
+        body = dict(body, poscar=POSCAR, cores_per_node=8)
+    response = client.post(url, json=body)
+    assert response.status_code == 400
+    assert response.json['error'] == error
+
+
+# ---------------------------------------------------------------------------
+# task_config.json reload
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def task_config(tmp_path):
+    saved = app_module.TASK_STATE
+    path = tmp_path / 'task_config.json'
+    yield path, app_module.TaskConfigWatcher(path)
+    app_module.install_task_state(saved)
+
+
+def test_reload_installs_a_changed_config(client, task_config):
+    path, watcher = task_config
+    generation = app_module.TASK_STATE.generation
+    path.write_text(json.dumps({'Tasks': {'Relax': {'params': {'NSW': '200'}}}}))
+    assert watcher.reload()
+    assert app_module.TASK_STATE.generation == generation + 1
+    response = client.post('/api/task-params', json={'task': 'relax'})
+    assert response.json['params'] == {'NSW': '200'}
+
+
+def test_invalid_config_keeps_the_previous_one(client, task_config, capsys):
+    path, watcher = task_config
+    state = app_module.TASK_STATE
+    path.write_text(json.dumps({'Tasks': {'Relax': {'params': {'BAD TAG': '1'}}}}))
+    assert not watcher.reload()
+    assert app_module.TASK_STATE is state
+    assert 'invalid INCAR tag' in watcher.last_error
+    assert 'keeping the previous task configuration' in capsys.readouterr().err
+
+
+# ---------------------------------------------------------------------------
+# User presets
+# ---------------------------------------------------------------------------
+
+def test_preset_crud_and_tag_filters(client):
+    created = client.post('/api/presets', json={'name': 'Fe spin', 'params': {'ISPIN': '2', 'LDAU': 'T'},
+                                                'owner': 'ana', 'project': 'oxides'})
+    assert created.status_code == 201
+    preset_id = created.json['id']
+    client.post('/api/presets', json={'name': 'Gas', 'params': {'ISMEAR': '0'}, 'owner': 'ana'})
+
+    listed = client.get('/api/presets?owner=ana&tag=ISPIN=2&tag=LDAU').json
+    assert [p['name'] for p in listed['presets']] == ['Fe spin'] and listed['total'] == 1
+    assert client.get('/api/presets?owner=ana&per_page=1&page=2').json['pages'] == 2
+
+    updated = client.put(f'/api/presets/{preset_id}', json={'params': {'ISPIN': '1'}})
+    assert updated.json['params'] == {'ISPIN': '1'}
+    assert client.get('/api/presets?tag=LDAU').json['total'] == 0
+    assert client.delete(f'/api/presets/{preset_id}').json == {'success': True}
+    assert client.get(f'/api/presets/{preset_id}').status_code == 404
+
+
+def test_presets_merge_under_custom_params(client):
+    preset_id = client.post('/api/presets', json={'name': 'Cutoff', 'params': {'ENCUT': '600', 'NSW': '0'}}).json['id']
+    response = client.post('/api/generate-incar', json={
+        'tasks': ['Single'], 'include_sections': {'d_elec': True}, 'presets': [preset_id],
+        'custom_params': {'ENCUT': '520'}})
+    content = response.json['incar_content']
+    assert 'ENCUT = 520' in content and 'ENCUT = 600' not in content
+    assert 'NSW = 0' in content
+    assert client.post('/api/generate-incar', json={'tasks': [], 'presets': [999]}).status_code == 400
+
+
+@pytest.mark.parametrize('body', [[1, 2], 'preset', 3])
+def test_presets_reject_non_object_bodies(client, body):
+    assert client.post('/api/presets', json=body).status_code == 400
+    assert client.put('/api/presets/1', json=body).status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# Parallel plan
+# ---------------------------------------------------------------------------
+
+def test_plan_parallel_for_a_posted_poscar(client):
+    response = client.post('/api/plan-parallel', json={
+        'poscar': POSCAR, 'cores_per_node': 16, 'nodes': 2, 'nkpts': 8, 'tasks': ['ISPIN']})
+    assert response.status_code == 200
+    assert (response.json['KPAR'], response.json['NCORE']) == (8, 2)
+    assert response.json['params'] == {'KPAR': '8', 'NCORE': '2', 'NPAR': None}
+
+
+def test_plan_parallel_rejects_an_unknown_species_label(client):
+    response = client.post('/api/plan-parallel', json={
+        'poscar': POSCAR.replace('Fe O Fe\n', 'Fe Xx Fe\n'), 'cores_per_node': 8})
+    assert response.status_code == 400
+    assert response.json['error'] == "unknown element 'Xx'"
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+def test_metrics_endpoint_reports_routes_and_caches(client, monkeypatch):
+    generate(client, {})
+    text = client.get('/metrics').data.decode()
+    assert 'route="/api/generate-incar",method="POST",status="200"' in text
+    assert 'incar_phase_duration_seconds_count{phase="render"' in text
+    assert 'incar_cache_misses_total{cache="incar"' in text
+    monkeypatch.setattr(app_module.METRICS, 'enabled', False)
+    assert client.get('/metrics').status_code == 404
+
+
+# ---------------------------------------------------------------------------
+# Production server
+# ---------------------------------------------------------------------------
+
+def test_ready_reports_503_while_draining(client, monkeypatch):
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.json['checks'] == {'task_registry': True, 'task_config': True, 'templates': True}
+    monkeypatch.setitem(app_module.SERVER_STATE, 'draining', True)
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert response.json['status'] == 'unavailable'
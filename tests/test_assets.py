@@ -0,0 +1,77 @@
+import pytest
+
+flask = pytest.importorskip('flask')
+
+from assets import IMMUTABLE_MAX_AGE, AssetStore, init_assets
+
+STYLE = 'body { color: #333; }\n' * 100
+
+
+@pytest.fixture
+def site(tmp_path):
+    (tmp_path / 'static' / 'css').mkdir(parents=True)
+    (tmp_path / 'static' / 'css' / 'style.css').write_text(STYLE)
+    (tmp_path / 'static' / '.hidden').write_text('secret')
+    (tmp_path / 'secret.txt').write_text('secret')
+    app = flask.Flask(__name__, static_folder=str(tmp_path / 'static'))
+    stores = init_assets(app, {'static': AssetStore(tmp_path / 'static', 'static')})
+
+    @app.route('/page')
+    def page():
+        return flask.render_template_string("{{ asset_url('css/style.css') }}")
+
+    return app, stores['static']
+
+
+def test_fingerprinted_urls_are_immutable(site):
+    app, store = site
+    client = app.test_client()
+    url = client.get('/page').get_data(as_text=True)
+    assert url == f"/static/{store.assets['css/style.css'].fingerprinted_name}"
+    response = client.get(url)
+    assert response.get_data(as_text=True) == STYLE
+    assert response.cache_control.immutable and response.cache_control.public
+    assert response.cache_control.max_age == IMMUTABLE_MAX_AGE
+
+
+def test_plain_urls_revalidate_with_an_etag(site):
+    client = site[0].test_client()
+    response = client.get('/static/css/style.css')
+    assert response.cache_control.no_cache
+    assert response.headers['ETag'] and response.last_modified
+    again = client.get('/static/css/style.css', headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_gzip_variant_has_its_own_etag(site):
+    import gzip
+    client = site[0].test_client()
+    plain = client.get('/static/css/style.css')
+    response = client.get('/static/css/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()).decode() == STYLE
+    assert response.headers['ETag'] != plain.headers['ETag']
+
+
+@pytest.mark.parametrize('debug', [False, True])
+@pytest.mark.parametrize('path', ['/static/missing.css', '/static/.hidden', '/static/../secret.txt',
+                                  '/static/css/../../secret.txt'])
+def test_unknown_hidden_and_outside_files_are_404(site, debug, path):
+    app = site[0]
+    app.debug = debug
+    assert app.test_client().get(path).status_code == 404
+
+
+def test_debug_mode_picks_up_edited_files(site, tmp_path):
+    app, store = site
+    app.debug = True
+    client = app.test_client()
+    old_url = client.get('/page').get_data(as_text=True)
+    (tmp_path / 'static' / 'css' / 'style.css').write_text('body { color: red; }\n')
+    new_url = client.get('/page').get_data(as_text=True)
+    assert new_url != old_url
+    assert client.get(new_url).get_data(as_text=True) == 'body { color: red; }\n'
+    stale = client.get(old_url)
+    assert stale.get_data(as_text=True) == 'body { color: red; }\n'
+    assert not stale.cache_control.immutable
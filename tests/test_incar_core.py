@@ -0,0 +1,689 @@
+import builtins
+import os
+import threading
+import time
+
+import pytest
+
+import incar_core
+
+POSCAR = """Fe O Fe test
+1.0
+  5.0 0.0 0.0
+  0.0 5.0 0.0
+  0.0 0.0 5.0
+Fe O Fe
+2 1 3
+Direct
+"""
+
+
+def potcar_text(*datasets):
+    """A POTCAR with (symbol, ENMAX, ZVAL) dataset headers and a little filler data."""
+    text = ''
+    for symbol, enmax, zval in datasets:
+        text += (f'  PAW_PBE {symbol} 06Sep2000\n {zval:.10f}\n parameters from PSCTR are:\n'
+                 f'   TITEL  = PAW_PBE {symbol} 06Sep2000\n'
+                 f'   POMASS =   50.000; ZVAL   =   {zval:.3f}    mass and valenz\n'
+                 f'   ENMAX  =  {enmax:.3f}; ENMIN  =  200.000 eV\n'
+                 f' Description\n' + '  0.1 0.2 0.3\n' * 100 + ' End of Dataset\n')
+    return text
+
+
+def make_job(path, poscar=POSCAR, potcar=None):
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'POSCAR').write_text(poscar)
+    if potcar is not None:
+        (path / 'POTCAR').write_text(potcar)
+    return str(path)
+
+
+@pytest.fixture
+def potcar_index(tmp_path, monkeypatch):
+    """Point the shared PotcarIndex at a private file."""
+    monkeypatch.setenv('INCAR_POTCAR_INDEX', str(tmp_path / 'potcar_index.json'))
+    monkeypatch.setattr(incar_core, '_potcar_index', None)
+
+
+# ---------------------------------------------------------------------------
+# POSCAR header
+# ---------------------------------------------------------------------------
+
+def test_poscar_header_reads_species_blocks_in_order():
+    header = incar_core.parse_poscar_header(POSCAR.encode().splitlines(True))
+    assert header.elements == ['Fe', 'O', 'Fe']
+    assert header.counts == [2, 1, 3]
+    assert header.element_counts() == {'Fe': 5, 'O': 1}
+    assert header.coordinates == 'Direct'
+
+
+def test_vasp4_poscar_takes_species_from_the_potcar(tmp_path):
+    job = tmp_path / 'job'
+    make_job(job, POSCAR.replace('Fe O Fe\n2 1 3', '2 3'),
+             potcar_text(('Fe_pv', 293.238, 14.0), ('O', 400.0, 6.0)))
+    assert incar_core.read_poscar_header(str(job / 'POSCAR')).elements == ['Fe', 'O']
+
+
+@pytest.mark.parametrize('scale, lattice_b, line', [
+    ('', '0.0 5.0 0.0', 2),
+    ('abc', '0.0 5.0 0.0', 2),
+    ('1.0', '0.0 5.0', 4),
+])
+def test_malformed_poscar_header_names_the_line(scale, lattice_b, line):
+    text = POSCAR.replace('1.0\n', f'{scale}\n', 1).replace('0.0 5.0 0.0', lattice_b)
+    with pytest.raises(ValueError, match=f'line {line}'):
+        incar_core.parse_poscar_header(text.splitlines())
+
+
+def test_scale_line_may_carry_a_comment():
+    header = incar_core.parse_poscar_header(POSCAR.replace('1.0\n', '1.0 ! scale\n', 1).splitlines())
+    assert header.scale == [1.0]
+
+
+# ---------------------------------------------------------------------------
+# MAGMOM and DFT+U
+# ---------------------------------------------------------------------------
+
+def test_magmom_follows_poscar_site_order():
+    header = incar_core.parse_poscar_header(POSCAR.splitlines())
+    # Fe, O and Fe again: the second Fe block keeps its place after O
+    assert incar_core.magmom_from_header(header) == '2*3.0  1*0.0  3*3.0'
+
+
+def test_magmom_override_splits_a_run():
+    header = incar_core.parse_poscar_header(POSCAR.splitlines())
+    assert incar_core.magmom_from_header(header, {0: -5.0}) == '1*-5.0  1*3.0  1*0.0  3*3.0'
+
+
+def test_magmom_moments_replace_the_defaults():
+    header = incar_core.parse_poscar_header(POSCAR.splitlines())
+    assert incar_core.magmom_from_header(header, moments={'O': 0.5}) == '2*3.0  1*0.5  3*3.0'
+
+
+def test_build_magmom_without_numpy_matches(monkeypatch):
+    fe, o = incar_core.atomic_numbers['Fe'], incar_core.atomic_numbers['O']
+    numbers = [fe] * 1000 + [o] * 2000 + [fe] * 3
+    overrides = {1500: 1.0, 1001: 0.0}
+    expected = '1000*3.0  500*0.0  1*1.0  1499*0.0  3*3.0'
+    assert incar_core.build_magmom(numbers, overrides) == expected
+
+    real_import = builtins.__import__
+
+    def no_numpy(name, *args, **kwargs):
+        if name == 'numpy':
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', no_numpy)
+    assert incar_core.build_magmom(numbers, overrides) == expected
+
+
+def test_dftu_params_use_species_in_order_of_first_appearance():
+    header = incar_core.parse_poscar_header(POSCAR.splitlines())
+    assert incar_core.dftu_params(header.elements)['LDAUL'] == '2  -1'
+
+
+# ---------------------------------------------------------------------------
+# Batch generation
+# ---------------------------------------------------------------------------
+
+def test_find_poscar_dirs_reports_neb_jobs_once(tmp_path):
+    make_job(tmp_path / 'bulk')
+    for image in ('00', '01', '02'):
+        make_job(tmp_path / 'neb' / image)
+    make_job(tmp_path / '.hidden')
+    assert incar_core.find_poscar_dirs(str(tmp_path)) == [str(tmp_path / 'bulk'), str(tmp_path / 'neb')]
+
+
+def test_batch_generate_on_a_process_pool(tmp_path):
+    folders = [make_job(tmp_path / f'job{i}') for i in range(6)]
+    seen = []
+    results = incar_core.batch_generate(str(tmp_path), ['ispin'], workers=2, chunksize=2,
+                                        progress=lambda done, total, folder, error: seen.append((done, total)))
+    assert sorted(r.folder for r in results) == folders
+    assert all(r.error is None and r.written for r in results)
+    assert seen[-1] == (6, 6)
+    for folder in folders:
+        with open(os.path.join(folder, 'INCAR')) as f:
+            assert 'MAGMOM = 2*3.0  1*0.0  3*3.0' in f.read()
+
+
+def test_batch_rejects_unknown_tasks(tmp_path):
+    make_job(tmp_path / 'job')
+    with pytest.raises(ValueError, match='nosuchtask'):
+        incar_core.batch_generate(str(tmp_path), ['nosuchtask'], workers=1)
+
+
+def test_batch_reports_a_malformed_poscar_as_an_error(tmp_path):
+    good = make_job(tmp_path / 'a')
+    bad = make_job(tmp_path / 'b', poscar='garbage\nfoo\n')
+    results = {r.folder: r for r in incar_core.batch_generate(str(tmp_path), ['ispin'], workers=1)}
+    assert results[good].error is None
+    assert any('MAGMOM' in message for message in results[good].messages)
+    assert 'Malformed POSCAR' in results[bad].error
+    assert not os.path.exists(os.path.join(bad, 'INCAR'))
+
+
+# ---------------------------------------------------------------------------
+# Task registry
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def registry():
+    return incar_core.build_task_registry({'Surface': {'Slab': {'params': {'IDIPOL': 3}}}})
+
+
+@pytest.mark.parametrize('name', ['dftu', 'DFT+U', 'dft-u', 'd_cal_dftu'])
+def test_registry_resolves_names_display_names_and_aliases(registry, name):
+    assert registry.lookup(name).key == 'd_cal_dftu'
+
+
+def test_registry_holds_task_config_presets_read_only(registry):
+    entry = registry.find_display('slab')
+    assert registry.by_category['Surface'] == (entry,)
+    assert entry.params == {'IDIPOL': 3}
+    with pytest.raises(TypeError):
+        entry.params['IDIPOL'] = 1
+    assert registry.lookup('nosuchtask') is None
+
+
+# ---------------------------------------------------------------------------
+# build_incar
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def restore_standard_incar():
+    saved = {section: dict(params) for section, params in incar_core.standard_incar.items()}
+    yield
+    incar_core.standard_incar.clear()
+    incar_core.standard_incar.update(saved)
+
+
+def test_build_incar_leaves_module_tables_untouched(restore_standard_incar):
+    header = incar_core.parse_poscar_header(POSCAR.splitlines())
+    before = {section: dict(params) for section, params in incar_core.standard_incar.items()}
+    result = incar_core.build_incar(['ispin', 'freq'], header=header)
+    assert result['standard']['d_elec']['ISPIN'] == '2'
+    assert 'd_ncore' not in result['standard']
+    assert incar_core.standard_incar == before
+    assert dict(incar_core.get_task_registry().by_name['ispin'].params) == {'ISPIN': '2'}
+
+
+def test_build_incar_does_not_depend_on_analyze_tasks(tmp_path, monkeypatch, restore_standard_incar):
+    monkeypatch.chdir(tmp_path)
+    incar_core.analyze_tasks(['freq'])
+    incar_core.standard_incar['d_elec']['ENCUT'] = '999'
+    result = incar_core.build_incar(['single'])
+    assert result['standard']['d_ncore'] == {'NCORE': '8'}
+    assert 'ENCUT = 450' in result['content']
+
+
+def test_build_incar_rejects_two_vdw_types():
+    with pytest.raises(ValueError, match='vdW'):
+        incar_core.build_incar(['vdwd3zero', 'vdwd3bj'])
+
+
+# ---------------------------------------------------------------------------
+# IncarDocument
+# ---------------------------------------------------------------------------
+
+def test_incar_document_edits_exact_tags_only():
+    doc = incar_core.IncarDocument('NCORE = 4\nLDAUU = 5 0\nLDAU = .TRUE.  # DFT+U\nLREAL = Auto\n')
+    doc.set('ldau', '.FALSE.')
+    doc.delete('LREAL')
+    doc.set('KPAR', '2')
+    text = doc.render()
+    assert 'LDAUU = 5 0\n' in text
+    assert 'ldau = .FALSE. # DFT+U\n' in text
+    assert 'LREAL' not in text
+    assert text.endswith('KPAR = 2\n')
+
+
+def test_incar_document_keeps_untouched_lines_verbatim():
+    text = 'ENCUT=520   ! cutoff\nISMEAR = 0; SIGMA = 0.05\n'
+    doc = incar_core.IncarDocument(text)
+    doc.set('ENCUT', '520')
+    assert doc.render() == text
+    doc.set('SIGMA', '0.1')
+    assert doc.render() == 'ENCUT=520   ! cutoff\nISMEAR = 0; SIGMA = 0.1\n'
+
+
+def test_incar_document_round_trips_quoted_values():
+    text = 'SYSTEM = "Fe; O # slab ! test"  # comment\nISMEAR = 0; SIGMA = 0.05\n'
+    doc = incar_core.IncarDocument(text)
+    assert doc.params() == {'SYSTEM': '"Fe; O # slab ! test"', 'ISMEAR': '0', 'SIGMA': '0.05'}
+    doc.set('ISMEAR', '1')
+    assert doc.render() == text.replace('ISMEAR = 0', 'ISMEAR = 1')
+    doc.set('SIGMA', '0.2')
+    doc.set('SYSTEM', '"a; b"')
+    assert doc.render() == 'SYSTEM = "a; b" # comment\nISMEAR = 1; SIGMA = 0.2\n'
+
+
+def test_incar_document_write_skips_unchanged_files(tmp_path):
+    path = str(tmp_path / 'INCAR')
+    doc = incar_core.IncarDocument('ENCUT = 520\n')
+    assert doc.write(path)
+    assert not incar_core.IncarDocument.read(path).write(path)
+
+
+# ---------------------------------------------------------------------------
+# NEB jobs
+# ---------------------------------------------------------------------------
+
+def make_neb(path, images=5, poscars=None):
+    for i in range(images):
+        make_job(path / f'{i:02d}', (poscars or {}).get(i, POSCAR))
+    return str(path)
+
+
+def test_neb_jobs_are_found_and_counted(tmp_path):
+    good = make_neb(tmp_path / 'reactions' / 'a')
+    make_neb(tmp_path / 'reactions' / 'b' / 'sub', images=3)
+    make_job(tmp_path / 'reactions' / 'bulk')
+    assert incar_core.find_neb_jobs(str(tmp_path)) == [good, str(tmp_path / 'reactions' / 'b' / 'sub')]
+    assert incar_core.count_neb_images(good) == 3
+    assert incar_core.count_neb_images(str(tmp_path / 'reactions' / 'bulk')) is None
+
+
+def test_neb_check_reports_every_image_problem(tmp_path):
+    good = make_neb(tmp_path / 'good')
+    bad = make_neb(tmp_path / 'bad', poscars={2: POSCAR.replace('2 1 3', '2 1 4'), 3: 'garbage\n'})
+    (tmp_path / 'bad' / '01' / 'POSCAR').unlink()
+    (tmp_path / 'bad' / '04').rename(tmp_path / 'bad' / '05')
+    checks = incar_core.check_neb_jobs([good, bad], workers=4)
+    assert checks[0].ok and checks[0].images == 3 and checks[0].counts == [2, 1, 3]
+    errors = '\n'.join(checks[1].errors)
+    assert 'missing: 04' in errors
+    assert '01/POSCAR: not found' in errors
+    assert '02/POSCAR: Fe2 O1 Fe4 differs from 00/POSCAR: Fe2 O1 Fe3' in errors
+    assert '03/POSCAR: Malformed POSCAR' in errors
+
+
+# ---------------------------------------------------------------------------
+# Bulk INCAR edits
+# ---------------------------------------------------------------------------
+
+def make_incars(tmp_path, texts):
+    paths = []
+    for i, text in enumerate(texts):
+        (tmp_path / f'job{i}').mkdir()
+        path = tmp_path / f'job{i}' / 'INCAR'
+        path.write_text(text)
+        paths.append(str(path))
+    return paths
+
+
+def test_bulk_edit_dry_run_reports_diffs_without_writing(tmp_path):
+    paths = make_incars(tmp_path, ['IBRION = 2\nLREAL = Auto\n', 'IBRION = 5\nNCORE = 4\n'])
+    results = incar_core.bulk_edit_incars(paths, [('LREAL', None)], ncore='8', dry_run=True, workers=2)
+    assert [(path, changed) for path, changed, _, _ in results] == [(paths[0], True), (paths[1], True)]
+    assert '-LREAL = Auto' in results[0][2] and '+NCORE = 8' in results[0][2]
+    assert '-NCORE = 4' in results[1][2]  # no NCORE for finite differences
+    with open(paths[0]) as f:
+        assert f.read() == 'IBRION = 2\nLREAL = Auto\n'
+
+    incar_core.bulk_edit_incars(paths, [('LREAL', None)], ncore='8')
+    with open(paths[0]) as f:
+        assert f.read() == 'IBRION = 2\nNCORE = 8\n'
+
+
+def test_bulk_edit_reports_progress_as_files_complete(tmp_path, monkeypatch):
+    paths = make_incars(tmp_path, ['ENCUT = 400\n', 'ENCUT = 400\n'])
+    second_done = threading.Event()
+    edit = incar_core.edit_incar_file
+
+    def slow_first(path, *args):
+        if path == paths[0]:
+            second_done.wait(5)
+        return edit(path, *args)
+
+    monkeypatch.setattr(incar_core, 'edit_incar_file', slow_first)
+    reported = []
+
+    def progress(result):
+        reported.append(result[0])
+        if result[0] == paths[1]:
+            second_done.set()
+
+    results = incar_core.bulk_edit_incars(paths, [('ENCUT', '520')], workers=2, progress=progress)
+    assert reported == [paths[1], paths[0]]
+    assert [result[0] for result in results] == paths
+
+
+@pytest.mark.parametrize('config, error', [
+    ({}, 'non-empty'),
+    ({'Tasks': []}, 'must map task names'),
+    ({'Tasks': {'Relax': {'NSW': '0'}}}, 'Tasks/Relax: expected an object'),
+    ({'Tasks': {'Relax': {'params': {'NSW': None}}}}, 'value of NSW'),
+])
+def test_validate_task_config_names_the_problem(config, error):
+    with pytest.raises(ValueError, match=error):
+        incar_core.validate_task_config(config)
+
+
+# ---------------------------------------------------------------------------
+# Suggestions
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def suggestions():
+    return incar_core.SuggestionIndex([('dftu', 'task', 'dftu'), ('DFT+U', 'task', 'dftu'),
+                                       ('ispin', 'task', 'ispin'), ('ISPIN', 'tag', 'ISPIN'),
+                                       ('ISMEAR', 'tag', 'ISMEAR'), ('ENCUT', 'tag', 'ENCUT')])
+
+
+def test_suggest_finds_typos_once_per_target(suggestions):
+    assert [(s.text, s.target) for s in suggestions.suggest('dfut')] == [('dftu', 'dftu')]
+    assert suggestions.suggest('xyz') == []
+
+
+def test_complete_prefers_prefixes_then_fuzzy_matches(suggestions):
+    assert [s.text for s in suggestions.complete('is', kinds=('tag',))] == ['ISPIN', 'ISMEAR']
+    completed = suggestions.complete('encu', limit=2)
+    assert completed[0] == incar_core.Suggestion('ENCUT', 'tag', 'ENCUT', 1.0)
+    assert [s.text for s in suggestions.complete('ecnut')] == ['ENCUT']
+
+
+def test_unknown_task_names_get_did_you_mean():
+    assert incar_core.did_you_mean('dfut') == ['dftu']
+
+
+# ---------------------------------------------------------------------------
+# INCAR rules
+# ---------------------------------------------------------------------------
+
+def test_rules_fire_only_when_every_condition_holds():
+    rules = incar_core.get_rule_set()
+    findings = rules.check({'lhfcalc': '.TRUE.', 'ALGO': 'Fast', 'LDAU': 'T'})
+    assert [(f.severity, f.rule) for f in findings] == [('error', 'hybrid-algo'), ('warning', 'ldau-without-u')]
+    assert findings[0].message.startswith('ALGO = Fast does not work with LHFCALC = .TRUE.')
+    assert rules.check({'LHFCALC': 'T', 'ALGO': 'Damped', 'LDAU': 'T', 'LDAUU': '5 0'}) == []
+
+
+def test_check_layers_reports_overrides_and_task_conflicts():
+    findings = incar_core.get_rule_set().check_layers([
+        ('standard', 'standard', {'ISMEAR': '0', 'NCORE': '8'}),
+        ('task', 'DOS', {'ISMEAR': '-5'}),
+        ('task', 'Freq', {'ISMEAR': '0', 'IBRION': '5'}),
+    ])
+    assert [(f.severity, f.rule) for f in findings] == [
+        ('error', 'finite-differences-ncore'), ('warning', 'task-conflict'), ('info', 'override')]
+
+
+def test_rule_set_rejects_rules_without_an_anchor():
+    with pytest.raises(ValueError, match='must be set'):
+        incar_core.RuleSet([incar_core.IncarRule('x', 'error', {'NCORE': incar_core.MISSING}, '')])
+
+
+def test_parse_incar_params_matches_the_document_model():
+    text = 'SYSTEM = "Fe; O # slab"  # note\nISMEAR = 0; SIGMA = 0.05 ! smearing\nismear = 1\n'
+    assert incar_core.parse_incar_params(text) == incar_core.IncarDocument(text).params()
+    assert incar_core.parse_incar_params(text)['ISMEAR'] == '1'
+
+
+def test_audit_reports_progress_as_files_complete(tmp_path, monkeypatch):
+    paths = make_incars(tmp_path, ['LHFCALC = T\nALGO = Fast\n', 'ISMEAR = 0\n', 'ISMEAR = 0\n'])
+    last_done = threading.Event()
+    validate = incar_core.validate_incar_file
+
+    def slow_first(path, *args):
+        if path == paths[0]:
+            last_done.wait(5)
+        return validate(path, *args)
+
+    monkeypatch.setattr(incar_core, 'validate_incar_file', slow_first)
+    reported = []
+
+    def progress(result):
+        reported.append(result[0])
+        if len(reported) == 2:
+            last_done.set()
+
+    results = incar_core.audit_incar_files(paths, workers=3, progress=progress)
+    assert reported[-1] == paths[0]
+    assert [path for path, _, _ in results] == paths
+    assert [f.rule for f in results[0][1]] == ['hybrid-algo']
+
+
+# ---------------------------------------------------------------------------
+# Skip-if-unchanged writes
+# ---------------------------------------------------------------------------
+
+def test_write_if_changed_leaves_identical_files_alone(tmp_path):
+    path = str(tmp_path / 'INCAR')
+    written, stamp = incar_core.write_if_changed(path, 'ENCUT = 520\n')
+    assert written
+    os.chmod(path, 0o600)
+    os.utime(path, ns=(1, 1))
+    assert incar_core.write_if_changed(path, 'ENCUT = 520\n')[0] is False
+    assert os.stat(path).st_mtime_ns == 1
+
+    assert incar_core.write_if_changed(path, 'ENCUT = 500\n')[0]
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert [name for name in os.listdir(tmp_path)] == ['INCAR']
+
+
+def test_batch_manifest_skips_unchanged_incars_without_reading_them(tmp_path, monkeypatch):
+    folders = [make_job(tmp_path / f'job{i}') for i in range(3)]
+    manifest = str(tmp_path / incar_core.WRITE_MANIFEST)
+    results = incar_core.batch_generate(folders, ['single'], workers=1, manifest=manifest)
+    assert all(r.written for r in results)
+    assert sorted(incar_core.load_write_manifest(manifest)) == [os.path.join(f, 'INCAR') for f in folders]
+
+    opened = []
+    real_open = builtins.open
+
+    def tracking_open(path, *args, **kwargs):
+        opened.append(os.path.basename(str(path)))
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, 'open', tracking_open)
+    results = incar_core.batch_generate(folders, ['single'], workers=1, manifest=manifest)
+    assert not any(r.written for r in results)
+    assert 'INCAR' not in opened
+
+    # A hand-edited INCAR of the same size no longer matches its stamp and is regenerated
+    with real_open(os.path.join(folders[0], 'INCAR'), 'r+') as f:
+        text = f.read()
+        f.seek(0)
+        f.write(text.replace('NSW = 0', 'NSW = 9'))
+    os.utime(os.path.join(folders[0], 'INCAR'), ns=(2, 2))
+    results = incar_core.batch_generate(folders, ['single'], workers=1, manifest=manifest)
+    assert [r.written for r in results] == [True, False, False]
+
+
+# ---------------------------------------------------------------------------
+# Caches
+# ---------------------------------------------------------------------------
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    cache = incar_core.LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['hits'] == 3
+
+
+def test_lru_cache_coalesces_concurrent_misses():
+    cache = incar_core.LRUCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    owner = threading.Thread(target=cache.get_or_compute, args=('key', compute))
+    owner.start()
+    started.wait(5)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+    waiter.start()
+    for _ in range(500):
+        if cache.stats()['coalesced']:
+            break
+        time.sleep(0.01)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert results == ['value']
+    assert len(calls) == 1
+
+
+# ---------------------------------------------------------------------------
+# Parallel plan
+# ---------------------------------------------------------------------------
+
+def header():
+    return incar_core.parse_poscar_header(POSCAR.splitlines())
+
+
+def test_estimate_nbands_counts_magnetic_systems_wider():
+    assert incar_core.estimate_valence('Fe') == 8
+    assert incar_core.estimate_nbands(46, 6) == 27
+    assert incar_core.estimate_nbands(46, 6, ispin=2) == 30
+
+
+def test_estimate_valence_rejects_unknown_elements():
+    with pytest.raises(ValueError, match="unknown element 'Xx'"):
+        incar_core.estimate_valence('Xx')
+
+
+def test_plan_parallel_rounds_nbands_up_to_npar():
+    plan = incar_core.plan_parallel(header(), 16, nodes=2, nkpts=8)
+    assert (plan.kpar, plan.ncore, plan.npar, plan.cores) == (8, 2, 2, 32)
+    assert plan.params == {'KPAR': '8', 'NCORE': '2', 'NPAR': None}
+    assert plan.nbands == 28 and plan.nbands % plan.npar == 0
+
+
+@pytest.mark.parametrize('incar', [{'LHFCALC': 'T'}, {'IBRION': '5'}])
+def test_plan_parallel_uses_ncore_1_for_hybrids_and_finite_differences(incar):
+    plan = incar_core.plan_parallel(header(), 16, nkpts=4, incar=incar)
+    assert plan.ncore == 1
+    assert plan.params['NCORE'] == '1'
+
+
+def test_plan_parallel_rejects_an_empty_machine():
+    with pytest.raises(ValueError, match='at least 1'):
+        incar_core.plan_parallel(header(), 0)
+
+
+# ---------------------------------------------------------------------------
+# POTCAR metadata
+# ---------------------------------------------------------------------------
+
+FE_O = POSCAR.replace('Fe O Fe\n2 1 3', 'Fe O\n2 3')
+
+
+def test_potcar_settings_from_enmax_and_zval(tmp_path):
+    job = make_job(tmp_path / 'job', FE_O, potcar_text(('Fe_pv', 293.238, 14.0), ('O', 400.0, 6.0)))
+    index = incar_core.PotcarIndex(str(tmp_path / 'index.json'))
+    entries, settings = incar_core.potcar_settings_in_dir(job, incar_core.read_poscar_header(
+        os.path.join(job, 'POSCAR')), index)
+    assert [entry.symbol for entry in entries] == ['Fe_pv', 'O']
+    assert settings.encut == 520  # 1.3 x 400, rounded up to 10 eV
+    assert settings.nelect == 2 * 14 + 3 * 6
+    assert settings.errors == []
+
+
+@pytest.mark.parametrize('label, element', [
+    ('Fe_pv', 'Fe'), ('Fe_pv/2a3c', 'Fe'), ('Fe1', 'Fe'), ('H.75', 'H'), ('H1.25', 'H'), ('O_s', 'O')])
+def test_species_name_is_the_element(label, element):
+    assert incar_core._species_name(label) == element
+
+
+def test_pseudo_hydrogen_matches_h_species(tmp_path):
+    job = make_job(tmp_path / 'job', POSCAR.replace('Fe O Fe\n2 1 3', 'Ga H H\n1 1 1'),
+                   potcar_text(('Ga_d', 282.691, 13.0), ('H.75', 250.0, 0.75), ('H1.25', 250.0, 1.25)))
+    assert incar_core.read_potcar_species(os.path.join(job, 'POTCAR')) == ['Ga', 'H', 'H']
+    index = incar_core.PotcarIndex(str(tmp_path / 'index.json'))
+    entries, settings = incar_core.potcar_settings_in_dir(job, incar_core.read_poscar_header(
+        os.path.join(job, 'POSCAR')), index)
+    assert settings.errors == []
+    assert settings.nelect == 15
+
+
+def test_potcar_index_reuses_scanned_files(tmp_path):
+    job = make_job(tmp_path / 'job', potcar=potcar_text(('Fe', 267.883, 8.0)))
+    index = incar_core.PotcarIndex(str(tmp_path / 'index.json'))
+    index.entries(os.path.join(job, 'POTCAR'))
+    assert index.save()
+    reloaded = incar_core.PotcarIndex(str(tmp_path / 'index.json'))
+    reloaded.entries(os.path.join(job, 'POTCAR'))
+    assert reloaded.scans == 0
+    assert not reloaded.dirty
+
+
+def test_potcar_index_save_checks_only_new_folders(tmp_path, monkeypatch):
+    potcar = potcar_text(('Fe', 267.883, 8.0))
+    old, gone, new = (os.path.join(make_job(tmp_path / name, potcar=potcar), 'POTCAR')
+                      for name in ('old', 'gone', 'new'))
+    index = incar_core.PotcarIndex(str(tmp_path / 'index.json'))
+    index.entries(old)
+    index.entries(gone)
+    index.save()
+    os.remove(gone)
+
+    checked = []
+    isfile = os.path.isfile
+    monkeypatch.setattr(os.path, 'isfile', lambda path: checked.append(path) or isfile(path))
+    reloaded = incar_core.PotcarIndex(str(tmp_path / 'index.json'))
+    reloaded.entries(new)
+    reloaded.save()
+    assert checked == [os.path.realpath(new)]
+    assert os.path.realpath(gone) in reloaded.files
+
+    reloaded.prune()
+    reloaded.save()
+    assert os.path.realpath(gone) not in incar_core.PotcarIndex(str(tmp_path / 'index.json'))._read_file()['files']
+
+
+def test_potcar_encut_is_opt_in(tmp_path, potcar_index):
+    job = make_job(tmp_path / 'job', FE_O, potcar_text(('Fe_pv', 293.238, 14.0), ('O', 400.0, 6.0)))
+    assert 'ENCUT = 450' in incar_core.build_incar_in_dir(job, ['single'])['content']
+
+    result = incar_core.build_incar_in_dir(job, ['single'], potcar=True)
+    assert 'ENCUT = 520' in result['content']
+    assert result['potcar'].nelect == 46
+    assert 'potcar-encut' in [finding.rule for finding in result['validation']]
+
+
+def test_potcar_species_order_is_a_validation_error(tmp_path, potcar_index):
+    job = make_job(tmp_path / 'job', FE_O, potcar_text(('O', 400.0, 6.0), ('Fe_pv', 293.238, 14.0)))
+    result = incar_core.build_incar_in_dir(job, ['single'], potcar=True)
+    errors = [finding for finding in result['validation'] if finding.rule == 'potcar-order']
+    assert errors and errors[0].severity == 'error'
+
+
+# ---------------------------------------------------------------------------
+# KPOINTS
+# ---------------------------------------------------------------------------
+
+def test_kpoints_spacing_falls_back_to_the_incar():
+    assert incar_core.kpoints_for(header()).mesh == [6, 6, 6]
+    kpoints = incar_core.kpoints_for(header(), {'KSPACING': '0.5'})
+    assert (kpoints.kspacing, kpoints.mesh) == (0.5, [3, 3, 3])
+    assert incar_core.kpoints_for(header(), {'KSPACING': '0.5'}, kspacing=0.25).mesh == [6, 6, 6]
+    assert 'KSPACING = 0.5' in incar_core.plan_parallel(header(), 16, incar={'KSPACING': '0.5'}).notes[0]
+
+
+def test_kpoints_for_slabs_and_molecules():
+    slab = incar_core.kpoints_for(header(), {'IDIPOL': '3'}, style='monkhorst')
+    assert (slab.style, slab.mesh) == ('Monkhorst-Pack', [6, 6, 1])
+    assert incar_core.kpoints_for(header(), {'IDIPOL': '4'}).mesh == [1, 1, 1]
+    with pytest.raises(ValueError, match='Unknown KPOINTS style'):
+        incar_core.kpoints_for(header(), style='x')
+
+
+def test_build_input_set_follows_the_generated_incar(tmp_path, monkeypatch):
+    monkeypatch.setattr(incar_core, '_task_registry', incar_core.TaskRegistry(
+        dict(incar_core.tasks_incar, d_cal_coarseslab={'IDIPOL': '3', 'KSPACING': '0.5'})))
+    result = incar_core.build_input_set(make_job(tmp_path / 'job'), ['coarseslab'])
+    assert result['kpoints'].mesh == [3, 3, 1]
+    assert result['kpoints_content'].splitlines()[3] == '  3 3 1'
+    assert incar_core.build_input_set(str(tmp_path / 'empty'), ['single'])['kpoints'] is None
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import incar_core
+import incar_gen
+from test_incar_core import POSCAR, make_job
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_launcher_does_not_import_flask_or_ase(tmp_path):
+    job = make_job(tmp_path / 'job')
+    code = ("import runpy, sys; sys.argv = ['incar-gen', 'ispin', '--dir', %r]\n"
+            "try:\n    runpy.run_path(%r, run_name='__main__')\n"
+            "except SystemExit as e:\n    assert e.code == 0, e.code\n"
+            "print(sorted(m for m in ('flask', 'ase') if m in sys.modules))"
+            % (job, os.path.join(ROOT, 'incar-gen')))
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.splitlines()[-1] == '[]'
+    with open(os.path.join(job, 'INCAR')) as f:
+        assert 'ISPIN = 2' in f.read()
+
+
+def test_task_names_alone_mean_generate(tmp_path, capsys):
+    job = make_job(tmp_path / 'job')
+    assert incar_gen.main(['single', '--dir', job]) == 0
+    assert 'INCAR written to' in capsys.readouterr().out
+    assert incar_gen.main(['single', '--dir', job]) == 0
+    assert 'INCAR unchanged' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('command', [['generate', 'single', '-c', '8'], ['parallel', '-c', '8']])
+def test_unknown_species_label_is_an_error_not_a_traceback(tmp_path, capsys, command):
+    job = make_job(tmp_path / 'job', POSCAR.replace('Fe O Fe\n', 'Fe Xx Fe\n'))
+    assert incar_gen.main(command + ['--dir', job]) == 2
+    assert "unknown element 'Xx'" in capsys.readouterr().err
+
+
+def test_kspacing_defaults_to_the_task_or_incar(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(incar_core, '_task_registry', incar_core.TaskRegistry(
+        dict(incar_core.tasks_incar, d_cal_coarse={'KSPACING': '0.5'})))
+    job = make_job(tmp_path / 'job')
+    assert incar_gen.main(['generate', 'coarse', '--kpoints', '--dir', job]) == 0
+    with open(os.path.join(job, 'KPOINTS')) as f:
+        assert f.read().splitlines()[3] == '  3 3 3'
+    assert incar_gen.main(['generate', 'coarse', '--kpoints', '--kspacing', '0.25', '--dir', job]) == 0
+    with open(os.path.join(job, 'KPOINTS')) as f:
+        assert f.read().splitlines()[3] == '  6 6 6'
+
+    capsys.readouterr()
+    assert incar_gen.main(['parallel', '-c', '8', '--dir', job]) == 0
+    assert '(KSPACING = 0.5)' in capsys.readouterr().out
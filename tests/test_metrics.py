@@ -0,0 +1,40 @@
+import pytest
+
+from metrics import Histogram, Metrics
+
+
+def test_histogram_counts_are_cumulative():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert list(histogram.cumulative()) == [('0.1', 2), ('1.0', 3), ('+Inf', 4)]
+    assert histogram.sum == pytest.approx(3.65)
+
+
+def test_requests_and_phases_are_rendered_per_route():
+    flask = pytest.importorskip('flask')
+    app = flask.Flask(__name__)
+    metrics = Metrics(buckets=(1.0,))
+    metrics.init_app(app)
+
+    @app.route('/item/<int:number>')
+    def item(number):
+        with metrics.phase('lookup'):
+            if number == 0:
+                flask.abort(500)
+            return str(number)
+
+    client = app.test_client()
+    client.get('/item/1')
+    client.get('/item/2')
+    client.get('/item/0')
+    text = metrics.render()
+    assert 'incar_http_requests_total{route="/item/<int:number>",method="GET",status="200"' in text
+    assert 'incar_http_request_errors_total{route="/item/<int:number>",method="GET"' in text
+    assert 'incar_http_requests_in_flight{route="/item/<int:number>"' in text
+    assert 'incar_phase_duration_seconds_count{phase="lookup"' in text
+
+    metrics.reset()
+    metrics.enabled = False
+    client.get('/item/1')
+    assert 'route=' not in metrics.render()